@@ -43,8 +43,8 @@ All metadata
 '''
 import pandas as pd
 import numpy as np
-import re
 from collections import defaultdict, Counter
+from histogram_schema import HistogramSchema
 
 class ModelFeatures(object):
     '''
@@ -66,26 +66,16 @@ class ModelFeatures(object):
     @staticmethod
     def get_top_colors(raw_df):
         '''
-        Gah. A big boy function.
+        Top 10 hue bins (as floats) across the given scenes, by
+        duration-weighted votes on the scenes' top_color_* columns
         '''
+        color_columns = HistogramSchema.get(raw_df.columns).names['top_color']
+
         ## Convert colors strings to floats
         df = raw_df.copy()
         df.reset_index(inplace=True)
-        col_names = df.columns
-        for col in col_names:
-            matches = re.search('top_color_', col)
-            if matches:
-                #df[col] = df[col].apply(lambda x: try: float(x.split('_')[-1]) except: '')
-                df[col] = df[col].apply(ModelFeatures.try_split)
-
-        ## Find column names with colors
-        color_columns = []
-        col_names = df.columns
-        for col in col_names:
-            matches = re.search('top_color_', col)
-            if matches:
-                color_columns.append(col)
-        sorted(color_columns)
+        for col in color_columns:
+            df[col] = df[col].apply(ModelFeatures.try_split)
 
         top_color_cntr = Counter()
         points = 10
@@ -102,6 +92,21 @@ class ModelFeatures(object):
             top_colors.append(k)
         return top_colors
 
+    @staticmethod
+    def get_summed_colors(raw_df):
+        '''
+        Top 10 hue bins (as floats) across the given scenes by pixel
+        count, adding up the scenes' summed hue histograms (hue_bin_*
+        columns, see ColorSummary). Empty for scene dataframes written
+        without them.
+        '''
+        hue_columns = HistogramSchema.get(raw_df.columns).names['hue']
+        if not hue_columns:
+            return []
+        sums = raw_df[hue_columns].values.sum(axis=0, dtype=np.uint64)
+        order = np.argsort(-sums.astype(np.float64), kind='mergesort')[:10]
+        return [ModelFeatures.try_split(hue_columns[i]) for i in order]
+
     @staticmethod
     def _weighted_avg(values, weights):
         '''
@@ -125,6 +130,9 @@ class ModelFeatures(object):
         top_colors = ModelFeatures.get_top_colors(action_df)
         for i, color in enumerate(top_colors):
             feature_df['color_' + str(i)] = color
+        summed_colors = ModelFeatures.get_summed_colors(action_df)
+        for i, color in enumerate(summed_colors):
+            feature_df['summed_color_' + str(i)] = color
 
         '''
         Editing analysis
@@ -19,6 +19,12 @@ bucket_name = os.getenv('S3-BUCKET')
 conn = boto.connect_s3(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
 bucket = conn.get_bucket(bucket_name)
 
+# Optional scene cut threshold. Scenes are re-split from the stored scene
+# change scores, so no video needs to be decoded again.
+threshold = None
+if len(sys.argv) > 1:
+    threshold = float(sys.argv[1])
+
 # Get list of files in video processing directory
 path = '../data/'
 files = [f for f in listdir(path) if isfile(join(path, f))]
@@ -36,11 +42,16 @@ for v_id in id_list:
     print v_id  # Keep track of progress
     flow_pkl_path = join(path, v_id + '.flow.pkl')
     quality_pkl_path = join(path, v_id + '.img_quality.pkl')
+    motion_pkl_path = join(path, v_id + '.motion.pkl')
     f_df = pd.read_pickle(flow_pkl_path)
     q_df = pd.read_pickle(quality_pkl_path)
+    # Videos extracted before the motion table was added have none
+    m_df = None
+    if isfile(motion_pkl_path):
+        m_df = pd.read_pickle(motion_pkl_path)
 
     # Process the video's data, creating a single dataframe
-    v = VideoPostprocess(v_id, f_df, q_df)
+    v = VideoPostprocess(v_id, f_df, q_df, threshold=threshold, motion_df=m_df)
     v_df = v.to_df()
     v_df.to_pickle("../scene_analysis_results/" + v_id + ".analysis.pkl")
 
@@ -5,30 +5,19 @@ import boto
 import sys
 import os
 from boto.s3.key import Key
-import re
 from os import listdir
 from os.path import isfile, join
 from video_feature_extraction import VideoFeatureExtraction
+from extraction_cache import ExtractionCache
 
+## Local store of extraction results, keyed by video content and
+## extractor settings/code, and its size limit
+CACHE_DIR = '../extraction_cache/'
+CACHE_MAX_BYTES = 20 * 1024 ** 3
 
-def list_completed_videos():
-    """
-    Helper to find files that have already been analyzed
-
-    Args:
-        none
-    Returns:
-        List of file names that have already been analyzed
-    """
-    completed_files = []
-    path = '../code/'
-    files_completed = [f for f in listdir(path) if isfile(join(path, f))]
-    for f in files_completed:
-        matches = re.search('(\S+)\.flow\.pkl', f)
-        if matches:
-            v_id = matches.groups(0)[0]
-            completed_files.append(v_id)
-    return completed_files
+## Per-video chunks of partly extracted videos, so a restarted worker
+## resumes where it stopped
+CHECKPOINT_DIR = '../extraction_checkpoints/'
 
 
 if __name__ == '__main__':
@@ -44,8 +33,9 @@ if __name__ == '__main__':
     path = '../videos_to_process/'
     files = [f for f in listdir(path) if isfile(join(path, f))]
 
-    # Get list of files that have already been processed
-    videos_completed = list_completed_videos()
+    # Videos that have already been processed (even under another name)
+    # are loaded from the cache instead of being decoded again
+    cache = ExtractionCache(CACHE_DIR, max_bytes=CACHE_MAX_BYTES)
 
     # Run video feature extraction on each file
     feature_extractor = VideoFeatureExtraction()
@@ -53,22 +43,21 @@ if __name__ == '__main__':
         # Get video from filename
         video_id = f.split('.')[0]
 
-        # Skip to next if video has already been processed
-        if video_id in videos_completed:
-            print "-I- Video already processed"
-            continue
-
         video_path = join(path, f)
         # Run the extractor. This saves file in a pickle, so not capturing
         # returned dataframes.
-        feature_extractor.run(video_id, video_path)
+        feature_extractor.run(video_id, video_path, cache=cache,
+                              checkpoint_dir=join(CHECKPOINT_DIR, video_id))
 
         # Save pickled dataframes to S3
         pkl_dir = "/home/ubuntu/code/"
         img_quality_file_path = pkl_dir + '/' + str(video_id) + \
                                 '.img_quality.pkl'
         flow_file_path = pkl_dir + '/' + str(video_id) + '.flow.pkl'
+        motion_file_path = pkl_dir + '/' + str(video_id) + '.motion.pkl'
         os.system('s3cmd put ' + img_quality_file_path + ' s3://' +
                   bucket_name + '/' + 'img_quality/')
         os.system('s3cmd put ' + flow_file_path + ' s3://' + bucket_name +
                   '/' + 'flow/')
+        os.system('s3cmd put ' + motion_file_path + ' s3://' + bucket_name +
+                  '/' + 'motion/')
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+from frame_analysis import FrameAnalysis
+from histogram_schema import HistogramSchema
+
+
+class ColorSummary(object):
+    """
+    Summed hue/saturation/value histograms of a set of frames, plus the
+    number of frames.
+
+    Summaries combine by adding their vectors, so a scene, a whole video or
+    a corpus can be summarised from the summaries of its parts without
+    going back to the frames. Top colours and average saturation/value are
+    computed from the vector in O(bins).
+
+    Counts are kept as uint32, which holds about 4e9 pixels per bin
+    (several minutes of 720p video). Sums that would not fit are kept as
+    uint64.
+    """
+
+    ## Histogram columns, as in the image quality dataframe
+    COLUMNS = FrameAnalysis.get_hsv_hist_columns(bw_mask=False)
+
+    def __init__(self, counts=None, num_frames=0):
+        """
+        Default constructor
+
+        ARGS:
+            counts: bin counts in the order of COLUMNS, or None for an
+                    empty summary
+            num_frames: number of frames summed
+        RETURNS:
+            None
+        """
+        if counts is None:
+            counts = np.zeros(len(ColorSummary.COLUMNS), dtype=np.uint32)
+        self.counts = ColorSummary._compact(np.asarray(counts, dtype=np.uint64))
+        self.num_frames = int(num_frames)
+
+    @staticmethod
+    def _compact(counts):
+        """
+        Store counts as uint32 if they fit
+
+        ARGS:
+            counts: uint64 array of counts
+        RETURNS:
+            uint32 or uint64 array
+        """
+        if len(counts) == 0 or counts.max() <= np.iinfo(np.uint32).max:
+            return counts.astype(np.uint32)
+        return counts
+
+    @staticmethod
+    def from_df(df):
+        """
+        Summarise the rows of a dataframe with the histogram columns:
+        frames of an image quality dataframe, or summaries written by
+        to_df (e.g. the scenes of a video)
+
+        ARGS:
+            df: dataframe with every COLUMNS column, and optionally
+                'num_frames' (otherwise each row is one frame)
+        RETURNS:
+            ColorSummary
+        """
+        schema = HistogramSchema.get(df.columns)
+        if schema.names['all'] != ColorSummary.COLUMNS:
+            raise ValueError("Dataframe does not have the histogram columns")
+        counts = schema.block(df).sum(axis=0, dtype=np.uint64)
+        if 'num_frames' in df.columns:
+            num_frames = df['num_frames'].sum()
+        else:
+            num_frames = len(df)
+        return ColorSummary(counts, num_frames)
+
+    def __add__(self, other):
+        return ColorSummary(self.counts.astype(np.uint64) + other.counts,
+                            self.num_frames + other.num_frames)
+
+    @staticmethod
+    def merge(summaries):
+        """
+        Combine summaries, e.g. those of every scene in a video
+
+        ARGS:
+            summaries: iterable of ColorSummary
+        RETURNS:
+            ColorSummary
+        """
+        total = ColorSummary()
+        for summary in summaries:
+            total = total + summary
+        return total
+
+    def _get_bins(self, hist):
+        """
+        Counts and bin start values of one histogram
+
+        ARGS:
+            hist: 'hue', 'sat' or 'val'
+        RETURNS:
+            Tuple of (column names, counts, bin values)
+        """
+        schema = HistogramSchema.get(ColorSummary.COLUMNS)
+        return (schema.names[hist], self.counts[schema.index[hist]].astype(np.float64),
+                schema.values[hist])
+
+    def get_top_colors(self, num_colors=10):
+        """
+        The hue bins with the most pixels. Ties go to the lower bin.
+
+        ARGS:
+            num_colors: number of bins to return
+        RETURNS:
+            List of hue column names, most common first
+        """
+        names, counts, _ = self._get_bins('hue')
+        order = np.argsort(-counts, kind='mergesort')[:num_colors]
+        return [names[i] for i in order]
+
+    def _get_avg(self, prefix):
+        """
+        Pixel-weighted average bin value of one histogram, NaN if empty
+        """
+        _, counts, values = self._get_bins(prefix)
+        total = counts.sum()
+        if total == 0:
+            return np.nan
+        return np.dot(counts, values) / total
+
+    def get_avg_saturation(self):
+        """
+        Average saturation over all pixels
+
+        ARGS:
+            None
+        RETURNS:
+            Float
+        """
+        return self._get_avg('sat')
+
+    def get_avg_value(self):
+        """
+        Average value (from HSV colorspace) over all pixels
+
+        ARGS:
+            None
+        RETURNS:
+            Float
+        """
+        return self._get_avg('val')
+
+    def to_df(self):
+        """
+        One-row dataframe with the counts under their column names and
+        'num_frames', which from_df reads back
+
+        ARGS:
+            None
+        RETURNS:
+            Dataframe
+        """
+        summary_df = pd.DataFrame(self.counts[np.newaxis], columns=ColorSummary.COLUMNS)
+        summary_df['num_frames'] = self.num_frames
+        return summary_df
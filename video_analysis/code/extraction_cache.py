@@ -0,0 +1,218 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import pandas as pd
+
+
+class ExtractionCache(object):
+    """
+    Local directory store of feature extraction results.
+
+    Entries are keyed by a hash of the video's content plus a fingerprint
+    of the extraction settings and of the extraction code, so a renamed or
+    re-downloaded video is recognised, and changing a setting or the code
+    never returns stale results. To stay fast on large videos, the content
+    hash covers the file size and a few evenly spaced chunks, not the
+    whole file.
+
+    Each entry is a directory holding the image quality, optical flow and
+    motion dataframes. When the store grows past max_bytes, the least recently
+    used entries are removed.
+    """
+
+    ## Number and size of the chunks of the video that are hashed
+    NUM_CHUNKS = 16
+    CHUNK_SIZE = 64 * 1024
+
+    ## Modules whose source is part of the code fingerprint
+    CODE_MODULES = ['ffmpeg_capture', 'flow_preprocess', 'flow_tracker',
+                    'frame_analysis', 'frame_buffer', 'frame_checkpoint',
+                    'frame_context', 'frame_pipeline', 'frame_sampling',
+                    'video_analysis', 'video_feature_extraction',
+                    'video_utilities']
+
+    _code_version = None
+
+    def __init__(self, cache_dir, max_bytes=None):
+        """
+        Default constructor
+
+        ARGS:
+            cache_dir: directory to keep entries in. Created if needed.
+            max_bytes: maximum total size of the entries, or None for no
+                       limit
+        RETURNS:
+            None
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def content_hash(video):
+        """
+        Hash of a video file's size and NUM_CHUNKS evenly spaced chunks,
+        including the first and last
+
+        ARGS:
+            video: path to video file
+        RETURNS:
+            Hex digest string
+        """
+        size = os.path.getsize(video)
+        digest = hashlib.sha1(str(size))
+        chunk_size = ExtractionCache.CHUNK_SIZE
+        num_chunks = ExtractionCache.NUM_CHUNKS
+        with open(video, 'rb') as f:
+            if size <= num_chunks * chunk_size:
+                digest.update(f.read())
+            else:
+                step = (size - chunk_size) // (num_chunks - 1)
+                for i in range(num_chunks):
+                    f.seek(i * step)
+                    digest.update(f.read(chunk_size))
+        return digest.hexdigest()
+
+    @staticmethod
+    def code_version():
+        """
+        Hash of the source of the extraction modules (CODE_MODULES)
+
+        ARGS:
+            None
+        RETURNS:
+            Hex digest string
+        """
+        if ExtractionCache._code_version is None:
+            digest = hashlib.sha1()
+            code_dir = os.path.dirname(os.path.abspath(__file__))
+            for name in ExtractionCache.CODE_MODULES:
+                path = os.path.join(code_dir, name + '.py')
+                if os.path.isfile(path):
+                    with open(path, 'rb') as f:
+                        digest.update(f.read())
+            ExtractionCache._code_version = digest.hexdigest()
+        return ExtractionCache._code_version
+
+    @staticmethod
+    def key(video, config):
+        """
+        Cache key of a video and extraction settings
+
+        ARGS:
+            video: path to video file
+            config: dictionary of the extraction settings that affect the
+                    results. Values must have a stable repr.
+        RETURNS:
+            Hex digest string
+        """
+        digest = hashlib.sha1(ExtractionCache.content_hash(video))
+        digest.update(repr(sorted(config.items())))
+        digest.update(ExtractionCache.code_version())
+        return digest.hexdigest()
+
+    def _entry_dir(self, key):
+        """
+        Directory of an entry
+        """
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """
+        Look up an entry, marking it as recently used
+
+        ARGS:
+            key: cache key (see key)
+        RETURNS:
+            Tuple of (image quality dataframe, optical flow dataframe,
+            motion dataframe), or None if there is no entry
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            img_quality_df = pd.read_pickle(os.path.join(entry_dir, 'img_quality.pkl'))
+            flow_df = pd.read_pickle(os.path.join(entry_dir, 'flow.pkl'))
+            motion_df = pd.read_pickle(os.path.join(entry_dir, 'motion.pkl'))
+        except (IOError, OSError):
+            return None
+        os.utime(entry_dir, None)
+        return img_quality_df, flow_df, motion_df
+
+    def put(self, key, img_quality_df, flow_df, motion_df):
+        """
+        Store an entry, then evict least recently used entries if the
+        store is over max_bytes. The new entry is never evicted; an entry
+        larger than max_bytes on its own is not stored.
+
+        ARGS:
+            key: cache key (see key)
+            img_quality_df: image quality dataframe
+            flow_df: optical flow dataframe
+            motion_df: motion dataframe
+        RETURNS:
+            None
+        """
+        ## Write to a temporary directory first so that readers never see
+        ## a partial entry
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+        img_quality_df.to_pickle(os.path.join(tmp_dir, 'img_quality.pkl'))
+        flow_df.to_pickle(os.path.join(tmp_dir, 'flow.pkl'))
+        motion_df.to_pickle(os.path.join(tmp_dir, 'motion.pkl'))
+        if self.max_bytes is not None and \
+                ExtractionCache._dir_size(tmp_dir) > self.max_bytes:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            ## Another worker stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict(keep=key)
+
+    @staticmethod
+    def _dir_size(directory):
+        """
+        Total size of the files in a directory
+        """
+        return sum(os.path.getsize(os.path.join(directory, f))
+                   for f in os.listdir(directory))
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the store is within
+        max_bytes
+
+        ARGS:
+            keep: key of an entry that must not be removed, e.g. the one
+                  just stored
+        RETURNS:
+            List of the keys removed
+        """
+        if self.max_bytes is None:
+            return []
+
+        entries = []
+        total = 0
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            if key.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            size = ExtractionCache._dir_size(entry_dir)
+            entries.append((os.path.getmtime(entry_dir), key, size))
+            total += size
+
+        removed = []
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
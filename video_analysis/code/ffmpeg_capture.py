@@ -0,0 +1,227 @@
+import re
+import threading
+import Queue
+import cv2
+import numpy as np
+from subprocess import Popen, PIPE
+
+
+class FFmpegCapture(object):
+    """
+    Frame source that decodes with an ffmpeg subprocess instead of
+    cv2.VideoCapture.
+
+    ffmpeg scales frames to the analysis resolution and writes them to a
+    pipe as raw planar YUV 4:2:0, which is what most videos decode to, so
+    no colour conversion happens in ffmpeg. Each frame is read into one
+    preallocated buffer with readinto, and the small BGR frame is converted
+    from the buffer with cv2. Presentation timestamps are parsed from
+    ffmpeg's showinfo filter.
+
+    Grayscale frames are derived from the BGR frame (see FrameContext), as
+    with cv2.VideoCapture. The Y plane is not used for them: stretched to
+    full range it differs slightly from cv2's BGR to gray conversion,
+    which would make flow, motion and the motion gate depend on the
+    backend on top of the difference in scaling.
+
+    Implements the parts of the cv2.VideoCapture interface used here
+    (read, grab, get, set, release, isOpened), so it can replace it.
+    """
+
+    ## ffmpeg executable
+    FFMPEG = 'ffmpeg'
+
+    ## Seconds to wait for a frame's timestamp before checking that ffmpeg
+    ## is still running
+    TIMEOUT = 1.
+
+    _PTS_RE = re.compile(b'pts_time:\s*(\S+)')
+
+    def __init__(self, video, max_edge=None):
+        """
+        Default constructor
+
+        ARGS:
+            video: path to video file
+            max_edge: analysis resolution, as the maximum length of the
+                      long edge in pixels (see FrameContext.downscale).
+                      None keeps the decoded resolution.
+        RETURNS:
+            None
+        """
+        self.video = video
+        self.max_edge = max_edge
+
+        ## Container metadata, without decoding
+        cap = cv2.VideoCapture(video)
+        width = int(cap.get(cv2.cv.CV_CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.cv.CV_CAP_PROP_FRAME_HEIGHT))
+        self.fps = cap.get(cv2.cv.CV_CAP_PROP_FPS)
+        self.frame_count = cap.get(cv2.cv.CV_CAP_PROP_FRAME_COUNT)
+        cap.release()
+
+        ## Output size. 4:2:0 chroma needs even dimensions.
+        scale = 1.
+        if max_edge is not None and max(width, height) > max_edge:
+            scale = float(max_edge) / max(width, height)
+        self.width = max(int(round(width * scale)) // 2 * 2, 2)
+        self.height = max(int(round(height * scale)) // 2 * 2, 2)
+
+        self._buffer = np.empty((self.height * 3 // 2, self.width), dtype=np.uint8)
+        self._process = None
+        self._start(0)
+
+    def _start(self, frame_number):
+        """
+        (Re)start ffmpeg at a frame
+
+        ARGS:
+            frame_number: frame number of the first frame to decode
+        RETURNS:
+            None
+        """
+        self.release()
+        command = [FFmpegCapture.FFMPEG, '-hide_banner', '-nostats',
+                   '-loglevel', 'info']
+        if frame_number > 0:
+            ## Keep the original timestamps after seeking
+            command += ['-ss', '%.6f' % (frame_number / self.fps), '-copyts']
+        command += ['-i', self.video, '-an', '-sn',
+                    '-vf', 'scale=%d:%d,showinfo' % (self.width, self.height),
+                    '-vsync', '0', '-pix_fmt', 'yuv420p',
+                    '-f', 'rawvideo', 'pipe:1']
+        self._process = Popen(command, stdout=PIPE, stderr=PIPE,
+                              bufsize=self._buffer.nbytes)
+        self._times = Queue.Queue()
+        self._stderr_thread = threading.Thread(target=self._read_stderr,
+                                               args=(self._process, self._times))
+        self._stderr_thread.daemon = True
+        self._stderr_thread.start()
+        self.frame_number = frame_number
+        self.time = 0.
+
+    @staticmethod
+    def _read_stderr(process, times):
+        """
+        Collect presentation timestamps from ffmpeg's log, and keep the
+        stderr pipe from filling up
+
+        ARGS:
+            process: ffmpeg process
+            times: queue to put timestamps (in seconds) on
+        RETURNS:
+            None
+        """
+        for line in iter(process.stderr.readline, b''):
+            match = FFmpegCapture._PTS_RE.search(line)
+            if match:
+                times.put(float(match.group(1)))
+        times.put(None)
+
+    def _read_raw(self):
+        """
+        Read the next frame into the buffer
+
+        ARGS:
+            None
+        RETURNS:
+            Whether a whole frame was read
+        """
+        if self._process is None:
+            return False
+        view = memoryview(self._buffer.reshape(-1))
+        filled = 0
+        while filled < len(view):
+            count = self._process.stdout.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+
+        ## The timestamp is logged when the frame leaves the filters, so
+        ## it can still be on its way. Give up if ffmpeg has exited and
+        ## its log has been read to the end.
+        time = None
+        while True:
+            try:
+                time = self._times.get(timeout=FFmpegCapture.TIMEOUT)
+                break
+            except Queue.Empty:
+                if self._process.poll() is not None and \
+                        not self._stderr_thread.is_alive():
+                    break
+        if time is not None:
+            self.time = time
+        self.frame_number += 1
+        return True
+
+    def grab(self):
+        """
+        Advance to the next frame without converting it
+
+        ARGS:
+            None
+        RETURNS:
+            Whether there was a frame
+        """
+        return self._read_raw()
+
+    def read(self):
+        """
+        Read the next frame
+
+        ARGS:
+            None
+        RETURNS:
+            Tuple of (whether there was a frame, BGR frame)
+        """
+        if not self.grab():
+            return False, None
+        frame = cv2.cvtColor(self._buffer, cv2.COLOR_YUV2BGR_I420)
+        return True, frame
+
+    def get(self, prop):
+        """
+        Same as cv2.VideoCapture.get, for the properties used here. The
+        frame size is the output (scaled) size.
+        """
+        if prop == cv2.cv.CV_CAP_PROP_POS_MSEC:
+            return self.time * 1000.
+        if prop == cv2.cv.CV_CAP_PROP_POS_FRAMES:
+            return float(self.frame_number)
+        if prop == cv2.cv.CV_CAP_PROP_FRAME_COUNT:
+            return self.frame_count
+        if prop == cv2.cv.CV_CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.cv.CV_CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.cv.CV_CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        return 0.
+
+    def set(self, prop, value):
+        """
+        Same as cv2.VideoCapture.set. Only seeking by frame number
+        (CV_CAP_PROP_POS_FRAMES) is supported; it restarts ffmpeg.
+        """
+        if prop != cv2.cv.CV_CAP_PROP_POS_FRAMES:
+            return False
+        self._start(int(value))
+        return True
+
+    def isOpened(self):
+        """
+        Whether ffmpeg is running
+        """
+        return self._process is not None
+
+    def release(self):
+        """
+        Stop ffmpeg
+        """
+        if self._process is None:
+            return
+        self._process.stdout.close()
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._process = None
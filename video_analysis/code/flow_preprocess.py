@@ -1,4 +1,4 @@
-import math
+import sys
 import numpy as np
 import pandas as pd
 
@@ -8,61 +8,137 @@ class FlowPreprocess():
     Collection of (static) utilities for processing optical flow data.
     """
 
+    ## Columns and types of the flow dataframe, one row per tracked point.
+    ## (x0, y0) is the point's position in the previous frame and (x1, y1)
+    ## its position in the current frame.
+    FLOW_SCHEMA = [('frame_number', np.int32),
+                   ('time', np.float32),
+                   ('x0', np.float32),
+                   ('y0', np.float32),
+                   ('x1', np.float32),
+                   ('y1', np.float32),
+                   ('flow_st', np.uint8),
+                   ('flow_err', np.float32)]
+
     @staticmethod
     def flow_angles(df):
         """
         Calculate the angle of motion for every tracked point
 
         Args:
-            df: Dataframe containing tracked optical flow points
+            df: Dataframe containing tracked optical flow points, either
+                as 'flow_pt_pos(t)'/'flow_pt_pos(t-1)' position columns or
+                as flat 'x0', 'y0', 'x1', 'y1' columns
         Returns:
-            list of angles for each tracked point
+            numpy array of angles for each tracked point
         """
-        angles = []
-        for new_pos, old_pos in zip(df['flow_pt_pos(t)'],
-                                    df['flow_pt_pos(t-1)']):
-            # print new_pos, old_pos
-            angles.append(FlowPreprocess._calculate_angle(new_pos, old_pos))
-        return angles
+        new_pos, old_pos = FlowPreprocess.get_positions(df)
+        delta = (new_pos - old_pos).astype(np.float64)
+        return np.arctan2(delta[:, 1], delta[:, 0])
 
     @staticmethod
-    def _calculate_angle(new_pos, old_pos):
+    def add_motion_columns(df):
         """
-        Helper for calculating the angles between two points
+        Add each tracked point's distance traveled ('distance') and angle of
+        motion ('angle')
 
         Args:
-            new_pos: position of point in current frame
-            old_pos: position of point in previous frame
+            df: Dataframe containing tracked optical flow points, in either
+                layout accepted by flow_angles
         Returns:
-            angle of point's motion
+            Copy of df with the 'distance' and 'angle' columns
         """
-        angle = math.atan2((new_pos[1] - old_pos[1]),
-                           (new_pos[0] - old_pos[0]))
-        return angle
+        return df.assign(distance=FlowPreprocess.flow_distances(df),
+                         angle=FlowPreprocess.flow_angles(df))
 
     @staticmethod
     def flow_distances(df):
         """
         Get distance traveled between frames for each tracked point
 
+        Args:
+            df: Dataframe containing tracked optical flow points, in either
+                layout accepted by flow_angles
+        Returns:
+            numpy array of distance traveled between frames for each
+            tracked point
+        """
+        new_pos, old_pos = FlowPreprocess.get_positions(df)
+        delta = (new_pos - old_pos).astype(np.float64)
+        return np.hypot(delta[:, 0], delta[:, 1])
+
+    @staticmethod
+    def get_positions(df):
+        """
+        Positions of every tracked point in the current and previous frame
+
+        Args:
+            df: Dataframe containing tracked optical flow points, in either
+                layout accepted by flow_angles
+        Returns:
+            Tuple of (N, 2) arrays: (position in current frame,
+            position in previous frame)
+        """
+        if 'x0' in df.columns:
+            new_pos = np.column_stack([df['x1'].values, df['y1'].values])
+            old_pos = np.column_stack([df['x0'].values, df['y0'].values])
+            return new_pos, old_pos
+
+        if len(df) == 0:
+            return np.empty((0, 2)), np.empty((0, 2))
+        new_pos = np.concatenate(list(df['flow_pt_pos(t)'].values)).reshape(-1, 2)
+        old_pos = np.concatenate(list(df['flow_pt_pos(t-1)'].values)).reshape(-1, 2)
+        return new_pos, old_pos
+
+    @staticmethod
+    def to_flat_layout(df):
+        """
+        Convert a flow dataframe with 'flow_pt_pos(t)'/'flow_pt_pos(t-1)'
+        object columns (.flow.pkl files written before FLOW_SCHEMA) to the
+        flat layout. Dataframes already in the flat layout are copied.
+
         Args:
             df: Dataframe containing tracked optical flow points
         Returns:
-            list of distance traveled between frames for each tracked point
+            Dataframe with the columns of FLOW_SCHEMA, plus any other
+            columns of df (e.g. video_id)
         """
-        distances = []
-        for new_pos, old_pos in zip(df['flow_pt_pos(t)'],
-                                    df['flow_pt_pos(t-1)']):
-            # print new_pos, old_pos
-            distances.append(FlowPreprocess._calculate_distance(new_pos,
-                                                                old_pos))
-        return distances
+        if 'x0' in df.columns:
+            return df.copy()
+
+        new_pos, old_pos = FlowPreprocess.get_positions(df)
+        out = df.drop(['flow_pt_pos(t)', 'flow_pt_pos(t-1)'], axis=1)
+        out['x0'], out['y0'] = old_pos[:, 0], old_pos[:, 1]
+        out['x1'], out['y1'] = new_pos[:, 0], new_pos[:, 1]
+
+        names = [name for name, _ in FlowPreprocess.FLOW_SCHEMA]
+        for name, dtype in FlowPreprocess.FLOW_SCHEMA:
+            if name in out.columns:
+                out[name] = out[name].values.astype(dtype)
+        first = [c for c in ['video_id'] + names if c in out.columns]
+        return out[first + [c for c in out.columns if c not in first]]
 
     @staticmethod
-    def _calculate_distance(new_pos, old_pos):
+    def convert_flow_pickle(path, out_path=None):
         """
-        Euclidean distance calculator
+        Rewrite a .flow.pkl file in the flat layout (see to_flat_layout)
+
+        Args:
+            path: path to the flow pickle
+            out_path: where to write the converted pickle. Defaults to
+                      overwriting path.
+        Returns:
+            None
         """
-        dist = math.sqrt((new_pos[0] - old_pos[0])**2 +
-                         (new_pos[1] - old_pos[1])**2)
-        return dist
+        if out_path is None:
+            out_path = path
+        df = FlowPreprocess.to_flat_layout(pd.read_pickle(path))
+        df.to_pickle(out_path)
+
+
+if __name__ == "__main__":
+    ## Convert flow pickles to the flat layout, in place
+    ## Usage: python flow_preprocess.py <flow pickle> [<flow pickle> ...]
+    for path in sys.argv[1:]:
+        print path
+        FlowPreprocess.convert_flow_pickle(path)
@@ -0,0 +1,311 @@
+import cv2
+import numpy as np
+from frame_buffer import FrameBuffer
+from frame_context import FrameContext
+from video_utilities import VideoUtilities
+
+
+class FlowTracker(object):
+    """
+    Stateful optical flow between consecutive frames.
+
+    VideoUtilities.flow_points preprocesses both frames of every pair, so
+    each frame of a video is converted to grayscale and blurred twice. The
+    tracker keeps the previous frame's preprocessed image and the corners
+    detected on it, so every new frame costs one preprocess, one corner
+    detection (for the next pair) and one Lucas-Kanade call.
+
+    By default corners are re-detected on every frame, and the points
+    tracked and the values returned are the same as those of
+    VideoUtilities.flow_points on the same pair of frames.
+
+    With redetect_fraction set, points that were tracked successfully are
+    carried forward as persistent (KLT) tracks, and corner detection only
+    runs when fewer than redetect_fraction * maxCorners of them survive.
+    New corners then top up the surviving tracks.
+
+    With motion_gate set, each frame is first compared with the last frame
+    flow was computed on, using small grayscale thumbnails. If their mean
+    absolute difference is below motion_gate, corner detection and
+    Lucas-Kanade are skipped and the tracked points are reported as not
+    having moved (see skipped). Comparing against the last computed frame,
+    rather than the previous one, means slow drift still triggers flow
+    once it adds up.
+
+    Held frames therefore report no motion, and the next computed frame
+    reports the whole displacement since the last computed frame, however
+    many frames ago that was. gap gives that number of frames after each
+    update (1 without the gate, 0 for held frames), so per-frame motion
+    can be normalised as distance / gap.
+    """
+
+    def __init__(self, preprocess=True, redetect_fraction=None,
+                 record_tracks=False, motion_gate=None):
+        """
+        Default constructor
+
+        ARGS:
+            preprocess: whether frames need to be put into standardized
+                        format
+            redetect_fraction: None to detect corners on every frame, or the
+                               fraction of maxCorners below which surviving
+                               tracks are topped up with new corners
+            record_tracks: whether to keep every point's position in every
+                           frame (see get_trajectories)
+            motion_gate: None to compute flow on every frame, or the mean
+                         absolute thumbnail difference (in gray levels)
+                         below which a frame is treated as static
+        RETURNS:
+            None
+        """
+        self.preprocess = preprocess
+        self.redetect_fraction = redetect_fraction
+        self.motion_gate = motion_gate
+        self.num_frames = 0
+        self.num_skipped = 0
+        self.num_detections = 0
+        self.num_detections_avoided = 0
+        self.next_track_id = 0
+        self.tracks = None
+        if record_tracks:
+            self.tracks = FrameBuffer([('track_id', np.int32, ()),
+                                       ('frame_number', np.int32, ()),
+                                       ('pos', np.float32, (2,))])
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the previous frame, e.g. after seeking
+
+        ARGS:
+            None
+        RETURNS:
+            None
+        """
+        self.prev_image = None
+        self.prev_corners = None
+        self.prev_ids = None
+        self.prev_thumbnail = None
+        self.prev_frame_number = None
+        self.ref_frame_number = None
+        self.skipped = False
+        self.gap = 0
+
+    def get_state(self):
+        """
+        Everything needed to carry on tracking from the previous frame in
+        another process, e.g. after resuming from a checkpoint. Recorded
+        tracks are not included.
+
+        ARGS:
+            None
+        RETURNS:
+            Dictionary of the previous frame's image, corners and thumbnail,
+            and of the counters
+        """
+        return {'prev_image': self.prev_image,
+                'prev_corners': self.prev_corners,
+                'prev_ids': self.prev_ids,
+                'prev_thumbnail': self.prev_thumbnail,
+                'prev_frame_number': self.prev_frame_number,
+                'ref_frame_number': self.ref_frame_number,
+                'next_track_id': self.next_track_id,
+                'num_frames': self.num_frames,
+                'num_skipped': self.num_skipped,
+                'num_detections': self.num_detections,
+                'num_detections_avoided': self.num_detections_avoided}
+
+    def set_state(self, state):
+        """
+        Restore a state from get_state
+
+        ARGS:
+            state: dictionary from get_state
+        RETURNS:
+            None
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.skipped = False
+        self.gap = 0
+
+    def update(self, frame, frame_number=None):
+        """
+        Track the previous frame's corners into frame, then make frame the
+        previous frame.
+
+        ARGS:
+            frame: next frame of the video
+            frame_number: frame number to record tracks under. Defaults to
+                          the number of frames seen so far.
+        RETURNS:
+            Tuple of (p0, p1, st, err) as returned by
+            VideoUtilities.flow_points, or None for the first frame or if
+            there were no feature points in the previous frame. If the
+            frame was skipped by the motion gate, p1 equals p0, st is 1 and
+            err is 0. gap is set to the number of frames the points moved
+            over.
+        """
+        if frame_number is None:
+            frame_number = self.num_frames
+        self.num_frames += 1
+        self.prev_frame_number = frame_number
+
+        self.skipped = False
+        self.gap = 0
+        if self.motion_gate is not None:
+            thumbnail = self._get_thumbnail(frame)
+            if self.prev_thumbnail is not None and \
+                    cv2.absdiff(thumbnail, self.prev_thumbnail).mean() < self.motion_gate:
+                return self._hold(frame_number)
+            self.prev_thumbnail = thumbnail
+
+        if self.preprocess:
+            image = VideoUtilities._img_preprocess(frame)
+        else:
+            image = frame
+
+        pts = None
+        corners, ids = None, None
+        if self.prev_corners is not None:
+            p0 = self.prev_corners
+            p1, st, err = cv2.calcOpticalFlowPyrLK(self.prev_image, image, p0,
+                                                   None, **VideoUtilities.LK_PARAMS)
+            pts = (p0.reshape(-1, 2), p1.reshape(-1, 2),
+                   st.reshape(-1), err.reshape(-1))
+            self.gap = 1
+            if self.ref_frame_number is not None:
+                self.gap = frame_number - self.ref_frame_number
+            if self.redetect_fraction is not None:
+                found = st.reshape(-1) == 1
+                corners, ids = p1[found], self.prev_ids[found]
+
+        ## Find feature points to track into the next frame
+        max_corners = VideoUtilities.FEATURE_PARAMS['maxCorners']
+        if self.redetect_fraction is None:
+            corners, ids = self._detect(image, None, None)
+        elif corners is None or len(corners) < self.redetect_fraction * max_corners:
+            corners, ids = self._detect(image, corners, ids)
+        else:
+            self.num_detections_avoided += 1
+        if corners is not None and len(corners) == 0:
+            corners, ids = None, None
+
+        self.prev_image = image
+        self.prev_corners = corners
+        self.prev_ids = ids
+        self.ref_frame_number = frame_number
+        if self.tracks is not None and corners is not None:
+            self.tracks.extend(len(ids),
+                               track_id=ids,
+                               frame_number=frame_number,
+                               pos=corners.reshape(-1, 2))
+        return pts
+
+    def _hold(self, frame_number):
+        """
+        Report the tracked points as static, without computing flow. The
+        last computed frame stays the reference for the next one.
+
+        ARGS:
+            frame_number: frame number to record tracks under
+        RETURNS:
+            Zero-motion (p0, p1, st, err), or None if there are no points
+        """
+        self.skipped = True
+        self.num_skipped += 1
+        if self.prev_corners is None:
+            return None
+
+        p0 = self.prev_corners.reshape(-1, 2)
+        if self.tracks is not None:
+            self.tracks.extend(len(self.prev_ids),
+                               track_id=self.prev_ids,
+                               frame_number=frame_number,
+                               pos=p0)
+        return (p0, p0.copy(), np.ones(len(p0), dtype=np.uint8),
+                np.zeros(len(p0), dtype=np.float32))
+
+    @staticmethod
+    def _get_thumbnail(frame):
+        """
+        Thumbnail used by the motion gate (see FrameContext.get_thumbnail)
+
+        ARGS:
+            frame: frame, or its FrameContext
+        RETURNS:
+            Small grayscale image
+        """
+        if isinstance(frame, FrameContext):
+            return frame.get_thumbnail()
+        if frame.ndim == 2:
+            ## Already preprocessed
+            return FrameContext.downscale(frame, FrameContext.THUMBNAIL_EDGE)
+        return FrameContext(frame).get_thumbnail()
+
+    def _detect(self, image, corners, ids):
+        """
+        Detect corners, away from the points that are already tracked
+
+        ARGS:
+            image: preprocessed frame
+            corners: (n, 1, 2) array of surviving points, or None
+            ids: track ids of the surviving points, or None
+        RETURNS:
+            Tuple of (corners, track ids), or (None, None) if there are no
+            points to track
+        """
+        params = dict(VideoUtilities.FEATURE_PARAMS)
+        mask = None
+        if corners is not None and len(corners) > 0:
+            mask = np.empty(image.shape[:2], dtype=np.uint8)
+            mask.fill(255)
+            for x, y in corners.reshape(-1, 2):
+                cv2.circle(mask, (int(x), int(y)), params['minDistance'], 0, -1)
+            params['maxCorners'] -= len(corners)
+        else:
+            corners, ids = None, None
+
+        new = None
+        if params['maxCorners'] > 0:
+            new = cv2.goodFeaturesToTrack(image, mask = mask, **params)
+            self.num_detections += 1
+        if new is None:
+            return corners, ids
+
+        new_ids = np.arange(self.next_track_id, self.next_track_id + len(new),
+                            dtype=np.int32)
+        self.next_track_id += len(new)
+        if corners is None:
+            return new, new_ids
+        return np.concatenate([corners, new]), np.concatenate([ids, new_ids])
+
+    def get_trajectories(self):
+        """
+        Positions of every tracked point, grouped by track. Only available
+        if the tracker was created with record_tracks=True.
+
+        Track i occupies rows offsets[i]:offsets[i + 1] of the other arrays,
+        in frame order.
+
+        ARGS:
+            None
+        RETURNS:
+            Dictionary of numpy arrays: 'track_id' (one per track),
+            'offsets' (one per track, plus the total number of rows),
+            'frame_number' (int32), 'x' and 'y' (float32)
+        """
+        track_id = self.tracks.view('track_id')
+        frame_number = self.tracks.view('frame_number')
+        pos = self.tracks.view('pos')
+
+        order = np.lexsort((frame_number, track_id))
+        track_id = track_id[order]
+        starts = np.flatnonzero(np.r_[True, track_id[1:] != track_id[:-1]])
+        if len(track_id) == 0:
+            starts = starts[:0]
+        return {'track_id': track_id[starts],
+                'offsets': np.append(starts, len(track_id)).astype(np.int64),
+                'frame_number': frame_number[order],
+                'x': pos[order, 0],
+                'y': pos[order, 1]}
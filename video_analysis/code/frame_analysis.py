@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import cv2
+from frame_context import FrameContext
 
 
 class FrameAnalysis(object):
@@ -8,6 +9,9 @@ class FrameAnalysis(object):
     This encapsulate all methods to process a single image in a video
     """
 
+    # Built on first use by _get_hsv_code_lut
+    _hsv_code_lut = None
+
     # Blur Detection
     # Based on
     # http://www.pyimagesearch.com/2015/09/07/blur-detection-with-opencv/
@@ -25,10 +29,46 @@ class FrameAnalysis(object):
         """
         # TODO: Machine learning to determine the proper threshold
         #       of Blur vs. non-Blur
-        out = pd.DataFrame([cv2.Laplacian(image, cv2.CV_64F).var()],
+        out = pd.DataFrame([FrameAnalysis.get_blur_value(image)],
                            columns=['blur'])
         return out
 
+    @staticmethod
+    def get_blur_value(image):
+        """
+        Same metric as get_blur, as a plain float
+
+        Args:
+            image: a single video frame, or its FrameContext
+        Returns:
+            single number metric for blur/sharpess
+        """
+        if isinstance(image, FrameContext):
+            image = image.get_image()
+        return cv2.Laplacian(image, cv2.CV_64F).var()
+
+    @staticmethod
+    def get_blur_values(images, chunk_size=64):
+        """
+        Blur metric (see get_blur) for each frame of a stack, as an array.
+        Frames are filtered one at a time: filtering a chunk as one tall
+        image gives the same values but measured slower, since it only
+        adds copies around the single Laplacian call per frame.
+
+        Args:
+            images: (N, H, W, 3) uint8 array, e.g. a np.memmap of frames
+                    cached on disk
+            chunk_size: number of frames to load into memory at a time
+        Returns:
+            (N,) float64 array
+        """
+        out = np.empty(len(images), dtype=np.float64)
+        for start in range(0, len(images), chunk_size):
+            chunk = np.ascontiguousarray(images[start:start + chunk_size])
+            for i in range(len(chunk)):
+                out[start + i] = FrameAnalysis.get_blur_value(chunk[i])
+        return out
+
     @staticmethod
     def get_hsv_hists(image, bw_mask=True):
         """
@@ -42,36 +82,134 @@ class FrameAnalysis(object):
             Also contains black pixel count and white pixel count if
             bw_mask is true.
         """
+        values = FrameAnalysis.get_hsv_hist_values(image, bw_mask)
+        return pd.DataFrame([values],
+                            columns=FrameAnalysis.get_hsv_hist_columns(bw_mask))
 
-        hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+    @staticmethod
+    def get_hsv_hist_values(image, bw_mask=True):
+        """
+        Same values as get_hsv_hists, as a plain array
 
-        # Mask off black and white values
-        # Black/white values may affect color hist
-        # NOTE: # saturation and value do not need to be masked
-        bw_count_df = pd.DataFrame()  # !
-        if bw_mask:
-            mask, bw_count_df = SceneAnalysis._get_filter_bw(hsv)
-            hue_df = hsv[:, :, 0] * mask
+        INPUT
+            image: RGB image, or its FrameContext
+            bw_mask: Whether to separate black and white pixels
+        OUTPUT
+            Numpy int64 array in the order of get_hsv_hist_columns
+        """
+        if isinstance(image, FrameContext):
+            hsv = image.get_hsv()
         else:
-            hue_df = hsv[:, :, 0]
-
-        # Create binned value counts per HSV channel
-        hue_hist_df = SceneAnalysis._get_hist(hue_df.ravel(),
-                                              num_bins=72,
-                                              max_val=180,
-                                              prefix="hue_bin_")
-        sat_hist_df = SceneAnalysis._get_hist(hsv[:, :, 1].ravel(),
-                                              num_bins=25,
-                                              max_val=255,
-                                              prefix="sat_bin_")
-        val_hist_df = SceneAnalysis._get_hist(hsv[:, :, 2].ravel(),
-                                              num_bins=25,
-                                              max_val=255,
-                                              prefix="val_bin_")
-        out = pd.concat([hue_hist_df, sat_hist_df, val_hist_df, bw_count_df],
-                        axis=1)
+            hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+        return FrameAnalysis._get_hsv_hist_values(hsv, bw_mask)
+
+    @staticmethod
+    def get_hsv_hists_batch(images, bw_mask=True, chunk_size=64):
+        """
+        Histograms and counts (see get_hsv_hists) for a stack of frames.
+        Colour conversion and binning run once per chunk of frames rather
+        than once per frame.
+
+        INPUT
+            images: (N, H, W, 3) uint8 array, e.g. a np.memmap of frames
+                    cached on disk
+            bw_mask: Whether to separate black and white pixels
+            chunk_size: number of frames to load into memory at a time
+        OUTPUT
+            (N, bins) int64 array, columns in the order of
+            get_hsv_hist_columns
+        """
+        num_frames = len(images)
+        out = np.empty((num_frames, len(FrameAnalysis.get_hsv_hist_columns(bw_mask))),
+                       dtype=np.int64)
+        for start in range(0, num_frames, chunk_size):
+            chunk = np.ascontiguousarray(images[start:start + chunk_size])
+            n, height, width = chunk.shape[:3]
+            ## Colour conversion is per pixel, so the chunk can be converted
+            ## as one tall image
+            hsv = cv2.cvtColor(chunk.reshape(n * height, width, 3),
+                               cv2.COLOR_RGB2HSV)
+            hsv = hsv.reshape(n, height, width, 3)
+            for i in range(n):
+                out[start + i] = FrameAnalysis._get_hsv_hist_values(hsv[i], bw_mask)
         return out
 
+    @staticmethod
+    def _get_hsv_hist_values(hsv_image, bw_mask=True):
+        """
+        Hue, saturation and value histograms plus black and white pixel
+        counts from a single joint histogram of the HSV image.
+
+        Every pixel is mapped to a (hue bin, sat bin, val bin) code with a
+        lookup table and counted in one calcHist pass. The first saturation
+        and value bins ([0, 10.2)) hold exactly the pixels at or below the
+        black/white threshold of 10, so the masked hue histogram and the
+        black/white counts can be read off the joint histogram.
+
+        Matches the previous implementation bin for bin, including its
+        quirk of counting black/white pixels with a hue of exactly 0 in
+        the first hue bin.
+
+        ARGS:
+            hsv_image: input image in HSV format
+            bw_mask: Whether to separate black and white pixels
+        RETURNS:
+            Numpy int64 array in the order of get_hsv_hist_columns
+        """
+        lut = FrameAnalysis._get_hsv_code_lut()
+        codes = cv2.LUT(hsv_image, lut)
+        num_hue_codes = 74
+        # Counts are float32, which is exact up to 2**24 pixels per bin
+        joint = cv2.calcHist([codes], [0, 1, 2], None, [num_hue_codes, 25, 25],
+                             [0, num_hue_codes, 0, 25, 0, 25]).astype(np.int64)
+
+        sat_hist = joint.sum(axis=2).sum(axis=0)
+        val_hist = joint.sum(axis=1).sum(axis=0)
+
+        ## Hue codes 0-71 are hue bins, 72 is unused (out of range) and 73
+        ## is a hue of exactly 0
+        if bw_mask:
+            hue_hist = joint[:72, 1:, 1:].sum(axis=2).sum(axis=1)
+            num_black = joint[:, :, 0].sum()
+            num_white = joint[:, 0, 1:].sum()
+        else:
+            hue_hist = joint[:72].sum(axis=2).sum(axis=1)
+        hue_hist[0] += joint[73].sum()
+
+        out = [hue_hist, sat_hist, val_hist]
+        if bw_mask:
+            out.append([num_black, num_white])
+        return np.concatenate(out)
+
+    @staticmethod
+    def _get_hsv_code_lut():
+        """
+        Lookup table mapping each 8-bit H, S and V value to its histogram
+        bin, using the same bin edges as np.histogram in _get_hist
+
+        ARGS:
+            None
+        RETURNS:
+            (1, 256, 3) uint8 lookup table for cv2.LUT
+        """
+        if FrameAnalysis._hsv_code_lut is None:
+            values = np.arange(256)
+            lut = np.empty((1, 256, 3), dtype=np.uint8)
+            for channel, num_bins, max_val in [(0, 72, 180),
+                                               (1, 25, 255),
+                                               (2, 25, 255)]:
+                hist, bins = np.histogram([], num_bins, [0, max_val])
+                bin_idx = np.searchsorted(bins, values, side='right') - 1
+                ## The last bin includes its right edge
+                bin_idx[values == max_val] = num_bins - 1
+                bin_idx[values > max_val] = num_bins
+                lut[0, :, channel] = bin_idx
+            lut[0, 0, 0] = 73
+            ## Black/white threshold must coincide with the first bin edge
+            assert (lut[0, :, 1] == 0).sum() == 11
+            FrameAnalysis._hsv_code_lut = lut
+        return FrameAnalysis._hsv_code_lut
+
     @staticmethod
     def _get_filter_bw(hsv_image):
         """
@@ -99,11 +237,42 @@ class FrameAnalysis(object):
 
         # Create a mask of 1's (non-black/white pixel)
         # and 0's (black/white pixel)
-        mask = s_mask * v_mask
-        vec_function = np.vectorize(lambda x: 1 if x > 0 else -1)
-        mask = vec_function(mask)
+        mask = np.where(s_mask * v_mask, 1, -1)
         return mask, bw_df
 
+    @staticmethod
+    def get_hsv_hist_columns(bw_mask=True):
+        """
+        Names of the columns returned by get_hsv_hists, without computing
+        any histograms.
+
+        INPUT
+            bw_mask: Whether black and white pixel counts are included
+        OUTPUT
+            List of column names
+        """
+        cols = (FrameAnalysis._get_bin_names(72, 180, "hue_bin_") +
+                FrameAnalysis._get_bin_names(25, 255, "sat_bin_") +
+                FrameAnalysis._get_bin_names(25, 255, "val_bin_"))
+        if bw_mask:
+            cols += ['num_black_pixels', 'num_white_pixels']
+        return cols
+
+    @staticmethod
+    def _get_bin_names(num_bins, max_val, prefix):
+        """
+        Column names for a histogram, using the same bin edges as _get_hist
+
+        ARGS:
+            num_bins:   number of bins in histogram
+            max_val:    maximum possible value that image parameter can take
+            prefix:     prefix of image parameter
+        RETURNS:
+            List of column names
+        """
+        hist, bins = np.histogram([], num_bins, [0, max_val])
+        return [prefix + str(v) for v in bins[:-1]]
+
     @staticmethod
     def _get_hist(hsv_image, num_bins, max_val, prefix):
         '''
@@ -0,0 +1,129 @@
+import numpy as np
+
+
+class FrameBuffer(object):
+    """
+    Growable, typed, column-oriented store for per-frame (or per-point)
+    features. Each column is a preallocated NumPy array; rows are written in
+    place and the arrays only grow (geometrically) when the initial capacity
+    turns out to be too small.
+
+    This replaces building results with DataFrame.append, which copies
+    everything accumulated so far on every call.
+    """
+
+    def __init__(self, schema, capacity=1024):
+        """
+        Default constructor
+
+        ARGS:
+            schema: list of (column name, numpy dtype, trailing shape) tuples.
+                    The trailing shape is () for scalar columns, (n,) for a
+                    block of n values per row.
+            capacity: initial number of rows to allocate
+        RETURNS:
+            None
+        """
+        self.schema = schema
+        self.capacity = max(int(capacity), 1)
+        self.size = 0
+        self.columns = {}
+        for name, dtype, shape in schema:
+            self.columns[name] = np.empty((self.capacity,) + tuple(shape),
+                                          dtype=dtype)
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, num_rows):
+        """
+        Make room for num_rows more rows, doubling capacity as needed.
+
+        ARGS:
+            num_rows: number of rows about to be written
+        RETURNS:
+            None
+        """
+        needed = self.size + num_rows
+        if needed <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        for name, col in self.columns.items():
+            grown = np.empty((capacity,) + col.shape[1:], dtype=col.dtype)
+            grown[:self.size] = col[:self.size]
+            self.columns[name] = grown
+        self.capacity = capacity
+
+    def append(self, **values):
+        """
+        Write a single row.
+
+        ARGS:
+            values: one keyword argument per column
+        RETURNS:
+            None
+        """
+        self._reserve(1)
+        for name, value in values.items():
+            self.columns[name][self.size] = value
+        self.size += 1
+
+    def extend(self, num_rows, **values):
+        """
+        Write num_rows rows at once. Scalar values are broadcast to every row.
+
+        ARGS:
+            num_rows: number of rows to write
+            values: one keyword argument per column, each either an array
+                    with num_rows leading entries or a scalar
+        RETURNS:
+            None
+        """
+        if num_rows <= 0:
+            return
+        self._reserve(num_rows)
+        end = self.size + num_rows
+        for name, value in values.items():
+            self.columns[name][self.size:end] = value
+        self.size = end
+
+    def trim(self):
+        """
+        Release unused capacity, e.g. before sending the buffer to another
+        process.
+
+        ARGS:
+            None
+        RETURNS:
+            None
+        """
+        self.capacity = max(self.size, 1)
+        for name, col in self.columns.items():
+            trimmed = np.empty((self.capacity,) + col.shape[1:],
+                               dtype=col.dtype)
+            trimmed[:self.size] = col[:self.size]
+            self.columns[name] = trimmed
+
+    def clear(self):
+        """
+        Drop every row, keeping the allocated capacity for reuse
+
+        ARGS:
+            None
+        RETURNS:
+            None
+        """
+        self.size = 0
+
+    def view(self, name):
+        """
+        Return the filled part of a column (a view, not a copy).
+
+        ARGS:
+            name: column name
+        RETURNS:
+            Numpy array with len(self) rows
+        """
+        return self.columns[name][:self.size]
@@ -0,0 +1,162 @@
+import os
+import shutil
+import pickle
+import numpy as np
+
+
+class FrameCheckpoint(object):
+    """
+    On-disk store of per-frame extraction results, written in chunks as a
+    video is processed, so that extraction can resume after a crash or a
+    lost instance instead of starting over.
+
+    Each chunk holds the rows of every output buffer (image quality,
+    optical flow and per-frame motion) for chunk_size consecutive frames
+    and is written as a .npz file. After every chunk, a checkpoint file
+    records the number of complete chunks and rows, the frame to resume
+    from and the FlowTracker and FrameSampling states. The checkpoint file
+    is replaced atomically and only after its chunk is on disk, so a chunk
+    that was being written when the process died is simply written again.
+
+    The checkpoint also records a key of the video and the settings it was
+    made with (see ExtractionCache.key). A checkpoint with a different key
+    is discarded, so a changed setting, video or extraction code never
+    resumes from stale chunks.
+
+    Complete checkpoints are read back one chunk at a time (see
+    iter_chunks), so the rows never have to be held twice.
+    """
+
+    CHECKPOINT_FILE = 'checkpoint.pkl'
+
+    def __init__(self, directory, chunk_size=1000, key=None):
+        """
+        Default constructor
+
+        ARGS:
+            directory: directory to keep the chunks in. Created if needed.
+                       Use a separate directory per video (and segment).
+            chunk_size: number of frames per chunk
+            key: key of the video and extraction settings. An existing
+                 checkpoint with another key is deleted.
+        RETURNS:
+            None
+        """
+        self.directory = directory
+        self.chunk_size = max(int(chunk_size), 1)
+        self.key = key
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.state = self._load_state()
+        if self.state.get('key') != key:
+            if self.state['num_chunks'] > 0:
+                print "-I- Discarding checkpoint made with other settings in %s" % directory
+            self.clear()
+            os.makedirs(directory)
+            self.state = self._load_state()
+
+    def _load_state(self):
+        """
+        Read the checkpoint file
+
+        ARGS:
+            None
+        RETURNS:
+            Dictionary with 'key', 'num_chunks', 'num_rows' (rows saved,
+            by buffer name), 'next_frame', 'tracker', 'sampling' and
+            'complete'. A fresh state if there is no checkpoint yet.
+        """
+        path = os.path.join(self.directory, FrameCheckpoint.CHECKPOINT_FILE)
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return {'key': self.key,
+                    'num_chunks': 0,
+                    'num_rows': {},
+                    'next_frame': None,
+                    'tracker': None,
+                    'sampling': None,
+                    'complete': False}
+
+    def _chunk_path(self, i_chunk):
+        """
+        Path of a chunk file
+        """
+        return os.path.join(self.directory, 'chunk_%06d.npz' % i_chunk)
+
+    def save(self, buffers, next_frame, tracker_state=None, complete=False,
+             sampling_state=None):
+        """
+        Write the buffers as the next chunk, then record the checkpoint
+
+        ARGS:
+            buffers: dictionary of FrameBuffers by name, holding the rows
+                     since the last chunk
+            next_frame: frame number to resume from
+            tracker_state: FlowTracker.get_state() after the last frame of
+                           the chunk, or None
+            complete: whether this is the last chunk
+            sampling_state: dictionary of FrameSampling.get_state() by
+                            metric family after the last frame of the
+                            chunk, or None
+        RETURNS:
+            None
+        """
+        i_chunk = self.state['num_chunks']
+        columns = {}
+        for buf_name, buf in buffers.items():
+            for name in buf.columns:
+                columns[buf_name + '.' + name] = buf.view(name)
+        with open(self._chunk_path(i_chunk), 'wb') as f:
+            np.savez(f, **columns)
+
+        num_rows = dict((name, self.state['num_rows'].get(name, 0) + len(buf))
+                        for name, buf in buffers.items())
+        state = {'key': self.key,
+                 'num_chunks': i_chunk + 1,
+                 'num_rows': num_rows,
+                 'next_frame': next_frame,
+                 'tracker': tracker_state,
+                 'sampling': sampling_state,
+                 'complete': complete}
+        path = os.path.join(self.directory, FrameCheckpoint.CHECKPOINT_FILE)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(path + '.tmp', path)
+        self.state = state
+
+    def iter_chunks(self, buffers):
+        """
+        Read the saved chunks in order, each into the same buffers, so only
+        one chunk is in memory at a time
+
+        ARGS:
+            buffers: dictionary of FrameBuffers, with names and schemas the
+                     chunks were saved with. Buffers may have a subset of
+                     the saved buffers and columns; only those are read.
+        RETURNS:
+            Generator of buffers, refilled with each chunk in turn
+        """
+        for i_chunk in range(self.state['num_chunks']):
+            chunk = np.load(self._chunk_path(i_chunk))
+            try:
+                for buf_name, buf in buffers.items():
+                    values = dict((name, chunk[buf_name + '.' + name])
+                                  for name in buf.columns)
+                    buf.clear()
+                    buf.extend(len(values[buf.schema[0][0]]), **values)
+            finally:
+                chunk.close()
+            yield buffers
+
+    def clear(self):
+        """
+        Delete the chunks and the checkpoint
+
+        ARGS:
+            None
+        RETURNS:
+            None
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
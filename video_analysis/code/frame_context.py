@@ -0,0 +1,148 @@
+import threading
+import cv2
+
+
+class FrameContext(object):
+    """
+    Lazily computed views of a single decoded frame.
+
+    Blur, the colour histograms and optical flow each need a different
+    version of the same frame (downscaled, HSV, grayscale, blurred
+    grayscale). A FrameContext computes each view the first time it is
+    requested and caches it, so no conversion runs twice for a frame.
+    FrameAnalysis and VideoUtilities accept a FrameContext wherever they
+    accept a frame.
+
+    conversions counts how many times each view was actually computed.
+
+    A context can be shared between threads (e.g. the FramePipeline
+    workers analysing a frame and the next one, which both use it). Each
+    view has its own lock, so a view is still computed once, and threads
+    computing different views, or views derived from one another, do not
+    wait on each other.
+    """
+
+    ## Long edge of the thumbnail used for cheap frame comparisons
+    THUMBNAIL_EDGE = 64
+
+    def __init__(self, frame, max_edge=None):
+        """
+        Default constructor
+
+        ARGS:
+            frame: decoded BGR frame
+            max_edge: analysis resolution, as the maximum length of the
+                      long edge in pixels. None keeps the decoded
+                      resolution.
+        RETURNS:
+            None
+        """
+        self.frame = frame
+        self.max_edge = max_edge
+        self.conversions = {}
+        self._views = {}
+        self._lock = threading.Lock()
+        self._view_locks = {}
+
+    def _get_view(self, name, compute):
+        """
+        Return a cached view, computing it on first use
+
+        ARGS:
+            name: name of the view
+            compute: function that computes the view
+        RETURNS:
+            The view
+        """
+        view = self._views.get(name)
+        if view is not None:
+            return view
+
+        with self._lock:
+            view_lock = self._view_locks.setdefault(name, threading.Lock())
+        with view_lock:
+            ## Another thread may have computed it while we waited
+            view = self._views.get(name)
+            if view is None:
+                view = compute()
+                with self._lock:
+                    self._views[name] = view
+                    self.conversions[name] = self.conversions.get(name, 0) + 1
+        return view
+
+    def get_image(self):
+        """
+        The frame at the analysis resolution. Every other view is derived
+        from this one.
+        """
+        if self.max_edge is None:
+            return self.frame
+        return self._get_view('resize',
+                              lambda: FrameContext.downscale(self.frame,
+                                                             self.max_edge))
+
+    def get_hsv(self):
+        """
+        HSV version of the frame.
+        NOTE: uses the RGB conversion the colour features were built with.
+        """
+        return self._get_view('hsv',
+                              lambda: cv2.cvtColor(self.get_image(),
+                                                   cv2.COLOR_RGB2HSV))
+
+    def get_gray(self):
+        """
+        Grayscale version of the frame
+        """
+        return self._get_view('gray',
+                              lambda: cv2.cvtColor(self.get_image(),
+                                                   cv2.COLOR_BGR2GRAY))
+
+    def get_blurred_gray(self):
+        """
+        Standardized grayscale, Gaussian blurred frame used for optical flow
+        """
+        return self._get_view('blurred_gray',
+                              lambda: cv2.GaussianBlur(self.get_gray(),
+                                                       (15,15), 0))
+
+    def get_thumbnail(self):
+        """
+        Small grayscale version of the frame (THUMBNAIL_EDGE pixels on the
+        long edge), for cheap frame-to-frame comparisons
+        """
+        return self._get_view('thumbnail',
+                              lambda: cv2.cvtColor(
+                                  FrameContext.downscale(self.get_image(),
+                                                         FrameContext.THUMBNAIL_EDGE),
+                                  cv2.COLOR_BGR2GRAY))
+
+    def num_conversions(self):
+        """
+        Total number of conversions computed for this frame
+        """
+        return sum(self.conversions.values())
+
+    @staticmethod
+    def downscale(frame, max_edge=None):
+        """
+        Downscale a frame so that its long edge is at most max_edge pixels,
+        keeping the aspect ratio. Frames that are already small enough are
+        returned unchanged.
+
+        ARGS:
+            frame: a single frame of video
+            max_edge: maximum length of the long edge, or None to keep the
+                      frame at its original size
+        RETURNS:
+            The (possibly) downscaled frame
+        """
+        if max_edge is None:
+            return frame
+        height, width = frame.shape[:2]
+        scale = float(max_edge) / max(height, width)
+        if scale >= 1:
+            return frame
+        size = (max(int(round(width * scale)), 1),
+                max(int(round(height * scale)), 1))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
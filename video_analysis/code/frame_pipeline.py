@@ -0,0 +1,167 @@
+import threading
+import Queue
+import numpy as np
+
+
+class FramePipeline(object):
+    """
+    Runs per-frame analysis as a pipeline:
+
+        decoder thread -> bounded frame queue -> analysis threads
+                       -> result queue -> caller (reassembled in frame order)
+
+    OpenCV releases the GIL while decoding and in most of its image
+    functions, so decoding and analysis of different frames overlap.
+
+    Queue occupancy is sampled every time a result is consumed. A frame
+    queue that stays full means analysis is the bottleneck; a frame queue
+    that stays empty means decoding is.
+    """
+
+    _DONE = object()
+
+    def __init__(self, analyze, num_workers=2, queue_size=None):
+        """
+        Default constructor
+
+        ARGS:
+            analyze: function called on every item from the frame source,
+                     returning that item's result. Must be thread safe.
+            num_workers: number of analysis threads
+            queue_size: capacity of the frame and result queues.
+                        Defaults to 4 items per worker.
+        RETURNS:
+            None
+        """
+        self.analyze = analyze
+        self.num_workers = max(int(num_workers), 1)
+        if queue_size is None:
+            queue_size = 4 * self.num_workers
+        self.queue_size = queue_size
+        self.frame_occupancy = []
+        self.result_occupancy = []
+
+    def run(self, items):
+        """
+        Analyze every item of a frame source.
+
+        ARGS:
+            items: iterable of items (e.g. decoded frames). It is consumed
+                   on the decoder thread.
+        RETURNS:
+            Generator of (item, result) tuples, in the order the source
+            produced the items
+        """
+        frame_queue = Queue.Queue(maxsize=self.queue_size)
+        result_queue = Queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        self.frame_occupancy = []
+        self.result_occupancy = []
+
+        def put(q, value):
+            ## Give up if the consumer has gone away
+            while not stop.is_set():
+                try:
+                    q.put(value, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def decode():
+            try:
+                for seq, item in enumerate(items):
+                    if not put(frame_queue, (seq, item)):
+                        return
+            except Exception as e:
+                put(result_queue, (None, e, None))
+            finally:
+                for _ in range(self.num_workers):
+                    put(frame_queue, FramePipeline._DONE)
+
+        def work():
+            while True:
+                task = frame_queue.get()
+                if task is FramePipeline._DONE:
+                    put(result_queue, FramePipeline._DONE)
+                    return
+                seq, item = task
+                try:
+                    result = self.analyze(item)
+                except Exception as e:
+                    put(result_queue, (None, e, None))
+                    return
+                if not put(result_queue, (seq, item, result)):
+                    return
+
+        threads = [threading.Thread(target=decode)]
+        threads += [threading.Thread(target=work)
+                    for _ in range(self.num_workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        ## Reassemble results in frame order
+        pending = {}
+        next_seq = 0
+        num_done = 0
+        try:
+            while num_done < self.num_workers:
+                out = result_queue.get()
+                self.frame_occupancy.append(frame_queue.qsize())
+                self.result_occupancy.append(result_queue.qsize())
+                if out is FramePipeline._DONE:
+                    num_done += 1
+                    continue
+                seq, item, result = out
+                if seq is None:
+                    raise item
+                pending[seq] = (item, result)
+                while next_seq in pending:
+                    yield pending.pop(next_seq)
+                    next_seq += 1
+        finally:
+            stop.set()
+
+    def stats(self):
+        """
+        Summarize queue occupancy over the last run
+
+        ARGS:
+            None
+        RETURNS:
+            Dictionary with the mean and max occupancy of each queue, as a
+            fraction of the queue capacity
+        """
+        out = {}
+        for name, samples in [('decoded', self.frame_occupancy),
+                              ('analyzed', self.result_occupancy)]:
+            samples = np.array(samples, dtype=float) / self.queue_size
+            out[name + '_queue_mean'] = samples.mean() if len(samples) else 0.
+            out[name + '_queue_max'] = samples.max() if len(samples) else 0.
+        return out
+
+    def report(self):
+        """
+        Human readable version of stats(), with a guess at the bottleneck
+
+        ARGS:
+            None
+        RETURNS:
+            String
+        """
+        stats = self.stats()
+        if stats['decoded_queue_mean'] > 0.5:
+            bottleneck = 'analysis'
+        else:
+            bottleneck = 'decode'
+        return ('-I- Pipeline (%d workers, queue size %d): '
+                'decoded queue %.0f%% full (max %.0f%%), '
+                'analyzed queue %.0f%% full (max %.0f%%). '
+                'Likely bottleneck: %s' %
+                (self.num_workers, self.queue_size,
+                 100 * stats['decoded_queue_mean'],
+                 100 * stats['decoded_queue_max'],
+                 100 * stats['analyzed_queue_mean'],
+                 100 * stats['analyzed_queue_max'],
+                 bottleneck))
@@ -0,0 +1,160 @@
+import numpy as np
+
+
+class FrameSampling(object):
+    """
+    Decides which frames a family of metrics is computed on.
+
+    Policies:
+        'all':       every frame
+        'stride':    every stride-th frame (frame_number % stride == 0)
+        'keyframes': only the given frame numbers, e.g. the video's
+                     I-frames from VideoUtilities.get_keyframes
+        'adaptive':  a stride that adapts to motion. After a frame with
+                     motion at or above motion_threshold the stride drops
+                     to min_stride; after each calm sample it doubles, up
+                     to max_stride.
+
+    VideoFeatureExtraction takes one FrameSampling per metric family
+    ('quality' and 'flow'). Frames that no family needs are skipped with
+    grab(), without being decoded.
+
+    The adaptive policy keeps state and is not thread-safe: wants,
+    sampled and observe must be called from one thread, in frame order.
+    """
+
+    def __init__(self, policy='all', stride=1, keyframes=None, min_stride=1,
+                 max_stride=30, motion_threshold=2.):
+        """
+        Default constructor
+
+        ARGS:
+            policy: 'all', 'stride', 'keyframes' or 'adaptive'
+            stride: stride of the 'stride' policy
+            keyframes: frame numbers of the 'keyframes' policy
+            min_stride, max_stride: stride range of the 'adaptive' policy
+            motion_threshold: mean absolute frame difference (see
+                              VideoUtilities.motion_energy) at or above
+                              which the 'adaptive' policy samples densely
+        RETURNS:
+            None
+        """
+        if policy not in ['all', 'stride', 'keyframes', 'adaptive']:
+            raise ValueError("Unknown sampling policy: %s" % policy)
+        if policy == 'keyframes' and keyframes is None:
+            raise ValueError("The keyframes policy needs keyframes")
+        self.policy = policy
+        self.stride = max(int(stride), 1)
+        self.keyframes = None
+        if keyframes is not None:
+            self.keyframes = set(int(i) for i in keyframes)
+        self.min_stride = max(int(min_stride), 1)
+        self.max_stride = max(int(max_stride), self.min_stride)
+        self.motion_threshold = motion_threshold
+        self.reset()
+
+    def get_config(self):
+        """
+        The policy's settings, without its adaptive state
+
+        ARGS:
+            None
+        RETURNS:
+            Tuple of settings, e.g. for cache keys
+        """
+        keyframes = None
+        if self.keyframes is not None:
+            keyframes = tuple(sorted(self.keyframes))
+        return (self.policy, self.stride, keyframes, self.min_stride,
+                self.max_stride, self.motion_threshold)
+
+    def reset(self):
+        """
+        Forget the adaptive state, e.g. at the start of a segment
+
+        ARGS:
+            None
+        RETURNS:
+            None
+        """
+        self.next_frame = 0
+        self.adaptive_stride = self.min_stride
+        self.last_motion = np.nan
+
+    def get_state(self):
+        """
+        The adaptive state, e.g. to resume from a checkpoint (see
+        FrameCheckpoint)
+
+        ARGS:
+            None
+        RETURNS:
+            Dictionary for set_state
+        """
+        return {'next_frame': self.next_frame,
+                'adaptive_stride': self.adaptive_stride,
+                'last_motion': self.last_motion}
+
+    def set_state(self, state):
+        """
+        Restore a state from get_state
+
+        ARGS:
+            state: dictionary from get_state
+        RETURNS:
+            None
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def wants(self, frame_number):
+        """
+        Whether the metrics should be computed on a frame. This does not
+        change any state, so it can be asked ahead of time.
+
+        ARGS:
+            frame_number: frame number
+        RETURNS:
+            Boolean
+        """
+        if self.policy == 'stride':
+            return frame_number % self.stride == 0
+        if self.policy == 'keyframes':
+            return frame_number in self.keyframes
+        if self.policy == 'adaptive':
+            return frame_number >= self.next_frame
+        return True
+
+    def sampled(self, frame_number):
+        """
+        Record that a frame was chosen, to schedule the next adaptive
+        sample
+
+        ARGS:
+            frame_number: frame number
+        RETURNS:
+            None
+        """
+        if self.policy != 'adaptive':
+            return
+        if not self.last_motion >= self.motion_threshold:
+            self.adaptive_stride = min(self.adaptive_stride * 2, self.max_stride)
+        self.next_frame = frame_number + self.adaptive_stride
+
+    def observe(self, frame_number, motion):
+        """
+        Feed the motion measured on a frame to the adaptive policy. High
+        motion brings the next sample forward.
+
+        ARGS:
+            frame_number: frame number
+            motion: mean absolute frame difference, or NaN if unknown
+        RETURNS:
+            None
+        """
+        if self.policy != 'adaptive' or np.isnan(motion):
+            return
+        self.last_motion = motion
+        if motion >= self.motion_threshold:
+            self.adaptive_stride = self.min_stride
+            self.next_frame = min(self.next_frame, frame_number + self.min_stride)
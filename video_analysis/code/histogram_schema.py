@@ -0,0 +1,94 @@
+import numpy as np
+
+
+class HistogramSchema(object):
+    """
+    Where the hue, saturation and value histogram bins of a table are, and
+    the values the bins stand for.
+
+    Column names are parsed once per table layout (tuple of column names),
+    and the schema is cached, so that per-scene code does not search every
+    column name on every call. When a histogram's columns are adjacent, as
+    they are in extracted data, they are addressed by a slice, so the bins
+    can be read as one contiguous block.
+
+    Scene tables also rank hue bins in top_color_*/summed_color_* columns
+    (see ScenePostprocess.to_df), which are found the same way.
+    """
+
+    ## Histograms, by column name prefix (see FrameAnalysis.get_hsv_hist_columns)
+    HISTOGRAMS = ['hue', 'sat', 'val']
+
+    ## Ranked hue bin columns of scene tables, by column name prefix
+    RANKINGS = ['top_color', 'summed_color']
+
+    _schemas = {}
+
+    def __init__(self, columns):
+        """
+        Default constructor. Use get, which caches schemas.
+
+        ARGS:
+            columns: column names of the table
+        RETURNS:
+            None
+        """
+        self.columns = tuple(columns)
+        self.index = {}
+        self.names = {}
+        self.values = {}
+        positions = []
+        for hist in HistogramSchema.HISTOGRAMS:
+            prefix = hist + '_bin_'
+            found = [i for i, c in enumerate(self.columns) if str(c).startswith(prefix)]
+            self.index[hist] = HistogramSchema._to_index(found)
+            self.names[hist] = [self.columns[i] for i in found]
+            ## Bin start value, from the name
+            self.values[hist] = np.array([float(str(self.columns[i])[len(prefix):])
+                                          for i in found])
+            positions += found
+        self.index['all'] = HistogramSchema._to_index(positions)
+        self.names['all'] = [self.columns[i] for i in positions]
+        for ranking in HistogramSchema.RANKINGS:
+            prefix = ranking + '_'
+            found = [i for i, c in enumerate(self.columns) if str(c).startswith(prefix)]
+            self.index[ranking] = HistogramSchema._to_index(found)
+            self.names[ranking] = [self.columns[i] for i in found]
+
+    @staticmethod
+    def _to_index(positions):
+        """
+        Slice for adjacent column positions, otherwise an index array
+        """
+        if positions and positions == list(range(positions[0], positions[-1] + 1)):
+            return slice(positions[0], positions[-1] + 1)
+        return np.array(positions, dtype=np.intp)
+
+    @staticmethod
+    def get(columns):
+        """
+        The schema of a table layout, built on first use
+
+        ARGS:
+            columns: column names, e.g. df.columns
+        RETURNS:
+            HistogramSchema
+        """
+        key = tuple(columns)
+        schema = HistogramSchema._schemas.get(key)
+        if schema is None:
+            schema = HistogramSchema(key)
+            HistogramSchema._schemas[key] = schema
+        return schema
+
+    def block(self, df, hist='all'):
+        """
+        Bin counts of one histogram (or all three, in hue, sat, val order)
+
+        ARGS:
+            df: dataframe with this schema's columns
+            hist: 'hue', 'sat', 'val' or 'all'
+        RETURNS:
+            (rows, bins) numpy array
+        """
+        return df.iloc[:, self.index[hist]].values
@@ -0,0 +1,369 @@
+import numpy as np
+import pandas as pd
+from flow_preprocess import FlowPreprocess
+from color_summary import ColorSummary
+from histogram_schema import HistogramSchema
+
+
+class SceneFeatures(object):
+    """
+    Computes the features of ScenePostprocess.to_df for every scene of one
+    or more videos at once.
+
+    Instead of one ScenePostprocess per scene, every quality and flow row
+    is labelled with a scene number, and each feature is a grouped
+    reduction (bincount, reduceat or a sort within scenes) over the whole
+    table. Rows are sorted by video and frame number first, so the rows of
+    a scene are contiguous.
+    """
+
+    ## Settings used by ScenePostprocess.to_df
+    NUM_COLORS = 10
+    BLUR_THRESHOLD = 100
+    MOTION_THRESHOLD = 1
+    STATIC_RATIO = .25
+    FRAME_SIZE = (480., 360.)
+
+    @staticmethod
+    def to_df(quality_df, flow_df, video_id=None, motion_df=None):
+        """
+        Scene features of one or more videos
+
+        ARGS:
+            quality_df: image quality dataframe with 'is_scene_transition'
+            flow_df: optical flow dataframe, in either layout accepted by
+                     FlowPreprocess, of the same video(s)
+            video_id: id of the video, if the dataframes hold one video.
+                      If None, rows are grouped into videos by their
+                      'video_id' column.
+            motion_df: optional dataframe with one row per frame sampled
+                       for flow, of the same video(s). Per-frame flow
+                       statistics are taken over its frames; without it,
+                       over the quality frames (see ScenePostprocess).
+        RETURNS:
+            Dataframe with one row per scene, in video and time order, with
+            the columns of ScenePostprocess.to_df followed by 'video_id'
+        """
+        if 'x0' not in flow_df.columns:
+            flow_df = FlowPreprocess.to_flat_layout(flow_df)
+        if 'distance' not in flow_df.columns or 'angle' not in flow_df.columns:
+            flow_df = FlowPreprocess.add_motion_columns(flow_df)
+
+        ## Videos as integer codes, in order of first appearance
+        if video_id is None and 'video_id' in quality_df.columns:
+            q_video, video_ids = pd.factorize(quality_df['video_id'].values)
+            f_video = pd.Index(video_ids).get_indexer(flow_df['video_id'].values)
+            if motion_df is not None:
+                m_video = pd.Index(video_ids).get_indexer(motion_df['video_id'].values)
+        else:
+            video_ids = np.array([video_id], dtype=object)
+            q_video = np.zeros(len(quality_df), dtype=np.int64)
+            f_video = np.zeros(len(flow_df), dtype=np.int64)
+            if motion_df is not None:
+                m_video = np.zeros(len(motion_df), dtype=np.int64)
+
+        ## Label quality rows. A scene starts at each video's first frame
+        ## and at each scene transition.
+        q_order = np.lexsort((quality_df['frame_number'].values, q_video))
+        q_video = q_video[q_order].astype(np.int64)
+        q_key = SceneFeatures._frame_key(q_video, quality_df['frame_number'].values[q_order])
+        first_row = np.r_[True, q_video[1:] != q_video[:-1]][:len(q_order)]
+        new_scene = first_row | (quality_df['is_scene_transition'].values[q_order] == 1)
+        q_offsets = np.append(np.flatnonzero(new_scene), len(q_order))
+        num_scenes = len(q_offsets) - 1
+
+        ## Label flow rows with the scene that started last at or before
+        ## their frame. A video's first scene starts at frame 0.
+        start_keys = np.where(first_row, q_video << 32, q_key)[new_scene]
+        keep = np.flatnonzero(f_video >= 0)
+        f_key = SceneFeatures._frame_key(f_video[keep].astype(np.int64),
+                                         flow_df['frame_number'].values[keep])
+        f_order = np.argsort(f_key, kind='mergesort')
+        f_key = f_key[f_order]
+        f_order = keep[f_order]
+        f_scene = np.searchsorted(start_keys, f_key, side='right') - 1
+        f_offsets = np.searchsorted(f_scene, np.arange(num_scenes + 1))
+
+        ## Frames flow was sampled on, per scene
+        num_flow_frames = np.diff(q_offsets)
+        frames_df, frame_rows, frame_key = quality_df, q_order, q_key
+        frame_scene = np.repeat(np.arange(num_scenes), num_flow_frames)
+        if motion_df is not None:
+            keep = np.flatnonzero(m_video >= 0)
+            m_key = SceneFeatures._frame_key(m_video[keep].astype(np.int64),
+                                             motion_df['frame_number'].values[keep])
+            m_scene = np.searchsorted(start_keys, m_key, side='right') - 1
+            num_flow_frames = np.bincount(m_scene[m_scene >= 0], minlength=num_scenes)
+            frames_df, frame_rows, frame_key = motion_df, keep, m_key
+            frame_scene = m_scene
+
+        ## Frames flow was computed on, and the number of frames each flow
+        ## row's distance covers (see ScenePostprocess._get_computed_flow)
+        num_computed_frames = num_flow_frames
+        f_gap = np.ones(len(f_key))
+        if 'flow_skipped' in frames_df.columns and len(frame_key) > 0:
+            skipped = frames_df['flow_skipped'].values[frame_rows] == 1
+            gap = np.ones(len(frame_rows))
+            if 'flow_gap' in frames_df.columns:
+                gap = np.maximum(frames_df['flow_gap'].values[frame_rows], 1)
+            gap[skipped] = 0
+            held = skipped & (frame_scene >= 0)
+            num_computed_frames = num_flow_frames - np.bincount(frame_scene[held],
+                                                                minlength=num_scenes)
+            key_order = np.argsort(frame_key, kind='mergesort')
+            pos = np.minimum(np.searchsorted(frame_key[key_order], f_key),
+                             len(key_order) - 1)
+            found = frame_key[key_order][pos] == f_key
+            f_gap = np.where(found, gap[key_order][pos], 1)
+
+        features = SceneFeatures._quality_features(quality_df, q_order, q_offsets)
+        features.update(SceneFeatures._flow_features(
+            flow_df, f_order, f_key, f_scene, f_offsets, num_flow_frames,
+            f_gap, num_computed_frames))
+
+        columns = ['top_color_%d' % n for n in range(SceneFeatures.NUM_COLORS)] + \
+            ['summed_color_%d' % n for n in range(SceneFeatures.NUM_COLORS)] + \
+            ['avg_sat', 'avg_val', 'black_pixel_pct', 'white_pixel_pct',
+             'flow_percentile_25', 'flow_percentile_50', 'flow_percentile_75',
+             'flow_avg', 'flow_angle', 'flow_angle_std_dev', 'is_static_scene',
+             'shake_coeff', 'avg_flow_pts_per_frame', 'blur', 'blur_pct',
+             'duration']
+        color_counts = features.pop('color_counts')
+        columns = [c for c in columns if c in features]
+        scene_df = pd.DataFrame(features, columns=columns)
+
+        ## Summed colour histograms and frame counts (see ColorSummary)
+        summary_df = pd.DataFrame(color_counts, columns=ColorSummary.COLUMNS)
+        summary_df['num_frames'] = np.diff(q_offsets)
+
+        video_df = pd.concat([scene_df, summary_df], axis=1)
+        video_df['video_id'] = video_ids[q_video[q_offsets[:-1]]]
+        return video_df
+
+    @staticmethod
+    def _frame_key(video, frame_number):
+        """
+        Sortable int64 key of (video code, frame number)
+        """
+        return (video << 32) + np.asarray(frame_number, dtype=np.int64)
+
+    @staticmethod
+    def _quality_features(quality_df, order, offsets):
+        """
+        Per-scene image quality features
+
+        ARGS:
+            quality_df: image quality dataframe
+            order: row order that makes scenes contiguous
+            offsets: scene i is rows offsets[i]:offsets[i + 1] of the
+                     reordered dataframe
+        RETURNS:
+            Dictionary of per-scene numpy arrays, by to_df column, plus
+            'color_counts' (scenes x ColorSummary.COLUMNS)
+        """
+        counts = np.diff(offsets)
+        starts = offsets[:-1]
+        features = {}
+        if len(starts) == 0:
+            features['color_counts'] = np.zeros((0, len(ColorSummary.COLUMNS)), dtype=np.uint32)
+            return features
+
+        def scene_sum(values):
+            return np.add.reduceat(values[order], starts, axis=0)
+
+        ## Colour, from per-frame votes and from the summed histograms
+        schema = HistogramSchema.get(quality_df.columns)
+        if schema.names['all'] != ColorSummary.COLUMNS:
+            raise ValueError("Dataframe does not have the histogram columns")
+        hue_names = np.array(schema.names['hue'], dtype=object)
+        top = SceneFeatures._vote_top_colors(schema.block(quality_df, 'hue')[order],
+                                             starts, SceneFeatures.NUM_COLORS)
+        for n in range(top.shape[1]):
+            features['top_color_%d' % n] = hue_names[top[:, n]]
+
+        color_counts = scene_sum(schema.block(quality_df).astype(np.uint64))
+        summary_schema = HistogramSchema.get(ColorSummary.COLUMNS)
+        hue = color_counts[:, summary_schema.index['hue']].astype(np.float64)
+        top = np.argsort(-hue, axis=1, kind='mergesort')[:, :SceneFeatures.NUM_COLORS]
+        for n in range(top.shape[1]):
+            features['summed_color_%d' % n] = hue_names[top[:, n]]
+
+        for hist, name in [('sat', 'avg_sat'), ('val', 'avg_val')]:
+            hist_counts = color_counts[:, summary_schema.index[hist]].astype(np.float64)
+            total = hist_counts.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                features[name] = np.where(total > 0,
+                                          hist_counts.dot(summary_schema.values[hist]) / total,
+                                          np.nan)
+        features['color_counts'] = ColorSummary._compact(color_counts)
+
+        ## Black and white pixels, as a share of all pixels
+        if 'num_pixels' in quality_df.columns:
+            total_pixels = scene_sum(quality_df['num_pixels'].values).astype(np.float64)
+        else:
+            frame_size = SceneFeatures.FRAME_SIZE
+            total_pixels = counts * frame_size[0] * frame_size[1]
+        for name in ['black', 'white']:
+            pixels = scene_sum(quality_df['num_%s_pixels' % name].values)
+            features['%s_pixel_pct' % name] = pixels / total_pixels
+
+        ## Blur and duration
+        blur = quality_df['blur'].values.astype(np.float64)
+        features['blur'] = scene_sum(blur) / counts
+        features['blur_pct'] = 1. * scene_sum((blur < SceneFeatures.BLUR_THRESHOLD).astype(np.int64)) / counts
+        time = quality_df['time'].values[order]
+        features['duration'] = np.maximum.reduceat(time, starts) - \
+            np.minimum.reduceat(time, starts)
+        return features
+
+    @staticmethod
+    def _vote_top_colors(hue, starts, num_colors):
+        """
+        Top hue bins of each scene by per-frame votes, as in
+        ScenePostprocess.get_top_colors: each frame votes for its
+        num_colors most common bins (ties to the later bin), and bins are
+        ranked by votes (ties to the bin voted for first).
+
+        ARGS:
+            hue: frames x hue bins counts, scenes contiguous and in frame
+                 order
+            starts: first row of each scene, of at least one frame each
+            num_colors: number of bins to return per scene
+        RETURNS:
+            scenes x min(num_colors, bins) array of hue bin indices, most
+            voted first
+        """
+        num_frames, num_bins = hue.shape
+        num_top = min(num_colors, num_bins)
+        if num_top == 0:
+            return np.zeros((len(starts), 0), dtype=np.int64)
+
+        ## Each frame's top bins, from most to least common. The sort key
+        ## is unique per bin: count first, then bin index (later wins).
+        keys = hue.astype(np.int64) * num_bins + np.arange(num_bins)
+        rows = np.arange(num_frames)[:, np.newaxis]
+        top = np.argpartition(-keys, num_top - 1, axis=1)[:, :num_top]
+        top = top[rows, np.argsort(-keys[rows, top], axis=1)]
+
+        ## Votes and first vote of every (scene, bin). Votes are in scene
+        ## and frame order, so the first overall is the first in its scene.
+        scene = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, num_frames)))
+        votes = (scene[:, np.newaxis] * num_bins + top).ravel()
+        counts = np.bincount(votes, minlength=len(starts) * num_bins)
+        first_vote = np.empty(len(counts), dtype=np.int64)
+        first_vote.fill(len(votes))
+        voted, first_index = np.unique(votes, return_index=True)
+        first_vote[voted] = first_index
+
+        ## Rank the bins of each scene. Every frame votes for num_top
+        ## distinct bins, so the first num_top ranked bins have votes.
+        order = np.lexsort((first_vote, -counts, np.arange(len(counts)) // num_bins))
+        return order.reshape(len(starts), num_bins)[:, :num_top] % num_bins
+
+    @staticmethod
+    def _flow_features(flow_df, order, key, scene, offsets, num_frames, gap,
+                       num_computed_frames):
+        """
+        Per-scene optical flow features
+
+        ARGS:
+            flow_df: flat optical flow dataframe with 'distance' and 'angle'
+            order: rows of flow_df, sorted by video and frame number
+            key: (video, frame number) key of each row in order
+            scene: scene of each row in order
+            offsets: scene i is rows offsets[i]:offsets[i + 1] of order
+            num_frames: number of frames flow was sampled on in each scene
+            gap: number of frames the distance of each row in order covers,
+                 0 for frames held by the motion gate
+            num_computed_frames: number of frames flow was computed on
+                                 (not held) in each scene
+        RETURNS:
+            Dictionary of per-scene numpy arrays, by to_df column
+        """
+        num_scenes = len(offsets) - 1
+        counts = np.diff(offsets)
+        distance = flow_df['distance'].values[order].astype(np.float64)
+        angle = flow_df['angle'].values[order].astype(np.float64)
+
+        def scene_mean(values, groups, offsets):
+            n = np.diff(offsets)
+            total = np.bincount(groups, weights=values, minlength=len(n))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(n > 0, total / n, np.nan)
+
+        features = {}
+        ## As in ScenePostprocess.to_df, every percentile column holds the
+        ## 25th percentile
+        percentile = SceneFeatures._grouped_quantile(distance, scene, offsets, 0.25)
+        for name in ['flow_percentile_25', 'flow_percentile_50', 'flow_percentile_75']:
+            features[name] = percentile
+        features['flow_avg'] = scene_mean(distance, scene, offsets)
+
+        ## Angle mean and sample standard deviation
+        angle_mean = scene_mean(angle, scene, offsets)
+        features['flow_angle'] = angle_mean
+        squares = np.bincount(scene, weights=(angle - angle_mean[scene]) ** 2,
+                              minlength=num_scenes)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features['flow_angle_std_dev'] = np.where(counts > 1,
+                                                      np.sqrt(squares / (counts - 1)),
+                                                      np.nan)
+
+        ## Computed frames within scenes, with distances per frame: shake
+        ## is the mean of the per-frame median distances
+        computed = gap > 0
+        frame_distance = distance[computed] / gap[computed]
+        computed_key = key[computed]
+        computed_scene = scene[computed]
+        frame_start = np.r_[True, computed_key[1:] != computed_key[:-1]][:len(computed_key)]
+        frame = np.cumsum(frame_start) - 1
+        frame_offsets = np.append(np.flatnonzero(frame_start), len(computed_key))
+        frame_scene = computed_scene[frame_start]
+        medians = SceneFeatures._grouped_quantile(frame_distance, frame, frame_offsets, 0.5)
+        shake = scene_mean(medians, frame_scene,
+                           np.searchsorted(frame_scene, np.arange(num_scenes + 1)))
+        computed_counts = np.bincount(computed_scene, minlength=num_scenes)
+        features['shake_coeff'] = np.where(computed_counts > 0, shake, 0)
+
+        ## Static if no point moved, or fewer than STATIC_RATIO of the
+        ## computed frames have a moving point
+        moving = frame_distance > SceneFeatures.MOTION_THRESHOLD
+        moving_frames = np.bincount(frame_scene[np.unique(frame[moving])],
+                                    minlength=num_scenes)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features['is_static_scene'] = (moving_frames == 0) | \
+                (1. * moving_frames / num_computed_frames < SceneFeatures.STATIC_RATIO)
+            features['avg_flow_pts_per_frame'] = np.where(num_frames > 0,
+                                                          1. * counts / num_frames, 0.)
+        return features
+
+    @staticmethod
+    def _grouped_quantile(values, groups, offsets, q):
+        """
+        Quantile of each group of values, interpolated linearly as in
+        pandas' Series.quantile. Empty groups get NaN.
+
+        ARGS:
+            values: flat float array
+            groups: group of each value, non-decreasing
+            offsets: group i is values[offsets[i]:offsets[i + 1]]
+            q: quantile, between 0 and 1
+        RETURNS:
+            numpy float64 array with one value per group
+        """
+        counts = np.diff(offsets)
+        out = np.empty(len(counts))
+        out.fill(np.nan)
+        nonempty = counts > 0
+        if not nonempty.any():
+            return out
+
+        ## Sort within groups
+        ordered = values[np.lexsort((values, groups))]
+        starts = offsets[:-1][nonempty]
+        pos = q * (counts[nonempty] - 1)
+        lower = np.floor(pos).astype(np.int64)
+        upper = np.ceil(pos).astype(np.int64)
+        low_values = ordered[starts + lower]
+        out[nonempty] = low_values + (ordered[starts + upper] - low_values) * (pos - lower)
+        return out
@@ -1,64 +1,65 @@
 import pandas as pd
 import numpy as np
-import re
-from collections import Counter
 from flow_preprocess import FlowPreprocess
+from color_summary import ColorSummary
+from histogram_schema import HistogramSchema
 
 class ScenePostprocess(object):
     """
     Heavy-lifting macro-feature class
     """
 
-    def __init__(self, flow_df, quality_df, remove_transitions=False):
+    def __init__(self, flow_df, quality_df, remove_transitions=False,
+                 motion_df=None):
         """
-        Default constructor
+        Default constructor. The dataframes are not copied (they can be
+        slices of a whole video's dataframes, see VideoPostprocess), unless
+        the flow data has to be converted or extended.
         Args:
-            flow_df: Optical flow dataframe
-            quality_df: Image quality dataframe
+            flow_df: Optical flow dataframe, in either layout accepted by
+                     FlowPreprocess (converted to the flat layout). If it
+                     already has 'distance' and 'angle' columns, they are
+                     used as they are.
+            quality_df: Image quality dataframe. Not modified.
             remove_transitions: whether to remove frames around
                                 scene transitions
+            motion_df: optional dataframe with one row per frame sampled
+                       for flow (see VideoFeatureExtraction._motion_df).
+                       Per-frame flow statistics are averaged over its
+                       frames; without it, over the image quality frames,
+                       which is only right if both were sampled alike.
+                       Its flow_skipped and flow_gap columns correct
+                       shake and is_static for the motion gate (see
+                       _get_computed_flow).
         Returns:
             Nothing
         """
-        self.flow_df = flow_df.copy()
-        self.quality_df = quality_df.copy()
+        if 'x0' not in flow_df.columns:
+            flow_df = FlowPreprocess.to_flat_layout(flow_df)
+        if 'distance' not in flow_df.columns or 'angle' not in flow_df.columns:
+            flow_df = FlowPreprocess.add_motion_columns(flow_df)
+        self.flow_df = flow_df
+        self.quality_df = quality_df
         self.remove_transitions = remove_transitions
         self.is_static = None
         self.duration = self.get_duration()
         self.num_frames = quality_df.shape[0]
+        self.motion_df = motion_df
+        self.num_flow_frames = self.num_frames
+        if motion_df is not None:
+            self.num_flow_frames = motion_df.shape[0]
 
-        ## Do some rudimentary cleaning of/addding to the flow data
-        self.flow_df['distance'] = FlowPreprocess.flow_distances(self.flow_df)
-        self.flow_df['angle'] = FlowPreprocess.flow_angles(self.flow_df)
+        ## Summed colour histograms, which merge across scenes
+        self.color_summary = ColorSummary.from_df(self.quality_df)
 
-        ## Add scene-centric timestamps
+        ## Scene-centric timestamps are time - scene_time_offset
         ## TODO: This has a few issues with actual start times...
-        scene_time_offset = self.quality_df['time'].min()
-
-        self.flow_df['time_scene'] = self.flow_df['time'] - scene_time_offset
-        self.quality_df['time_scene'] = self.quality_df['time'] - scene_time_offset
-        self.min_time_scene = self.quality_df['time_scene'].min()
-        self.max_time_scene =self.quality_df['time_scene'].max()
+        self.scene_time_offset = self.quality_df['time'].min()
+        self.min_time_scene = self.quality_df['time'].min() - self.scene_time_offset
+        self.max_time_scene = self.quality_df['time'].max() - self.scene_time_offset
         self.min_frame_num = self.quality_df['frame_number'].min()
         self.max_frame_num = self.quality_df['frame_number'].max()
 
-    def _find_columns_by_name(self, df, name_re):
-        """
-        Helper function to find binned features by the prefixes in their names
-
-        Args:
-            df:         Dataframe
-            name_re:    regular expression for finding colmns
-        Returns:
-            List of columns that have names that match name_re
-        """
-        output = []
-        cols = df.columns
-        for c in cols:
-            if re.search(name_re, c):
-                output.append(c)
-        return output
-
     def get_duration(self):
         """
         Find scene duration (in seconds)
@@ -100,7 +101,11 @@ class ScenePostprocess(object):
 
     def get_top_colors(self, num_colors=10):
         """
-        Find the dominant colors in all frames across the scene
+        Find the dominant colors in all frames across the scene. Each frame
+        votes for its num_colors most common hue bins, and the bins with
+        the most votes are returned. Ties between bins of equal count in a
+        frame go to the later bin; ties between equal numbers of votes go
+        to the bin first ranked in the earliest frame.
         NOTE:   This can be sped if only a subset of frames are sampled.
                 Need to run experiments on the optimal sampling rate.
         TODO:   This approach should be changed in v2.0
@@ -109,39 +114,37 @@ class ScenePostprocess(object):
             num_colors: The number of most common colors to return.
                         This is 10 by default.
         Returns:
-            Numpy array containing the most prevalent colors in the scene
+            List of the names of the most prevalent hue columns in the scene
         """
         self.num_colors = num_colors
-        max_color_array = np.array(str)
 
-        cols = self._find_columns_by_name(self.quality_df, "hue")
-        for frame_num in range(self.min_frame_num, self.max_frame_num + 1):
-            frame_color_array = self.quality_df[cols].ix[frame_num].sort_values()[::-1].index.values[:self.num_colors]
-            max_color_array = np.append(max_color_array, frame_color_array)
-
-        ## Find most common colors
-        color_count = Counter(max_color_array)
-        return map(lambda x: x[0], color_count.most_common(self.num_colors))
-
-    def _get_values_from_bin_names(self, cols):
-        """
-        From a list of columns representing bins, return a list of the values
-        of those bins
-
-        Args:
-            cols: a list of column names of histogram bins
-        Returns:
-            A list of the value of each bin
-        """
-        values = []
-        for c in cols:
-            matches = re.search('_(\d+.\d+)', c)
-            if matches:
-                values.append(float(matches.groups(0)[0]))
-            else:
-                ## This should never happen, but just in case...
-                values.append(None)
-        return values
+        schema = HistogramSchema.get(self.quality_df.columns)
+        cols = schema.names['hue']
+        num_bins = len(cols)
+        num_top = min(num_colors, num_bins)
+        if num_top == 0 or self.quality_df.empty:
+            return []
+
+        ## Unique sort key per bin: count first, then bin index (later wins)
+        keys = schema.block(self.quality_df, 'hue').astype(np.int64) * num_bins + \
+            np.arange(num_bins)
+
+        ## Each frame's top bins, then ordered from most to least common
+        rows = np.arange(len(keys))[:, np.newaxis]
+        top = np.argpartition(-keys, num_top - 1, axis=1)[:, :num_top]
+        top = top[rows, np.argsort(-keys[rows, top], axis=1)]
+
+        ## Count the votes
+        votes = top.ravel()
+        counts = np.bincount(votes, minlength=num_bins)
+        first_vote = np.empty(num_bins, dtype=np.int64)
+        first_vote.fill(len(votes))
+        voted, first_index = np.unique(votes, return_index=True)
+        first_vote[voted] = first_index
+
+        order = np.lexsort((first_vote, -counts))
+        order = order[counts[order] > 0][:num_colors]
+        return [cols[i] for i in order]
 
     def get_avg_saturation(self):
         """
@@ -152,12 +155,7 @@ class ScenePostprocess(object):
         Returns:
             A float value of average scene saturation
         """
-        cols = self._find_columns_by_name(self.quality_df, "sat")
-        vals = self._get_values_from_bin_names(cols)
-        sums = self.quality_df[cols].sum()
-
-        avg = np.sum((sums * vals).values)/np.sum(sums)
-        return avg
+        return self.color_summary.get_avg_saturation()
 
     def get_avg_value(self):
         """
@@ -169,26 +167,28 @@ class ScenePostprocess(object):
         Returns:
             A float value of average scene HSV value
         """
-        cols = self._find_columns_by_name(self.quality_df, "val")
-        vals = self._get_values_from_bin_names(cols)
-        sums = self.quality_df[cols].sum()
-
-        avg = np.sum((sums * vals).values)/np.sum(sums)
-        return avg
+        return self.color_summary.get_avg_value()
 
     def get_pixel_pct(self, col_name, frame_size=(480., 360.)):
         """
-        Calculates the number of pixels in a scene are in col_name
+        Calculates the number of pixels in a scene are in col_name.
+        Counts are normalised by the number of pixels each frame was
+        analyzed at ('num_pixels'), so scenes are comparable across
+        source and analysis resolutions.
 
         Args:
             col_name: the name of column of interest
-            frame_size:
+            frame_size: frame size to assume for data extracted before
+                        'num_pixels' was recorded
         Returns:
             Proportion of pixels that are in the column of interest
         """
-        frame_pixels = frame_size[0] * frame_size[1]
-        num_frames = self.quality_df.shape[0]
-        total_pixels = frame_pixels * num_frames
+        if 'num_pixels' in self.quality_df.columns:
+            total_pixels = 1. * np.sum(self.quality_df['num_pixels'])
+        else:
+            frame_pixels = frame_size[0] * frame_size[1]
+            num_frames = self.quality_df.shape[0]
+            total_pixels = frame_pixels * num_frames
         pixel_cnt = np.sum(self.quality_df[col_name])
         return pixel_cnt / total_pixels
 
@@ -226,7 +226,8 @@ class ScenePostprocess(object):
         """
         Return the shakiness of the scene. Shake is calculated by finding the
         median distance an optical flow point has traveled in each frame, and
-        averaging these values.
+        averaging these values over the frames flow was computed on (see
+        _get_computed_flow).
         TODO: vector addition.
 
         Args:
@@ -234,12 +235,49 @@ class ScenePostprocess(object):
         Returns:
             A float value representing the shakiness of a scene.
         """
-        if not self.flow_df.empty:
-            shake = np.mean((self.flow_df.groupby('frame_number').median())['distance'])
+        computed, distance, _ = self._get_computed_flow()
+        if computed.any():
+            frame_numbers = self.flow_df['frame_number'].values[computed]
+            shake = np.mean(pd.Series(distance[computed]).groupby(frame_numbers).median())
         else:
             shake = 0
         return shake
 
+    def _get_computed_flow(self):
+        """
+        Flow distances per frame, on the frames flow was computed on.
+
+        Frames held by the motion gate (flow_skipped) report no motion, and
+        the next computed frame reports the whole displacement since the
+        last one (see FlowTracker). Held frames are therefore left out, and
+        distances are divided by flow_gap, the number of frames they cover.
+        Gaps and held frames come from the motion dataframe, or the image
+        quality dataframe without one. Without those columns every frame
+        counts, with a gap of 1.
+
+        Args:
+            None
+        Returns:
+            Tuple of (boolean mask of the flow rows of computed frames,
+            distance per frame of every flow row, number of computed frames)
+        """
+        distance = self.flow_df['distance'].values.astype(np.float64)
+        computed = np.ones(len(distance), dtype=bool)
+        frames_df = self.motion_df if self.motion_df is not None else self.quality_df
+        if 'flow_skipped' not in frames_df.columns:
+            return computed, distance, self.num_flow_frames
+
+        skipped = frames_df['flow_skipped'].values == 1
+        gap = np.ones(len(frames_df))
+        if 'flow_gap' in frames_df.columns:
+            gap = np.maximum(frames_df['flow_gap'].values, 1)
+        gap = pd.Series(np.where(skipped, 0, gap), index=frames_df['frame_number'].values)
+        row_gap = gap.reindex(self.flow_df['frame_number'].values).fillna(1).values
+        computed = row_gap > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            distance = np.where(computed, distance / row_gap, 0.)
+        return computed, distance, self.num_flow_frames - int(skipped.sum())
+
     def get_flow_angle(self):
         """
         Find the average angle of travel of the optical flow points in a scene.
@@ -274,9 +312,10 @@ class ScenePostprocess(object):
             A boolean value of whether a scene is static or not.
         """
         is_static = None
-        motion_threshold = 1    # one pixel of movement
+        motion_threshold = 1    # one pixel of movement per frame
         total_flow_points = self.flow_df.shape[0]   ## number of frames in range
-        thresholded_df = self.flow_df[self.flow_df['distance'] > motion_threshold].copy()
+        computed, distance, num_computed_frames = self._get_computed_flow()
+        thresholded_df = self.flow_df[computed & (distance > motion_threshold)]
 
         if thresholded_df.empty:
             is_static = True
@@ -289,20 +328,21 @@ class ScenePostprocess(object):
 
                 ## Ensure that scene is long enough to remove buffer from analysis
                 if self.max_time_scene > transition_time_buffer:
-                    thresholded_df = thresholded_df[thresholded_df['time_scene'] > transition_time_buffer]
-                    thresholded_df = thresholded_df[thresholded_df['time_scene'] < self.max_time_scene - transition_time_buffer]
+                    time_scene = thresholded_df['time'] - self.scene_time_offset
+                    thresholded_df = thresholded_df[(time_scene > transition_time_buffer) &
+                                                    (time_scene < self.max_time_scene - transition_time_buffer)]
                 ## Do not remove transitions if scene is too short
                 else:
                     pass
 
             if not thresholded_df.empty:
                 ##moving_flow_points = thresholded_df.shape[0]
-                moving_frames = thresholded_df.groupby(by=['frame_number']).mean().shape[0]
+                moving_frames = thresholded_df['frame_number'].nunique()
             else:
                 ##moving_flow_points = 0
                 moving_frames = 0
             ##pts_ratio = 1. * moving_flow_points/self.num_frames
-            pts_ratio = 1. * moving_frames/self.num_frames
+            pts_ratio = 1. * moving_frames/num_computed_frames
 
             # less than 1 moving frame per 4 frames
             is_static = pts_ratio < .25
@@ -334,13 +374,17 @@ class ScenePostprocess(object):
             None
         Returns:
             A float value of the average number of trackable optical flow
-            points in all of the scene's frames
+            points in all of the scene's frames (that flow was sampled on)
         """
-        return 1. * len(self.flow_df) / self.num_frames
+        if self.num_flow_frames == 0:
+            return 0.
+        return 1. * len(self.flow_df) / self.num_flow_frames
 
     def to_df(self):
         """
-        Return a dataframe containing all features
+        Return a dataframe containing all features, followed by the scene's
+        summed colour histograms and frame count (see ColorSummary), so
+        scenes can be merged without their frames.
         TODO: better type checking
 
         Args:
@@ -350,9 +394,14 @@ class ScenePostprocess(object):
         """
         scene_df = pd.DataFrame(index=[0])
 
+        ## Top colors by per-frame votes, then by pixel count (from the
+        ## mergeable summary)
         top_colors = self.get_top_colors()
-        for n in range(self.num_colors):
-            scene_df['top_color_' + str(n)] = top_colors[n]
+        for n, color in enumerate(top_colors):
+            scene_df['top_color_' + str(n)] = color
+        summed_colors = self.color_summary.get_top_colors()
+        for n, color in enumerate(summed_colors):
+            scene_df['summed_color_' + str(n)] = color
         scene_df['avg_sat'] = self.get_avg_saturation()
         scene_df['avg_val'] = self.get_avg_value()
         scene_df['black_pixel_pct'] = self.get_pixel_pct('num_black_pixels')
@@ -374,4 +423,4 @@ class ScenePostprocess(object):
 
         scene_df['duration'] = self.get_duration()
 
-        return scene_df
+        return pd.concat([scene_df, self.color_summary.to_df()], axis=1)
@@ -0,0 +1,82 @@
+import unittest
+import numpy as np
+import pandas as pd
+from color_summary import ColorSummary
+from histogram_schema import HistogramSchema
+
+
+def make_quality_df(num_frames, seed=0):
+    """
+    Image quality dataframe with random histograms
+    """
+    rng = np.random.RandomState(seed)
+    quality_df = pd.DataFrame(rng.randint(0, 1000, size=(num_frames, len(ColorSummary.COLUMNS))),
+                              columns=ColorSummary.COLUMNS)
+    quality_df['frame_number'] = np.arange(num_frames)
+    return quality_df
+
+
+class ColorSummaryTest(unittest.TestCase):
+    """
+    Summaries of scenes added up against the summary of all their frames
+    """
+
+    def assert_same_summary(self, summary, expected):
+        self.assertTrue(np.array_equal(summary.counts, expected.counts))
+        self.assertEqual(summary.num_frames, expected.num_frames)
+        self.assertEqual(summary.get_top_colors(), expected.get_top_colors())
+        self.assertAlmostEqual(summary.get_avg_saturation(), expected.get_avg_saturation())
+        self.assertAlmostEqual(summary.get_avg_value(), expected.get_avg_value())
+
+    def test_scenes_add_up(self):
+        quality_df = make_quality_df(50)
+        expected = ColorSummary.from_df(quality_df)
+        self.assertTrue(np.array_equal(expected.counts,
+                                       quality_df[ColorSummary.COLUMNS].values.sum(axis=0)))
+        self.assertEqual(expected.num_frames, 50)
+
+        scenes = [quality_df.iloc[start:end] for start, end in [(0, 7), (7, 30), (30, 50)]]
+        summaries = [ColorSummary.from_df(scene_df) for scene_df in scenes]
+        self.assert_same_summary(summaries[0] + summaries[1] + summaries[2], expected)
+        self.assert_same_summary(ColorSummary.merge(summaries), expected)
+
+        ## Scene rows written by to_df summarise to the whole video
+        scene_df = pd.concat([summary.to_df() for summary in summaries], ignore_index=True)
+        self.assert_same_summary(ColorSummary.from_df(scene_df), expected)
+
+    def test_empty(self):
+        summary = ColorSummary.merge([])
+        self.assertEqual(summary.num_frames, 0)
+        self.assertTrue(np.isnan(summary.get_avg_saturation()))
+        self.assert_same_summary(summary + ColorSummary.from_df(make_quality_df(5)),
+                                 ColorSummary.from_df(make_quality_df(5)))
+
+    def test_averages(self):
+        quality_df = make_quality_df(10, seed=1)
+        schema = HistogramSchema.get(quality_df.columns)
+        counts = quality_df[schema.names['sat']].values.sum(axis=0)
+        expected = np.dot(counts, schema.values['sat']) / float(counts.sum())
+        self.assertAlmostEqual(ColorSummary.from_df(quality_df).get_avg_saturation(), expected)
+
+    def test_top_color_ties(self):
+        ## Ties go to the lower bin
+        names = HistogramSchema.get(ColorSummary.COLUMNS).names['hue']
+        counts = np.zeros(len(ColorSummary.COLUMNS), dtype=np.uint32)
+        counts[[3, 60, 10]] = [5, 7, 5]
+        self.assertEqual(ColorSummary(counts, 1).get_top_colors(3),
+                         [names[60], names[3], names[10]])
+
+    def test_overflow(self):
+        ## Sums past uint32 are kept as uint64
+        counts = np.zeros(len(ColorSummary.COLUMNS), dtype=np.uint32)
+        counts[0] = np.iinfo(np.uint32).max
+        summary = ColorSummary(counts, 1)
+        self.assertEqual(summary.counts.dtype, np.uint32)
+        total = summary + summary
+        self.assertEqual(total.counts.dtype, np.uint64)
+        self.assertEqual(int(total.counts[0]), 2 * int(np.iinfo(np.uint32).max))
+        self.assertEqual(ColorSummary.from_df(total.to_df()).counts[0], total.counts[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+from extraction_cache import ExtractionCache
+
+
+def make_dfs(num_rows):
+    """
+    Image quality, flow and motion dataframes of num_rows rows
+    """
+    frames = np.arange(num_rows)
+    return (pd.DataFrame({'frame_number': frames, 'blur': frames * 1.}),
+            pd.DataFrame({'frame_number': frames, 'x0': frames * 2.}),
+            pd.DataFrame({'frame_number': frames, 'motion_mean': frames * 3.}))
+
+
+class ExtractionCacheTest(unittest.TestCase):
+    """
+    Keys, lookups and LRU eviction of ExtractionCache
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.video = os.path.join(self.directory, 'video.mp4')
+        with open(self.video, 'wb') as f:
+            f.write(np.random.RandomState(0).bytes(300000))
+        self.config = {'max_edge': 360, 'backend': 'opencv'}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_renamed_video_hits(self):
+        cache = ExtractionCache(os.path.join(self.directory, 'cache'))
+        dfs = make_dfs(10)
+        cache.put(ExtractionCache.key(self.video, self.config), *dfs)
+
+        renamed = os.path.join(self.directory, 'renamed.mp4')
+        os.rename(self.video, renamed)
+        cached = cache.get(ExtractionCache.key(renamed, self.config))
+        self.assertTrue(cached is not None)
+        for df, cached_df in zip(dfs, cached):
+            assert_frame_equal(df, cached_df)
+
+    def test_changed_config_misses(self):
+        cache = ExtractionCache(os.path.join(self.directory, 'cache'))
+        key = ExtractionCache.key(self.video, self.config)
+        cache.put(key, *make_dfs(10))
+
+        config = dict(self.config, max_edge=720)
+        other_key = ExtractionCache.key(self.video, config)
+        self.assertNotEqual(key, other_key)
+        self.assertTrue(cache.get(other_key) is None)
+
+    def test_changed_content_misses(self):
+        key = ExtractionCache.key(self.video, self.config)
+        with open(self.video, 'r+b') as f:
+            f.write(b'changed')
+        self.assertNotEqual(key, ExtractionCache.key(self.video, self.config))
+
+    def test_lru_eviction(self):
+        cache_dir = os.path.join(self.directory, 'cache')
+        cache = ExtractionCache(cache_dir)
+        cache.put('a', *make_dfs(100))
+        entry_size = ExtractionCache._dir_size(os.path.join(cache_dir, 'a'))
+
+        ## Room for two entries. 'a' is used after 'b', so 'b' goes first.
+        cache.max_bytes = int(2.5 * entry_size)
+        cache.put('b', *make_dfs(100))
+        os.utime(os.path.join(cache_dir, 'a'), (1000, 1000))
+        os.utime(os.path.join(cache_dir, 'b'), (2000, 2000))
+        cache.get('a')
+        cache.put('c', *make_dfs(100))
+        self.assertEqual(sorted(os.listdir(cache_dir)), ['a', 'c'])
+
+        ## The entry just stored is kept even if it is the oldest
+        cache.max_bytes = None
+        cache.put('d', *make_dfs(100))
+        os.utime(os.path.join(cache_dir, 'd'), (1000, 1000))
+        cache.max_bytes = int(1.5 * entry_size)
+        self.assertEqual(sorted(cache.evict(keep='d')), ['a', 'c'])
+        self.assertEqual(os.listdir(cache_dir), ['d'])
+
+    def test_oversized_entry_not_stored(self):
+        cache_dir = os.path.join(self.directory, 'cache')
+        cache = ExtractionCache(cache_dir, max_bytes=100)
+        cache.put('a', *make_dfs(100))
+        self.assertTrue(cache.get('a') is None)
+        self.assertEqual(os.listdir(cache_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+from flow_preprocess import FlowPreprocess
+
+
+def object_layout_df(num_points=20, seed=0):
+    """
+    Flow dataframe in the layout of .flow.pkl files written before
+    FLOW_SCHEMA: one row per point, positions as (2,) arrays in object
+    columns
+    """
+    rng = np.random.RandomState(seed)
+    old_pos = (rng.rand(num_points, 2) * 100).astype(np.float32)
+    new_pos = old_pos + rng.randn(num_points, 2).astype(np.float32)
+    frames = np.sort(rng.randint(0, 5, size=num_points))
+    df = pd.DataFrame({'flow_st': rng.randint(0, 2, size=num_points),
+                       'flow_err': rng.rand(num_points),
+                       'video_id': 'test',
+                       'frame_number': frames,
+                       'time': frames / 30.})
+    df['flow_pt_pos(t)'] = list(new_pos)
+    df['flow_pt_pos(t-1)'] = list(old_pos)
+    return df
+
+
+class FlatLayoutTest(unittest.TestCase):
+    """
+    Conversion of flow dataframes to the flat FLOW_SCHEMA layout
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_to_flat_layout(self):
+        df = object_layout_df()
+        flat_df = FlowPreprocess.to_flat_layout(df)
+        names = [name for name, _ in FlowPreprocess.FLOW_SCHEMA]
+        self.assertEqual(list(flat_df.columns), ['video_id'] + names)
+        for name, dtype in FlowPreprocess.FLOW_SCHEMA:
+            self.assertEqual(flat_df[name].dtype, np.dtype(dtype))
+
+        new_pos = np.vstack(df['flow_pt_pos(t)'].values)
+        old_pos = np.vstack(df['flow_pt_pos(t-1)'].values)
+        self.assertTrue(np.array_equal(flat_df[['x1', 'y1']].values, new_pos))
+        self.assertTrue(np.array_equal(flat_df[['x0', 'y0']].values, old_pos))
+        self.assertTrue(np.array_equal(flat_df['frame_number'].values,
+                                       df['frame_number'].values))
+
+        ## Motion is the same in either layout
+        self.assertTrue(np.allclose(FlowPreprocess.flow_distances(df),
+                                    FlowPreprocess.flow_distances(flat_df)))
+        self.assertTrue(np.allclose(FlowPreprocess.flow_angles(df),
+                                    FlowPreprocess.flow_angles(flat_df)))
+
+    def test_flat_layout_is_copied(self):
+        flat_df = FlowPreprocess.to_flat_layout(object_layout_df())
+        again = FlowPreprocess.to_flat_layout(flat_df)
+        assert_frame_equal(flat_df, again)
+        again['x0'] = 0.
+        self.assertFalse((flat_df['x0'] == 0.).all())
+
+    def test_convert_flow_pickle(self):
+        df = object_layout_df()
+        path = os.path.join(self.directory, 'test.flow.pkl')
+        df.to_pickle(path)
+
+        ## In place, twice: the second conversion changes nothing
+        for i_run in range(2):
+            FlowPreprocess.convert_flow_pickle(path)
+            assert_frame_equal(pd.read_pickle(path),
+                               FlowPreprocess.to_flat_layout(df))
+
+        out_path = os.path.join(self.directory, 'out.flow.pkl')
+        df.to_pickle(path)
+        FlowPreprocess.convert_flow_pickle(path, out_path)
+        assert_frame_equal(pd.read_pickle(path), df)
+        assert_frame_equal(pd.read_pickle(out_path),
+                           FlowPreprocess.to_flat_layout(df))
+
+
+if __name__ == '__main__':
+    unittest.main()
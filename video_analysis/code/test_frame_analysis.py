@@ -0,0 +1,66 @@
+import unittest
+import cv2
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+from frame_analysis import FrameAnalysis
+
+
+def masked_hist_values(hsv_image, bw_mask=True):
+    """
+    Histograms of an HSV image the way they were computed before the
+    joint-histogram kernel: np.histogram per channel, with black and white
+    pixels masked out of the hue channel by _get_filter_bw
+    """
+    bw_df = pd.DataFrame()
+    hue = hsv_image[:, :, 0]
+    if bw_mask:
+        mask, bw_df = FrameAnalysis._get_filter_bw(hsv_image)
+        hue = hue * mask
+    hists = [FrameAnalysis._get_hist(hue.ravel(), 72, 180, 'hue_bin_'),
+             FrameAnalysis._get_hist(hsv_image[:, :, 1].ravel(), 25, 255, 'sat_bin_'),
+             FrameAnalysis._get_hist(hsv_image[:, :, 2].ravel(), 25, 255, 'val_bin_'),
+             bw_df]
+    return pd.concat(hists, axis=1)
+
+
+class HsvHistTest(unittest.TestCase):
+    """
+    FrameAnalysis._get_hsv_hist_values against the np.histogram and mask
+    path it replaced
+    """
+
+    def assert_matches(self, hsv_image):
+        for bw_mask in [True, False]:
+            expected = masked_hist_values(hsv_image, bw_mask)
+            values = FrameAnalysis._get_hsv_hist_values(hsv_image, bw_mask)
+            self.assertEqual(list(expected.columns),
+                             FrameAnalysis.get_hsv_hist_columns(bw_mask))
+            self.assertEqual(list(expected.values[0]), list(values))
+
+    def test_random_images(self):
+        rng = np.random.RandomState(0)
+        for i_image in range(5):
+            self.assert_matches(rng.randint(0, 256, size=(48, 64, 3)).astype(np.uint8))
+
+    def test_bin_edges(self):
+        ## Every combination of values around the bin edges and the
+        ## black/white threshold, including a hue of exactly 0
+        edges = [0, 1, 9, 10, 11, 12, 178, 179, 180, 181, 254, 255]
+        hue, sat, val = np.meshgrid(edges, edges, edges, indexing='ij')
+        hsv_image = np.dstack([hue.ravel(), sat.ravel(), val.ravel()])
+        self.assert_matches(hsv_image.astype(np.uint8))
+
+    def test_rgb_image(self):
+        rng = np.random.RandomState(1)
+        image = rng.randint(0, 256, size=(40, 30, 3)).astype(np.uint8)
+        image[:10] = 0
+        image[10:20] = 255
+        expected = masked_hist_values(cv2.cvtColor(image, cv2.COLOR_RGB2HSV))
+        assert_frame_equal(expected, FrameAnalysis.get_hsv_hists(image),
+                           check_dtype=False)
+        self.assertEqual(expected['num_black_pixels'][0], 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import numpy as np
+from frame_sampling import FrameSampling
+
+
+def sample(policy, num_frames, motion=None):
+    """
+    Frames a policy chooses, driven the way VideoFeatureExtraction drives
+    it on one thread: ask, record the sample, then observe its motion
+
+    ARGS:
+        policy: FrameSampling
+        num_frames: number of frames
+        motion: motion of each frame, or None for no motion
+    RETURNS:
+        List of sampled frame numbers
+    """
+    if motion is None:
+        motion = np.zeros(num_frames)
+    policy.reset()
+    frames = []
+    for i_frame in range(num_frames):
+        if policy.wants(i_frame):
+            policy.sampled(i_frame)
+            policy.observe(i_frame, motion[i_frame])
+            frames.append(i_frame)
+    return frames
+
+
+class FrameSamplingTest(unittest.TestCase):
+    """
+    Frames chosen by each FrameSampling policy
+    """
+
+    def test_all(self):
+        self.assertEqual(sample(FrameSampling(), 10), list(range(10)))
+
+    def test_stride(self):
+        self.assertEqual(sample(FrameSampling('stride', stride=4), 10), [0, 4, 8])
+        self.assertEqual(sample(FrameSampling('stride', stride=0), 3), [0, 1, 2])
+
+    def test_keyframes(self):
+        policy = FrameSampling('keyframes', keyframes=[7, 0, 3.0])
+        self.assertEqual(sample(policy, 10), [0, 3, 7])
+        self.assertRaises(ValueError, FrameSampling, 'keyframes')
+        self.assertRaises(ValueError, FrameSampling, 'random')
+
+    def test_adaptive_calm(self):
+        ## The stride doubles after each calm sample, up to max_stride
+        policy = FrameSampling('adaptive', max_stride=30)
+        self.assertEqual(sample(policy, 100), [0, 2, 6, 14, 30, 60, 90])
+
+    def test_adaptive_motion(self):
+        ## Motion at frame 6 brings the next sample forward to frame 7 and
+        ## resets the stride
+        motion = np.zeros(20)
+        motion[6] = 5.
+        policy = FrameSampling('adaptive', max_stride=30, motion_threshold=2.)
+        self.assertEqual(sample(policy, 20, motion), [0, 2, 6, 7, 8, 10, 14])
+
+        ## Unknown motion does not count as calm or moving
+        motion[:] = np.nan
+        self.assertEqual(sample(policy, 20, motion), [0, 2, 6, 14])
+
+    def test_reset(self):
+        policy = FrameSampling('adaptive')
+        sample(policy, 100)
+        policy.reset()
+        self.assertTrue(policy.wants(0))
+        self.assertEqual(policy.adaptive_stride, policy.min_stride)
+
+    def test_state(self):
+        ## A policy restored mid-video carries on the same schedule
+        policy = FrameSampling('adaptive')
+        frames = sample(policy, 100)
+        sample(policy, 20)
+        resumed = FrameSampling('adaptive')
+        resumed.set_state(policy.get_state())
+        resumed_frames = []
+        for i_frame in range(20, 100):
+            if resumed.wants(i_frame):
+                resumed.sampled(i_frame)
+                resumed.observe(i_frame, 0.)
+                resumed_frames.append(i_frame)
+        self.assertEqual(resumed_frames, [i for i in frames if i >= 20])
+
+    def test_wants_has_no_side_effects(self):
+        policy = FrameSampling('adaptive')
+        for i_frame in range(10):
+            policy.wants(i_frame)
+        self.assertEqual(sample(policy, 10), [0, 2, 6])
+
+    def test_config(self):
+        self.assertEqual(FrameSampling('keyframes', keyframes=[3, 1]).get_config(),
+                         FrameSampling('keyframes', keyframes=[1, 3]).get_config())
+        self.assertNotEqual(FrameSampling('stride', stride=2).get_config(),
+                            FrameSampling('stride', stride=3).get_config())
+
+        ## The adaptive state is not part of the settings
+        policy = FrameSampling('adaptive')
+        config = policy.get_config()
+        sample(policy, 50)
+        self.assertEqual(policy.get_config(), config)
+
+
+if __name__ == '__main__':
+    unittest.main()
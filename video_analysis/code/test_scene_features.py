@@ -0,0 +1,182 @@
+import unittest
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+from frame_analysis import FrameAnalysis
+from flow_preprocess import FlowPreprocess
+from scene_features import SceneFeatures
+from video_postprocess import VideoPostprocess
+
+
+def make_video(num_frames, cut_frames, seed=0):
+    """
+    Random image quality, optical flow and motion dataframes of a video.
+    Histogram counts are small, so top colours have many ties.
+
+    ARGS:
+        num_frames: number of frames
+        cut_frames: frames with is_scene_transition set
+        seed: random seed
+    RETURNS:
+        Tuple of (image quality dataframe, flow dataframe, motion dataframe)
+    """
+    rng = np.random.RandomState(seed)
+    frames = np.arange(num_frames)
+    columns = FrameAnalysis.get_hsv_hist_columns()
+    quality_df = pd.DataFrame(rng.randint(0, 4, size=(num_frames, len(columns))),
+                              columns=columns)
+    quality_df['frame_number'] = frames
+    quality_df['time'] = frames / 30.
+    quality_df['blur'] = rng.rand(num_frames) * 200
+    quality_df['num_pixels'] = 160 * 120
+    quality_df['is_scene_transition'] = np.in1d(frames, cut_frames).astype(int)
+
+    points = rng.randint(0, 8, size=num_frames)
+    flow_frames = np.repeat(frames, points)
+    num_points = len(flow_frames)
+    flow_df = pd.DataFrame({'frame_number': flow_frames,
+                            'time': flow_frames / 30.,
+                            'x0': rng.rand(num_points) * 160,
+                            'y0': rng.rand(num_points) * 120,
+                            'flow_st': np.ones(num_points, dtype=np.uint8),
+                            'flow_err': rng.rand(num_points)})
+    flow_df['x1'] = flow_df['x0'] + rng.randn(num_points) * 2
+    flow_df['y1'] = flow_df['y0'] + rng.randn(num_points) * 2
+    flow_df = flow_df[[name for name, _ in FlowPreprocess.FLOW_SCHEMA]]
+
+    motion_df = pd.DataFrame({'frame_number': frames, 'time': frames / 30.,
+                              'num_points': points})
+    return quality_df, flow_df, motion_df
+
+
+def steady_motion(quality_df, flow_df, motion_df, speeds, cut_frames):
+    """
+    Copies of a video's dataframes in which every point of a scene moves
+    by the same distance in x on every frame
+
+    ARGS:
+        quality_df, flow_df, motion_df: dataframes from make_video
+        speeds: distance per frame in each scene
+        cut_frames: first frame of every scene but the first
+    RETURNS:
+        Tuple of (image quality dataframe, flow dataframe, motion dataframe)
+        with flow_skipped and flow_gap columns as recorded without the
+        motion gate
+    """
+    scene = np.searchsorted(cut_frames, flow_df['frame_number'].values, side='right')
+    flow_df = flow_df.copy()
+    flow_df['x1'] = flow_df['x0'] + np.asarray(speeds, dtype=np.float32)[scene]
+    flow_df['y1'] = flow_df['y0']
+    quality_df = quality_df.assign(flow_skipped=0)
+    motion_df = motion_df.assign(flow_skipped=0, flow_gap=1)
+    return quality_df, flow_df, motion_df
+
+
+def gate(quality_df, flow_df, motion_df, held_frames):
+    """
+    Copies of a video's dataframes as the motion gate records them when it
+    holds held_frames: held frames report no motion, and the next computed
+    frame the motion of the whole gap (see FlowTracker)
+    """
+    frames = motion_df['frame_number'].values
+    held = np.in1d(frames, held_frames)
+    ## A computed frame's gap is 1 plus the frames held in a row before it
+    gap = np.ones(len(frames), dtype=np.int32)
+    run = 0
+    for i in range(len(frames)):
+        if held[i]:
+            run += 1
+            gap[i] = 0
+        else:
+            gap[i] = run + 1
+            run = 0
+
+    row_gap = pd.Series(gap, index=frames).reindex(flow_df['frame_number'].values).values
+    flow_df = flow_df.copy()
+    flow_df['x1'] = flow_df['x0'] + (flow_df['x1'] - flow_df['x0']) * row_gap
+    flow_df['y1'] = flow_df['y0'] + (flow_df['y1'] - flow_df['y0']) * row_gap
+    quality_df = quality_df.assign(flow_skipped=held.astype(int))
+    motion_df = motion_df.assign(flow_skipped=held.astype(int), flow_gap=gap)
+    return quality_df, flow_df, motion_df
+
+
+class SceneFeaturesTest(unittest.TestCase):
+    """
+    The batch scene features (SceneFeatures) against ScenePostprocess on
+    each scene
+    """
+
+    def assert_batch_matches(self, quality_df, flow_df, motion_df=None):
+        video = VideoPostprocess('test', flow_df, quality_df, motion_df=motion_df)
+        expected = video.to_df(batch=False)
+        assert_frame_equal(expected, video.to_df(), check_dtype=False)
+        return expected
+
+    def test_single_scene(self):
+        quality_df, flow_df, _ = make_video(30, [])
+        self.assertEqual(len(self.assert_batch_matches(quality_df, flow_df)), 1)
+
+    def test_many_scenes(self):
+        quality_df, flow_df, motion_df = make_video(90, [10, 11, 40, 75])
+        self.assertEqual(len(self.assert_batch_matches(quality_df, flow_df)), 5)
+        self.assert_batch_matches(quality_df, flow_df, motion_df)
+
+    def test_cut_on_first_frame(self):
+        quality_df, flow_df, _ = make_video(40, [0, 20])
+        self.assertEqual(len(self.assert_batch_matches(quality_df, flow_df)), 2)
+
+    def test_scenes_without_flow(self):
+        quality_df, flow_df, motion_df = make_video(60, [20, 40])
+        flow_df = flow_df[(flow_df['frame_number'] < 20) |
+                          (flow_df['frame_number'] >= 40)]
+        self.assert_batch_matches(quality_df, flow_df, motion_df)
+
+    def test_sampled_quality(self):
+        ## Quality on every third frame, flow on every frame
+        quality_df, flow_df, motion_df = make_video(60, [21, 42])
+        quality_df = quality_df[quality_df['frame_number'] % 3 == 0]
+        self.assert_batch_matches(quality_df, flow_df, motion_df)
+
+    def test_unsorted_rows(self):
+        quality_df, flow_df, motion_df = make_video(60, [15, 30])
+        self.assert_batch_matches(quality_df.iloc[::-1], flow_df.iloc[::-1],
+                                  motion_df.iloc[::-1])
+
+    def test_motion_gate(self):
+        ## Steady motion of 0.6 and 2 pixels per frame, with runs of held
+        ## frames in both scenes
+        cut_frames = [30]
+        dfs = steady_motion(*make_video(60, cut_frames), speeds=[.6, 2.],
+                            cut_frames=cut_frames)
+        held_frames = [3, 4, 5, 10, 11, 17, 40, 41, 50, 51, 52]
+        gated_dfs = gate(*dfs, held_frames=held_frames)
+
+        columns = ['shake_coeff', 'is_static_scene']
+        expected = self.assert_batch_matches(*dfs)[columns]
+        self.assertEqual(list(expected['is_static_scene']), [True, False])
+        assert_frame_equal(expected, self.assert_batch_matches(*gated_dfs)[columns])
+
+        ## Without motion_df, held frames are found from the quality rows
+        gated = self.assert_batch_matches(gated_dfs[0], gated_dfs[1])
+        self.assertEqual(list(gated['is_static_scene']), [True, False])
+
+    def test_many_videos(self):
+        videos = [make_video(40 + 10 * seed, [7 * seed + 5], seed=seed)
+                  for seed in range(3)]
+        expected = []
+        for seed, (quality_df, flow_df, motion_df) in enumerate(videos):
+            video = VideoPostprocess('video_%d' % seed, flow_df, quality_df,
+                                     motion_df=motion_df)
+            expected.append(video.to_df(batch=False))
+        expected = pd.concat(expected, ignore_index=True)
+
+        tables = []
+        for i_table in range(3):
+            tables.append(pd.concat([video[i_table].assign(video_id='video_%d' % seed)
+                                     for seed, video in enumerate(videos)]))
+        scene_df = SceneFeatures.to_df(tables[0], tables[1], motion_df=tables[2])
+        assert_frame_equal(expected, scene_df, check_dtype=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
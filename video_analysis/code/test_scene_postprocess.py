@@ -0,0 +1,86 @@
+import unittest
+import numpy as np
+import pandas as pd
+from frame_analysis import FrameAnalysis
+from histogram_schema import HistogramSchema
+from scene_postprocess import ScenePostprocess
+
+
+def make_quality_df(hue_counts):
+    """
+    Image quality dataframe of a scene with the given hue counts (frames x
+    72 hue bins) and empty saturation/value histograms
+    """
+    num_frames = len(hue_counts)
+    columns = FrameAnalysis.get_hsv_hist_columns()
+    quality_df = pd.DataFrame(np.zeros((num_frames, len(columns)), dtype=np.int64),
+                              columns=columns)
+    hue_columns = HistogramSchema.get(columns).names['hue']
+    quality_df[hue_columns] = hue_counts
+    quality_df['frame_number'] = np.arange(num_frames)
+    quality_df['time'] = np.arange(num_frames) / 30.
+    return quality_df
+
+
+def voted_top_colors(quality_df, num_colors=10):
+    """
+    Top colours as the frame-by-frame voting loop computed them: each frame
+    sorts its hue bins by count and votes for the first num_colors, and
+    the bins with the most votes win. Ties are broken as documented in
+    get_top_colors: later bin within a frame, first vote between bins.
+    """
+    cols = HistogramSchema.get(quality_df.columns).names['hue']
+    votes = {}
+    first_vote = {}
+    for _, row in quality_df[cols].iterrows():
+        ranked = sorted(range(len(cols)), key=lambda i: (-row.values[i], -i))
+        for i in ranked[:num_colors]:
+            votes[cols[i]] = votes.get(cols[i], 0) + 1
+            first_vote.setdefault(cols[i], len(first_vote))
+    ranked = sorted(votes, key=lambda col: (-votes[col], first_vote[col]))
+    return ranked[:num_colors]
+
+
+class TopColorsTest(unittest.TestCase):
+    """
+    The vectorized ScenePostprocess.get_top_colors against per-frame voting
+    """
+
+    def top_colors(self, hue_counts, num_colors=10):
+        flow_df = pd.DataFrame({'frame_number': [], 'time': [],
+                                'x0': [], 'y0': [], 'x1': [], 'y1': []})
+        scene = ScenePostprocess(flow_df, make_quality_df(hue_counts))
+        return scene.get_top_colors(num_colors)
+
+    def test_distinct_counts(self):
+        ## Counts distinct within each frame, as in real frames
+        rng = np.random.RandomState(0)
+        hue_counts = np.array([rng.permutation(72) * 10 for i in range(40)])
+        self.assertEqual(self.top_colors(hue_counts),
+                         voted_top_colors(make_quality_df(hue_counts)))
+
+    def test_ties(self):
+        rng = np.random.RandomState(1)
+        for i_trial in range(20):
+            hue_counts = rng.randint(0, 3, size=(rng.randint(1, 30), 72))
+            for num_colors in [1, 10, 72]:
+                self.assertEqual(self.top_colors(hue_counts, num_colors),
+                                 voted_top_colors(make_quality_df(hue_counts),
+                                                  num_colors))
+
+    def test_tie_rules(self):
+        names = HistogramSchema.get(FrameAnalysis.get_hsv_hist_columns()).names['hue']
+
+        ## Equal counts in a frame: the later bins are voted for
+        self.assertEqual(self.top_colors(np.ones((1, 72), dtype=int), 3),
+                         [names[71], names[70], names[69]])
+
+        ## Equal votes: the bin voted for first wins
+        hue_counts = np.zeros((2, 72), dtype=int)
+        hue_counts[0, 5] = 2
+        hue_counts[1, 3] = 2
+        self.assertEqual(self.top_colors(hue_counts, 1), [names[5]])
+
+
+if __name__ == '__main__':
+    unittest.main()
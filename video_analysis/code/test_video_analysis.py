@@ -0,0 +1,71 @@
+import unittest
+import numpy as np
+from video_analysis import VideoAnalysis
+
+
+def labels(cut_frames, num_frames=100):
+    """
+    Per-frame cut labels with cuts at cut_frames
+    """
+    is_cut = np.zeros(num_frames, dtype=int)
+    is_cut[list(cut_frames)] = 1
+    return is_cut
+
+
+class CompareCutsTest(unittest.TestCase):
+    """
+    VideoAnalysis.compare_cuts
+    """
+
+    def compare(self, cuts_a, cuts_b, tolerance=2):
+        return VideoAnalysis.compare_cuts(labels(cuts_a), labels(cuts_b),
+                                          tolerance=tolerance)
+
+    def test_same_cuts(self):
+        agreement = self.compare([10, 40, 70], [10, 40, 70])
+        self.assertEqual(agreement['matched'], 3)
+        self.assertEqual(agreement['f1'], 1.)
+
+    def test_tolerance(self):
+        agreement = self.compare([10, 50], [12, 47])
+        self.assertEqual(agreement['matched'], 1)
+        self.assertEqual(agreement['precision'], .5)
+        self.assertEqual(agreement['recall'], .5)
+        self.assertEqual(self.compare([10, 50], [12, 47], tolerance=3)['matched'], 2)
+
+    def test_one_to_one(self):
+        ## Two cuts near one reference cut match it only once
+        agreement = self.compare([10], [9, 11])
+        self.assertEqual(agreement['matched'], 1)
+        self.assertEqual(agreement['precision'], .5)
+        self.assertEqual(agreement['recall'], 1.)
+
+        agreement = self.compare([9, 11], [10])
+        self.assertEqual(agreement['matched'], 1)
+        self.assertEqual(agreement['precision'], 1.)
+        self.assertEqual(agreement['recall'], .5)
+
+    def test_closest_first(self):
+        ## 14-15 is the closest pair, which leaves 12 for 10
+        self.assertEqual(self.compare([10, 14], [12, 15])['matched'], 2)
+
+    def test_no_cuts(self):
+        agreement = self.compare([], [])
+        self.assertEqual((agreement['precision'], agreement['recall']), (1., 1.))
+        agreement = self.compare([], [30])
+        self.assertEqual((agreement['precision'], agreement['recall']), (0., 1.))
+        self.assertEqual(agreement['f1'], 0.)
+
+    def test_bounds(self):
+        rng = np.random.RandomState(0)
+        for i_trial in range(200):
+            is_cut_a = (rng.rand(100) < .1).astype(int)
+            is_cut_b = (rng.rand(100) < .1).astype(int)
+            agreement = VideoAnalysis.compare_cuts(is_cut_a, is_cut_b)
+            self.assertTrue(agreement['matched'] <= min(is_cut_a.sum(), is_cut_b.sum()))
+            self.assertTrue(0. <= agreement['precision'] <= 1.)
+            self.assertTrue(0. <= agreement['recall'] <= 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,411 @@
+import os
+import shutil
+import tempfile
+import unittest
+import cv2
+import numpy as np
+from pandas.util.testing import assert_frame_equal
+from frame_sampling import FrameSampling
+from video_feature_extraction import VideoFeatureExtraction
+from video_utilities import VideoUtilities
+
+
+def write_video(path, num_frames=60, scene_length=20, size=(320, 240)):
+    """
+    Synthesize a short MJPG video: scenes of scene_length frames, each a
+    different texture panning across the frame, with a moving square
+
+    ARGS:
+        path: path of the .avi file to write
+        num_frames: number of frames
+        scene_length: frames per scene
+        size: (width, height)
+    RETURNS:
+        None
+    """
+    width, height = size
+    rng = np.random.RandomState(0)
+    textures = []
+    for i_scene in range(3):
+        texture = (rng.rand(height, width, 3) * 255).astype(np.uint8)
+        texture = cv2.GaussianBlur(texture, (15, 15), 0)
+        textures.append(cv2.normalize(texture, None, 0, 255, cv2.NORM_MINMAX))
+
+    writer = cv2.VideoWriter(path, cv2.cv.CV_FOURCC(*'MJPG'), 30, size)
+    for i_frame in range(num_frames):
+        i_scene = i_frame // scene_length
+        frame = np.roll(textures[i_scene % 3], 2 * (i_frame % scene_length),
+                        axis=1 + i_scene % 2).copy()
+        corner = (20 + 4 * (i_frame % scene_length), 40)
+        cv2.rectangle(frame, corner, (corner[0] + 30, corner[1] + 30),
+                      (0, 0, 255), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def tracked_errors(df):
+    """
+    Copy of a dataframe with the flow errors of lost points (flow_st 0)
+    set to NaN: OpenCV leaves them undefined
+    """
+    if 'flow_err' not in df.columns:
+        return df
+    df = df.copy()
+    df.loc[df['flow_st'] == 0, 'flow_err'] = np.nan
+    return df
+
+
+def sample_adaptive(policy, motion_df, num_frames=60):
+    """
+    Frames an adaptive policy chooses when fed the motion of motion_df
+    """
+    motion = dict(zip(motion_df['frame_number'], motion_df['motion_mean']))
+    frames = []
+    for i_frame in range(num_frames):
+        if policy.wants(i_frame):
+            policy.sampled(i_frame)
+            policy.observe(i_frame, motion[i_frame])
+            frames.append(i_frame)
+    return frames
+
+
+class InexactSeekCapture(object):
+    """
+    cv2.VideoCapture whose frame seeks land offset frames away from the
+    requested frame, as with some codecs and containers
+    """
+
+    offset = 0
+
+    def __init__(self, video):
+        self.cap = cv2.VideoCapture(video)
+
+    def set(self, prop, value):
+        if prop == cv2.cv.CV_CAP_PROP_POS_FRAMES and value > 0:
+            value = max(value + InexactSeekCapture.offset, 0)
+        return self.cap.set(prop, value)
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+
+class VariableRateCapture(object):
+    """
+    Capture of a video's frames with variable frame rate timestamps: frames
+    20-39 are three times as long as the others. Frame seeks land on the
+    frame shown at frame number / nominal fps, as timestamp-based seeks do.
+    """
+
+    FPS = 30.
+
+    def __init__(self, video):
+        cap = cv2.VideoCapture(video)
+        self.frames = []
+        ret, frame = cap.read()
+        while ret:
+            self.frames.append(frame)
+            ret, frame = cap.read()
+        cap.release()
+        self.position = 0
+
+    @staticmethod
+    def frame_times(num_frames=60):
+        durations = np.ones(num_frames) / VariableRateCapture.FPS
+        durations[20:40] *= 3
+        return np.concatenate([[0.], np.cumsum(durations)[:-1]])
+
+    def set(self, prop, value):
+        if prop == cv2.cv.CV_CAP_PROP_POS_FRAMES:
+            times = VariableRateCapture.frame_times(len(self.frames))
+            self.position = int(np.searchsorted(times, value / VariableRateCapture.FPS - 1e-6))
+        return True
+
+    def get(self, prop):
+        if prop == cv2.cv.CV_CAP_PROP_FPS:
+            return VariableRateCapture.FPS
+        if prop == cv2.cv.CV_CAP_PROP_POS_MSEC:
+            times = VariableRateCapture.frame_times(len(self.frames))
+            return times[max(self.position - 1, 0)] * 1000.
+        if prop == cv2.cv.CV_CAP_PROP_FRAME_COUNT:
+            return len(self.frames)
+        return 0
+
+    def grab(self):
+        if self.position >= len(self.frames):
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return True, self.frames[self.position - 1]
+
+    def release(self):
+        pass
+
+
+class VideoFeatureExtractionTest(unittest.TestCase):
+    """
+    Feature extraction on a synthesized video
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.directory, 'test.avi')
+        write_video(cls.video)
+        cls.expected = VideoFeatureExtraction.extract('test', cls.video)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def assert_same_features(self, results, expected=None):
+        if expected is None:
+            expected = self.expected
+        for expected_df, df in zip(expected, results):
+            assert_frame_equal(tracked_errors(expected_df), tracked_errors(df))
+
+    def test_sequential(self):
+        img_quality_df, video_df, motion_df = self.expected
+        self.assertEqual(len(img_quality_df), 60)
+        self.assertEqual(list(img_quality_df['frame_number']), list(range(60)))
+        self.assertEqual(list(motion_df['frame_number']), list(range(60)))
+        self.assertTrue(len(video_df) > 0)
+
+    def test_workers(self):
+        self.assert_same_features(
+            VideoFeatureExtraction.extract('test', self.video, num_workers=2))
+
+    def test_segments(self):
+        for num_segments in [2, 3]:
+            self.assert_same_features(
+                VideoFeatureExtraction.extract('test', self.video,
+                                               num_segments=num_segments))
+
+    def test_segments_inexact_seeks(self):
+        open_video = VideoUtilities.open_video
+        VideoUtilities.open_video = staticmethod(
+            lambda video, backend='opencv', max_edge=None: InexactSeekCapture(video))
+        try:
+            for offset in [3, -5, 25]:
+                InexactSeekCapture.offset = offset
+                self.assert_same_features(
+                    VideoFeatureExtraction.extract('test', self.video,
+                                                   num_segments=3))
+        finally:
+            VideoUtilities.open_video = staticmethod(open_video)
+
+    def test_segments_variable_frame_rate(self):
+        open_video = VideoUtilities.open_video
+        get_frame_times = VideoUtilities.get_frame_times
+        VideoUtilities.open_video = staticmethod(
+            lambda video, backend='opencv', max_edge=None: VariableRateCapture(video))
+        try:
+            expected = VideoFeatureExtraction.extract('test', self.video)
+
+            ## The frame reached by a seek is found from its timestamp
+            VideoUtilities.get_frame_times = staticmethod(
+                lambda video: VariableRateCapture.frame_times())
+            self.assert_same_features(
+                VideoFeatureExtraction.extract('test', self.video, num_segments=3),
+                expected)
+
+            ## Assuming a constant frame rate gets it wrong
+            VideoUtilities.get_frame_times = staticmethod(lambda video: np.zeros(0))
+            img_quality_df = VideoFeatureExtraction.extract(
+                'test', self.video, num_segments=3)[0]
+            self.assertFalse(np.allclose(img_quality_df['blur'], expected[0]['blur']))
+        finally:
+            VideoUtilities.open_video = staticmethod(open_video)
+            VideoUtilities.get_frame_times = staticmethod(get_frame_times)
+
+    def test_sampling(self):
+        sampling = {'quality': FrameSampling('stride', stride=5),
+                    'flow': FrameSampling('keyframes', keyframes=[10, 30])}
+        img_quality_df, video_df, motion_df = VideoFeatureExtraction.extract(
+            'test', self.video, sampling=sampling)
+        self.assertEqual(list(img_quality_df['frame_number']), list(range(0, 60, 5)))
+        self.assertEqual(list(motion_df['frame_number']), [10, 30])
+        self.assertEqual(sorted(set(video_df['frame_number'])), [10, 30])
+
+        ## Sampled rows match the rows of the full extraction. Quality
+        ## rows only carry motion on frames also sampled for flow.
+        expected_quality_df, expected_video_df, expected_motion_df = self.expected
+        expected_df = expected_quality_df[expected_quality_df['frame_number'] % 5 == 0]
+        motion_columns = ['motion_mean', 'motion_stdev']
+        assert_frame_equal(expected_df.drop(motion_columns, axis=1).reset_index(drop=True),
+                           img_quality_df.drop(motion_columns, axis=1).reset_index(drop=True))
+        for expected_df, df in [(expected_video_df, video_df),
+                                (expected_motion_df, motion_df)]:
+            expected_df = expected_df[expected_df['frame_number'].isin([10, 30])]
+            assert_frame_equal(tracked_errors(expected_df).reset_index(drop=True),
+                               tracked_errors(df).reset_index(drop=True))
+
+    def test_adaptive_sampling_needs_one_thread(self):
+        sampling = {'flow': FrameSampling('adaptive')}
+        self.assertRaises(ValueError, VideoFeatureExtraction.extract,
+                          'test', self.video, num_workers=2, sampling=sampling)
+
+        ## On one thread, flow is computed on the frames the policy chooses
+        ## given the motion measured so far
+        img_quality_df, video_df, motion_df = VideoFeatureExtraction.extract(
+            'test', self.video, sampling=sampling)
+        frames = list(motion_df['frame_number'])
+        self.assertTrue(0 < len(frames) < 60)
+        self.assertEqual(frames, sample_adaptive(FrameSampling('adaptive'),
+                                                 motion_df))
+
+    def run_interrupted(self, checkpoint_dir, stop_frame, **kwargs):
+        """
+        Extract with a checkpoint, failing when stop_frame is analyzed
+        """
+        analyze_frame = VideoFeatureExtraction._analyze_frame
+
+        def failing(*args, **kw):
+            if kw.get('frame_number') == stop_frame:
+                raise RuntimeError('interrupted')
+            return analyze_frame(*args, **kw)
+
+        VideoFeatureExtraction._analyze_frame = staticmethod(failing)
+        try:
+            self.assertRaises(RuntimeError, VideoFeatureExtraction.extract,
+                              'test', self.video, checkpoint_dir=checkpoint_dir,
+                              **kwargs)
+        finally:
+            VideoFeatureExtraction._analyze_frame = staticmethod(analyze_frame)
+
+    def count_analyzed(self, **kwargs):
+        """
+        Extract, counting the frames analyzed
+        RETURNS:
+            Tuple of (results of extract, number of frames analyzed)
+        """
+        analyze_frame = VideoFeatureExtraction._analyze_frame
+        analyzed = []
+
+        def counting(*args, **kw):
+            analyzed.append(kw.get('frame_number'))
+            return analyze_frame(*args, **kw)
+
+        VideoFeatureExtraction._analyze_frame = staticmethod(counting)
+        try:
+            results = VideoFeatureExtraction.extract('test', self.video, **kwargs)
+        finally:
+            VideoFeatureExtraction._analyze_frame = staticmethod(analyze_frame)
+        return results, len(analyzed)
+
+    def test_checkpoint_resume(self):
+        for kwargs in [{}, {'num_workers': 2}]:
+            checkpoint_dir = os.path.join(self.directory, 'checkpoint')
+            self.run_interrupted(checkpoint_dir, 47, chunk_size=10, **kwargs)
+
+            ## Resumes after the last complete chunk
+            results, num_analyzed = self.count_analyzed(
+                checkpoint_dir=checkpoint_dir, chunk_size=10, **kwargs)
+            self.assert_same_features(results)
+            self.assertTrue(num_analyzed < 60)
+
+            ## A complete checkpoint is read back without decoding
+            results, num_analyzed = self.count_analyzed(
+                checkpoint_dir=checkpoint_dir, chunk_size=10, **kwargs)
+            self.assert_same_features(results)
+            self.assertEqual(num_analyzed, 0)
+            shutil.rmtree(checkpoint_dir)
+
+    def test_checkpoint_resume_sampling(self):
+        ## The adaptive policy carries on from its saved state. Resuming
+        ## at frame 50, in the calm last scene, it next samples frame 56.
+        sampling = {'flow': FrameSampling('adaptive', max_stride=8,
+                                          motion_threshold=5.)}
+        expected = VideoFeatureExtraction.extract('test', self.video, sampling=sampling)
+        checkpoint_dir = os.path.join(self.directory, 'checkpoint_sampling')
+        self.run_interrupted(checkpoint_dir, 57, chunk_size=10, sampling=sampling)
+        results, num_analyzed = self.count_analyzed(
+            checkpoint_dir=checkpoint_dir, chunk_size=10, sampling=sampling)
+        self.assert_same_features(results, expected)
+        self.assertTrue(num_analyzed < 60)
+        shutil.rmtree(checkpoint_dir)
+
+    def test_checkpoint_segments(self):
+        ## Segments run in other processes, so only the results are checked
+        checkpoint_dir = os.path.join(self.directory, 'checkpoint_segments')
+        self.run_interrupted(checkpoint_dir, 47, chunk_size=10, num_segments=2)
+        for i_run in range(2):
+            self.assert_same_features(
+                VideoFeatureExtraction.extract('test', self.video,
+                                               num_segments=2,
+                                               checkpoint_dir=checkpoint_dir,
+                                               chunk_size=10))
+        shutil.rmtree(checkpoint_dir)
+
+    def test_checkpoint_other_settings(self):
+        checkpoint_dir = os.path.join(self.directory, 'checkpoint_settings')
+        self.run_interrupted(checkpoint_dir, 47, chunk_size=10)
+
+        ## Chunks made without the motion gate are not reused
+        expected = VideoFeatureExtraction.extract('test', self.video,
+                                                  motion_gate=0.5)
+        results, num_analyzed = self.count_analyzed(
+            checkpoint_dir=checkpoint_dir, chunk_size=10, motion_gate=0.5)
+        self.assert_same_features(results, expected)
+        self.assertEqual(num_analyzed, 60)
+        shutil.rmtree(checkpoint_dir)
+
+
+
+def make_segment(frames):
+    """
+    Segment result with rows at the given frame numbers of each buffer.
+    Times start at 0, as after a seek that restarted the timestamps.
+
+    ARGS:
+        frames: dictionary of frame numbers by buffer name
+    RETURNS:
+        Dictionary of buffers (see VideoFeatureExtraction._buffers)
+    """
+    buffers = VideoFeatureExtraction._buffers(0)
+    for name, frame_numbers in frames.items():
+        frame_numbers = np.asarray(frame_numbers)
+        times = (frame_numbers - frame_numbers.min()) / 30.
+        buffers[name].extend(len(frame_numbers), frame_number=frame_numbers,
+                             time=times)
+    return buffers
+
+
+class StitchSegmentsTest(unittest.TestCase):
+    """
+    VideoFeatureExtraction._stitch_segments on hand-made segments
+    """
+
+    def test_segment_without_quality_rows(self):
+        ## The middle segment was only sampled for flow
+        segments = [make_segment({'quality': range(5), 'motion': range(5)}),
+                    make_segment({'motion': range(5, 10),
+                                  'flow': np.repeat(range(5, 10), 3)}),
+                    make_segment({'quality': range(10, 15), 'motion': range(10, 15)})]
+        buffers = VideoFeatureExtraction._stitch_segments(segments)
+        self.assertEqual(list(buffers['quality'].view('frame_number')),
+                         list(range(5)) + list(range(10, 15)))
+        self.assertEqual(list(buffers['motion'].view('frame_number')), list(range(15)))
+        self.assertEqual(list(buffers['flow'].view('frame_number')),
+                         list(np.repeat(range(5, 10), 3)))
+
+        ## Times continue across segments
+        times = buffers['motion'].view('time')
+        self.assertTrue(np.allclose(times, np.arange(15) / 30.))
+        self.assertTrue(np.allclose(buffers['flow'].view('time'),
+                                    np.repeat(np.arange(5, 10), 3) / 30.))
+
+    def test_repeated_rows(self):
+        ## Each buffer drops the frames it already holds
+        segments = [make_segment({'quality': range(5), 'motion': [0, 2]}),
+                    make_segment({'quality': range(3, 8), 'motion': [2, 4, 6]})]
+        buffers = VideoFeatureExtraction._stitch_segments(segments)
+        self.assertEqual(list(buffers['quality'].view('frame_number')), list(range(8)))
+        self.assertEqual(list(buffers['motion'].view('frame_number')), [0, 2, 4, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ import base64
 import numpy as np
 import pandas as pd
 from subprocess import Popen, PIPE
+from histogram_schema import HistogramSchema
 
 
 class VideoAnalysis(object):
@@ -60,6 +61,209 @@ class VideoAnalysis(object):
 
         return out_df
 
+    @staticmethod
+    def detect_cut_from_hists(quality_df, min_score=0.25, window=31, num_devs=6.):
+        """
+        Detect scene boundaries ("cuts") from the per-frame HSV histograms
+        already computed by feature extraction, so the video does not have
+        to be decoded again.
+
+        A frame is a cut if its scene change score (see
+        scene_change_scores) is a local peak, above min_score, and above an
+        adaptive threshold: the median score of the surrounding window
+        plus num_devs median absolute deviations. The adaptive part stops
+        fast pans and flicker from being flagged.
+
+        Args:
+            quality_df: image quality dataframe with 'time' and histogram
+                        columns
+            min_score: minimum score for a cut, between 0 and 1
+            window: number of frames used for the adaptive threshold
+            num_devs: number of median absolute deviations above the local
+                      median a cut must be
+        Returns:
+            A dataframe of with each frame labeled as whether it is a
+            scene boundary, in the same format as detect_cut.
+        """
+        scores = VideoAnalysis.get_scene_change_scores(quality_df)
+        is_cut = VideoAnalysis._find_cuts(scores, min_score, window, num_devs)
+
+        out_df = pd.DataFrame({'time': quality_df['time'].values,
+                               'is_scene_transition': is_cut.astype(int)},
+                              columns=['time', 'is_scene_transition'],
+                              index=quality_df.index)
+        return out_df
+
+    @staticmethod
+    def scene_change_scores(quality_df):
+        """
+        Score how much each frame's colour distribution differs from the
+        previous frame's. The score is the chi-square histogram distance,
+        averaged over the hue, saturation and value histograms, and is
+        between 0 (identical) and 1 (no overlap). The first frame scores 0.
+
+        Args:
+            quality_df: image quality dataframe with histogram columns
+        Returns:
+            numpy float64 array with one score per frame
+        """
+        scores = np.zeros(len(quality_df))
+        if len(quality_df) < 2:
+            return scores
+
+        schema = HistogramSchema.get(quality_df.columns)
+        for hist in HistogramSchema.HISTOGRAMS:
+            hists = schema.block(quality_df, hist).astype(np.float64)
+            hists /= np.maximum(hists.sum(axis=1), 1)[:, np.newaxis]
+            p, q = hists[1:], hists[:-1]
+            total = p + q
+            total[total == 0] = 1
+            scores[1:] += 0.5 * ((p - q) ** 2 / total).sum(axis=1)
+        return scores / 3.
+
+    @staticmethod
+    def get_scene_change_scores(quality_df):
+        """
+        Scene change scores stored in the 'scene_change_score' column, or
+        computed from the histogram columns for dataframes saved before the
+        column existed.
+
+        Args:
+            quality_df: image quality dataframe
+        Returns:
+            numpy float64 array with one score per frame
+        """
+        if 'scene_change_score' in quality_df.columns:
+            return quality_df['scene_change_score'].values.astype(np.float64)
+        return VideoAnalysis.scene_change_scores(quality_df)
+
+    @staticmethod
+    def resegment(quality_df, thresholds, window=31, num_devs=6.):
+        """
+        Re-label scene transitions at new thresholds from the stored scene
+        change scores, without decoding the video again. The adaptive part
+        of the threshold is computed once and shared by every threshold.
+
+        Args:
+            quality_df: image quality dataframe
+            thresholds: a single min_score (see detect_cut_from_hists), or
+                        a list of them
+            window, num_devs: see detect_cut_from_hists
+        Returns:
+            For a single threshold, a Series of 0/1 transition flags indexed
+            like quality_df. For a list, a dataframe with one column of flags
+            per threshold.
+        """
+        scores = VideoAnalysis.get_scene_change_scores(quality_df)
+        candidates = VideoAnalysis._find_cut_candidates(scores, window, num_devs)
+
+        if np.isscalar(thresholds):
+            return pd.Series((candidates & (scores > thresholds)).astype(int),
+                             index=quality_df.index, name='is_scene_transition')
+
+        flags = dict((threshold, (candidates & (scores > threshold)).astype(int))
+                     for threshold in thresholds)
+        return pd.DataFrame(flags, columns=list(thresholds), index=quality_df.index)
+
+    @staticmethod
+    def _find_cuts(scores, min_score=0.25, window=31, num_devs=6.):
+        """
+        Threshold scene change scores (see detect_cut_from_hists)
+
+        Args:
+            scores: per-frame scene change scores
+            min_score: minimum score for a cut
+            window: number of frames used for the adaptive threshold
+            num_devs: number of median absolute deviations above the local
+                      median a cut must be
+        Returns:
+            boolean numpy array, True for frames that start a new scene
+        """
+        candidates = VideoAnalysis._find_cut_candidates(scores, window, num_devs)
+        return candidates & (scores > min_score)
+
+    @staticmethod
+    def _find_cut_candidates(scores, window=31, num_devs=6.):
+        """
+        Frames that pass every part of the cut threshold except min_score:
+        single-frame peaks above the adaptive threshold
+        (see detect_cut_from_hists)
+
+        Args:
+            scores: per-frame scene change scores
+            window, num_devs: see _find_cuts
+        Returns:
+            boolean numpy array
+        """
+        num_frames = len(scores)
+        if num_frames < 2:
+            return np.zeros(num_frames, dtype=bool)
+
+        ## Rolling median and median absolute deviation, centred on each frame
+        half = window // 2
+        padded = np.pad(scores, half, mode='edge')
+        windows = np.lib.stride_tricks.as_strided(
+            padded, shape=(num_frames, 2 * half + 1),
+            strides=(padded.strides[0], padded.strides[0]))
+        local_median = np.median(windows, axis=1)
+        local_mad = np.median(np.abs(windows - local_median[:, np.newaxis]), axis=1)
+
+        ## Cuts are single-frame peaks
+        prev_score = np.r_[-np.inf, scores[:-1]]
+        next_score = np.r_[scores[1:], -np.inf]
+        is_peak = (scores >= prev_score) & (scores > next_score)
+
+        return (scores > local_median + num_devs * local_mad) & is_peak
+
+    @staticmethod
+    def compare_cuts(is_cut_a, is_cut_b, tolerance=2):
+        """
+        Agreement between two sets of per-frame cut labels. Cuts are
+        matched one to one: pairs within tolerance are taken closest
+        first, and each cut is used by at most one pair.
+
+        Args:
+            is_cut_a: per-frame cut labels, treated as the reference
+            is_cut_b: per-frame cut labels to compare
+            tolerance: number of frames two cuts may be apart and still match
+        Returns:
+            Dictionary with the number of cuts in each set, the number of
+            matched pairs, and precision/recall/f1 of b against a
+        """
+        frames_a = np.flatnonzero(np.asarray(is_cut_a))
+        frames_b = np.flatnonzero(np.asarray(is_cut_b))
+
+        ## Every (a, b) pair within tolerance, closest first
+        lo = np.searchsorted(frames_a, frames_b - tolerance, side='left')
+        counts = np.searchsorted(frames_a, frames_b + tolerance, side='right') - lo
+        pair_b = np.repeat(np.arange(len(frames_b)), counts)
+        ## Cuts lo[j], lo[j] + 1, ... of a for the pairs of cut j of b
+        first_pair = np.cumsum(counts) - counts
+        pair_a = np.arange(len(pair_b)) + np.repeat(lo - first_pair, counts)
+        distance = np.abs(frames_a[pair_a] - frames_b[pair_b])
+        order = np.lexsort((pair_b, pair_a, distance))
+
+        used_a = np.zeros(len(frames_a), dtype=bool)
+        used_b = np.zeros(len(frames_b), dtype=bool)
+        matched = 0
+        for i, j in zip(pair_a[order], pair_b[order]):
+            if not (used_a[i] or used_b[j]):
+                used_a[i] = used_b[j] = True
+                matched += 1
+
+        precision = 1. * matched / len(frames_b) if len(frames_b) else 1.
+        recall = 1. * matched / len(frames_a) if len(frames_a) else 1.
+        if precision + recall > 0:
+            f1 = 2 * precision * recall / (precision + recall)
+        else:
+            f1 = 0.
+        return {'num_cuts_a': len(frames_a),
+                'num_cuts_b': len(frames_b),
+                'matched': matched,
+                'precision': precision,
+                'recall': recall,
+                'f1': f1}
+
     @staticmethod
     def detect_shake(video):
         '''
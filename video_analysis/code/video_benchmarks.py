@@ -0,0 +1,304 @@
+"""
+Benchmarks for the feature extraction pipeline.
+
+Usage:
+    python video_benchmarks.py <path to video> [<more reference videos>]
+"""
+import sys
+import math
+import time
+import numpy as np
+import pandas as pd
+from histogram_schema import HistogramSchema
+from flow_preprocess import FlowPreprocess
+from video_analysis import VideoAnalysis
+from video_utilities import VideoUtilities
+from video_feature_extraction import VideoFeatureExtraction
+from video_postprocess import VideoPostprocess
+
+
+class VideoBenchmarks(object):
+    """
+    Speed and accuracy comparisons between extraction settings
+    """
+
+    @staticmethod
+    def resolution(video, max_edges=(480, 320)):
+        """
+        Compare extraction at reduced analysis resolutions against the full
+        (decoded) resolution.
+
+        Drift is reported per feature family:
+            blur:       mean relative difference in per-frame blur
+            hue/sat/val: mean L1 distance between per-frame histograms,
+                        each normalised to sum to 1
+            black/white: mean absolute difference in per-frame pixel
+                        fraction
+            flow:       relative difference in median per-frame flow
+                        distance, after scaling back to full resolution
+
+        ARGS:
+            video: path to video file
+            max_edges: analysis resolutions to compare
+        RETURNS:
+            Dataframe with one row per resolution
+        """
+        start = time.time()
+        full_q, full_f, _ = VideoFeatureExtraction.extract('benchmark', video)
+        full_time = time.time() - start
+
+        rows = []
+        for max_edge in max_edges:
+            start = time.time()
+            q, f, _ = VideoFeatureExtraction.extract('benchmark', video,
+                                                     max_edge=max_edge)
+            elapsed = time.time() - start
+
+            row = {'max_edge': max_edge,
+                   'seconds': elapsed,
+                   'full_res_seconds': full_time,
+                   'speedup': full_time / elapsed}
+            row.update(VideoBenchmarks._quality_drift(full_q, q))
+            scale = np.sqrt(1. * full_q['num_pixels'].values[0] /
+                            q['num_pixels'].values[0])
+            full_flow = VideoBenchmarks._median_flow(full_f)
+            flow = VideoBenchmarks._median_flow(f) * scale
+            row['flow_drift'] = abs(flow - full_flow) / full_flow
+            rows.append(row)
+
+        return pd.DataFrame(rows, columns=['max_edge', 'seconds',
+                                           'full_res_seconds', 'speedup',
+                                           'blur_drift', 'hue_drift',
+                                           'sat_drift', 'val_drift',
+                                           'black_drift', 'white_drift',
+                                           'flow_drift'])
+
+    @staticmethod
+    def cut_detection(video, tolerance=2):
+        """
+        Compare histogram based cut detection against ffprobe, which decodes
+        the video a second time. Features are extracted once and not
+        counted in either time.
+
+        ARGS:
+            video: path to video file
+            tolerance: number of frames two cuts may be apart and still match
+        RETURNS:
+            Dictionary with the wall time of each detector and the
+            agreement from VideoAnalysis.compare_cuts, with ffprobe as the
+            reference
+        """
+        quality_df, _, _ = VideoFeatureExtraction.extract('benchmark', video)
+
+        start = time.time()
+        hist_df = VideoAnalysis.detect_cut_from_hists(quality_df)
+        hist_time = time.time() - start
+
+        start = time.time()
+        ffprobe_df = VideoAnalysis.detect_cut(video, quality_df['time'])
+        ffprobe_time = time.time() - start
+
+        result = {'histogram_seconds': hist_time,
+                  'ffprobe_seconds': ffprobe_time}
+        result.update(VideoAnalysis.compare_cuts(
+            ffprobe_df['is_scene_transition'].values,
+            hist_df['is_scene_transition'].values,
+            tolerance=tolerance))
+        return result
+
+    @staticmethod
+    def motion_gate(videos, gates=(0.5, 1., 2.)):
+        """
+        Measure how much optical flow the motion gate skips (see
+        FlowTracker) and how much that changes the scene features built
+        on flow. Each video is split into scenes with
+        VideoAnalysis.detect_cut_from_hists, and the gated scene features
+        are compared with the ungated ones:
+            shake_error:    mean relative difference in shake_coeff
+            static_agreement: fraction of scenes with the same
+                            is_static_scene
+
+        ARGS:
+            videos: paths to the reference video files
+            gates: motion_gate values to compare
+        RETURNS:
+            Dataframe with one row per video and gate
+        """
+        rows = []
+        for video in videos:
+            start = time.time()
+            full_q, full_f, full_m = VideoFeatureExtraction.extract('benchmark', video)
+            full_time = time.time() - start
+            cuts = VideoAnalysis.detect_cut_from_hists(full_q)['is_scene_transition']
+            full_q['is_scene_transition'] = cuts.values
+            full_scenes = VideoPostprocess('benchmark', full_f, full_q,
+                                           motion_df=full_m).scenes
+
+            for gate in gates:
+                start = time.time()
+                q, f, m = VideoFeatureExtraction.extract('benchmark', video,
+                                                         motion_gate=gate)
+                elapsed = time.time() - start
+                q['is_scene_transition'] = cuts.values
+                scenes = VideoPostprocess('benchmark', f, q, motion_df=m).scenes
+
+                full_shake = np.array([scene.get_shake() for scene in full_scenes])
+                shake = np.array([scene.get_shake() for scene in scenes])
+                full_static = [scene.is_static_scene() for scene in full_scenes]
+                static = [scene.is_static_scene() for scene in scenes]
+
+                rows.append({'video': video,
+                             'motion_gate': gate,
+                             'skipped_fraction': m['flow_skipped'].mean(),
+                             'seconds': elapsed,
+                             'speedup': full_time / elapsed,
+                             'shake_error': np.mean(np.abs(shake - full_shake) /
+                                                    np.maximum(full_shake, 1e-9)),
+                             'static_agreement': np.mean(np.array(static) ==
+                                                         np.array(full_static))})
+
+        return pd.DataFrame(rows, columns=['video', 'motion_gate',
+                                           'skipped_fraction', 'seconds',
+                                           'speedup', 'shake_error',
+                                           'static_agreement'])
+
+    @staticmethod
+    def flow_preprocess(num_frames=5000, num_points=50, repeat=3):
+        """
+        Microbenchmark of FlowPreprocess.flow_distances and flow_angles
+        against the per-point loop they replaced, on synthetic flow data
+        in both the object column and flat layouts.
+
+        ARGS:
+            num_frames: number of frames of synthetic flow
+            num_points: tracked points per frame
+            repeat: number of timed runs; the fastest is reported
+        RETURNS:
+            Dictionary of seconds per call for each implementation and
+            layout, and the largest difference from the loop
+        """
+        rng = np.random.RandomState(0)
+        num_rows = num_frames * num_points
+        old_pos = (rng.rand(num_rows, 2) * 480).astype(np.float32)
+        new_pos = old_pos + rng.randn(num_rows, 2).astype(np.float32)
+        object_df = pd.DataFrame({'flow_pt_pos(t)': list(new_pos),
+                                  'flow_pt_pos(t-1)': list(old_pos)})
+        flat_df = pd.DataFrame({'x0': old_pos[:, 0], 'y0': old_pos[:, 1],
+                                'x1': new_pos[:, 0], 'y1': new_pos[:, 1]})
+
+        def loop(df):
+            ## The per-point implementation FlowPreprocess used to have
+            new_col, old_col = df['flow_pt_pos(t)'], df['flow_pt_pos(t-1)']
+            return ([math.sqrt((n[0] - o[0])**2 + (n[1] - o[1])**2)
+                     for n, o in zip(new_col, old_col)],
+                    [math.atan2(n[1] - o[1], n[0] - o[0])
+                     for n, o in zip(new_col, old_col)])
+
+        def vectorized(df):
+            return (FlowPreprocess.flow_distances(df),
+                    FlowPreprocess.flow_angles(df))
+
+        def best_time(func, df):
+            times = []
+            for _ in range(repeat):
+                start = time.time()
+                result = func(df)
+                times.append(time.time() - start)
+            return min(times), result
+
+        loop_time, (loop_dist, loop_angle) = best_time(loop, object_df)
+        object_time, (dist, angle) = best_time(vectorized, object_df)
+        flat_time, _ = best_time(vectorized, flat_df)
+
+        return {'num_rows': num_rows,
+                'loop_seconds': loop_time,
+                'object_seconds': object_time,
+                'flat_seconds': flat_time,
+                'max_distance_diff': np.abs(dist - loop_dist).max(),
+                'max_angle_diff': np.abs(angle - loop_angle).max()}
+
+    @staticmethod
+    def decode_throughput(video, max_edges=(None, 320)):
+        """
+        Frames per second of decoding a video into the grayscale frames
+        used by optical flow and the BGR frames used by the image quality
+        metrics, with each decoder backend (see VideoUtilities.open_video)
+
+        ARGS:
+            video: path to video file
+            max_edges: analysis resolutions to compare
+        RETURNS:
+            Dataframe with one row per backend and resolution
+        """
+        rows = []
+        for max_edge in max_edges:
+            for backend in ['opencv', 'ffmpeg']:
+                cap = VideoUtilities.open_video(video, backend, max_edge)
+                num_frames = 0
+                start = time.time()
+                while True:
+                    ret, frame = VideoUtilities.read_frame(cap, max_edge)
+                    if ret == False:
+                        break
+                    frame.get_gray()
+                    num_frames += 1
+                elapsed = time.time() - start
+                cap.release()
+                rows.append({'backend': backend,
+                             'max_edge': max_edge,
+                             'frames': num_frames,
+                             'seconds': elapsed,
+                             'fps': num_frames / max(elapsed, 1e-9)})
+        return pd.DataFrame(rows, columns=['backend', 'max_edge', 'frames',
+                                           'seconds', 'fps'])
+
+    @staticmethod
+    def _quality_drift(full_df, df):
+        """
+        Per-feature drift between two image quality dataframes of the same
+        video (see resolution)
+        """
+        drift = {}
+        drift['blur_drift'] = np.mean(np.abs(df['blur'].values - full_df['blur'].values) /
+                                      np.maximum(full_df['blur'].values, 1e-9))
+        full_schema = HistogramSchema.get(full_df.columns)
+        schema = HistogramSchema.get(df.columns)
+        for prefix in HistogramSchema.HISTOGRAMS:
+            full_hist = VideoBenchmarks._normalise_rows(full_schema.block(full_df, prefix))
+            hist = VideoBenchmarks._normalise_rows(schema.block(df, prefix))
+            drift[prefix + '_drift'] = np.abs(hist - full_hist).sum(axis=1).mean()
+        for name in ['black', 'white']:
+            col = 'num_%s_pixels' % name
+            full_pct = 1. * full_df[col].values / full_df['num_pixels'].values
+            pct = 1. * df[col].values / df['num_pixels'].values
+            drift[name + '_drift'] = np.abs(pct - full_pct).mean()
+        return drift
+
+    @staticmethod
+    def _normalise_rows(values):
+        """
+        Scale each row to sum to 1
+        """
+        values = values.astype(float)
+        return values / np.maximum(values.sum(axis=1), 1)[:, np.newaxis]
+
+    @staticmethod
+    def _median_flow(flow_df):
+        """
+        Median over frames of the median flow distance per frame
+        """
+        if flow_df.empty:
+            return np.nan
+        dist = pd.Series(FlowPreprocess.flow_distances(flow_df),
+                         index=flow_df['frame_number'].values)
+        return dist.groupby(level=0).median().median()
+
+
+if __name__ == "__main__":
+    video = sys.argv[1]
+    pd.set_option('display.width', 200)
+    print VideoBenchmarks.resolution(video)
+    print VideoBenchmarks.decode_throughput(video)
+    print VideoBenchmarks.cut_detection(video)
+    print VideoBenchmarks.motion_gate(sys.argv[1:])
+    print VideoBenchmarks.flow_preprocess()
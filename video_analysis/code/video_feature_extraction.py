@@ -1,8 +1,17 @@
+import os
+import shutil
 import numpy as np
 import pandas as pd
 from frame_analysis import FrameAnalysis
+from frame_buffer import FrameBuffer
+from frame_checkpoint import FrameCheckpoint
+from extraction_cache import ExtractionCache
+from frame_pipeline import FramePipeline
+from flow_preprocess import FlowPreprocess
+from flow_tracker import FlowTracker
 from video_utilities import VideoUtilities
 from video_analysis import VideoAnalysis
+import multiprocessing
 import cv2
 
 
@@ -18,7 +27,10 @@ class VideoFeatureExtraction(object):
         pass
 
     @staticmethod
-    def run(video_id, video):
+    def run(video_id, video, num_workers=0, num_segments=1, max_edge=None,
+            motion_gate=None, sampling=None, backend='opencv',
+            cut_detector='histogram', validate_cuts=False, cache=None,
+            checkpoint_dir=None, chunk_size=1000):
         '''
         Main function for running all feature extraction steps.
         TODO: move this to "__main__"
@@ -26,92 +38,910 @@ class VideoFeatureExtraction(object):
         ARGS:
             video_id: unique video identifier
             video: path to video file (mp4 format)
+            num_workers, num_segments, max_edge, motion_gate, sampling,
+                backend, checkpoint_dir, chunk_size: see extract
+            cut_detector: 'histogram' to find scene cuts from the extracted
+                          colour histograms (VideoAnalysis.detect_cut_from_hists),
+                          or 'ffprobe' to decode the video again with ffprobe
+                          (VideoAnalysis.detect_cut)
+            validate_cuts: also run ffprobe and print how well the
+                           histogram cuts agree with it
+            cache: optional ExtractionCache. If it holds results for the
+                   same video content, settings and code, they are
+                   returned without decoding the video.
         RETURNS:
-            dataframe with frame-by-frame analysis
+            Tuple of (image quality dataframe, optical flow dataframe,
+            motion dataframe), also saved as <video_id>.img_quality.pkl,
+            .flow.pkl and .motion.pkl. The checkpoint directory is deleted
+            once the pickles are saved.
         '''
+        if cache is not None:
+            config = VideoFeatureExtraction._config(max_edge, motion_gate,
+                                                    sampling, backend)
+            config['cut_detector'] = cut_detector
+            cache_key = cache.key(video, config)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                print "-I- Using cached features for %s" % video
+                if checkpoint_dir is not None:
+                    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+                img_quality_df, video_df, motion_df = cached
+                for df in cached:
+                    df['video_id'] = video_id
+                img_quality_df.to_pickle(video_id + '.img_quality.pkl')
+                video_df.to_pickle(video_id + '.flow.pkl')
+                motion_df.to_pickle(video_id + '.motion.pkl')
+                return img_quality_df, video_df, motion_df
 
-        ## Go through every frame in the video and extract features
-        cap = cv2.VideoCapture(video)
-        frame = None
-
-        ## Output dataframes
-        video_df = pd.DataFrame()
-        img_quality_df = pd.DataFrame()
-
-        num_frames = cap.get(cv2.cv.CV_CAP_PROP_FRAME_COUNT)
         #num_frames = 3
         debug = 0
         if debug == 0:
-            i_frame = 0
-            while i_frame < num_frames:
-                ## Progress logging
-                if i_frame % 100 == 0:
-                	print i_frame
-
-                if frame is not None:
-                    prev_frame = frame.copy()
-                else:
-                    prev_frame = None
-
-                ret,frame = cap.read()
-                ## If there are no more frames, break out of loop
-                if ret == False:
-                    break
-
-                frame_series = pd.DataFrame(index=[0])
-                frame_series['video_id'] = video_id
-                frame_series['frame_number'] = i_frame
-                frame_series['time'] = cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000.
-
-                ##=======================
-                ## Image quality metrics
-                ##=======================
-                ## Blur
-                blur_df = SceneAnalysis.get_blur(frame)
-
-                ## Color Spectrum
-                color_df = SceneAnalysis.get_hsv_hists(frame)
-
-                img_quality_df = img_quality_df.append(pd.concat([frame_series, blur_df, color_df], axis=1), ignore_index=True)
-                #img_quality_df = img_quality_df.append(frame_series)
-
-                ##=======================
-                ## Video/motion metrics
-                ##=======================
-                ## Optical Flow
-                if prev_frame is not None:
-                    flow_df = VideoUtilities.optical_flow_on_frame(frame, prev_frame)
-                else:
-                    flow_df = None
-
-                ## Merge results into single dataframe
-                #video_df = video_df.append(pd.concat([frame_series, blur_df, color_df, flow_df], axis=1, ignore_index=True))
-                #video_df = video_df.append(frame_series)
-                #cat['video_id'] = video_id
-
-                #cat = pd.concat([blur_df, color_df, flow_df], axis=1)
-                if flow_df is not None:
-                    flow_series = flow_df.copy()
-                    ##NOTE: the below code is duplicated above - bad style
-                    flow_series['video_id'] = video_id
-                    flow_series['frame_number'] = i_frame #cap.get(cv2.cv.CV_CAP_PROP_POS_FRAMES-1)
-                    flow_series['time'] = cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000.
-                    #cat = pd.concat([frame_series, cat], axis=1)
-                    video_df = video_df.append(flow_series, ignore_index=True)
-
-                i_frame += 1
+            img_quality_df, video_df, motion_df = VideoFeatureExtraction.extract(
+                video_id, video, num_workers=num_workers,
+                num_segments=num_segments, max_edge=max_edge,
+                motion_gate=motion_gate, sampling=sampling, backend=backend,
+                checkpoint_dir=checkpoint_dir, chunk_size=chunk_size)
         else:
             img_quality_df = pd.read_pickle(video_id + '.img_quality.pkl')
+            video_df = pd.DataFrame()
+            motion_df = pd.DataFrame()
 
         ## After completing the frame-by-frame analysis, run video metrics
-        ## scene changes
-        scene_change_df = VideoAnalysis.detect_cut(video, img_quality_df['time'])
+        ## scene changes. The continuous score is saved so that cuts can be
+        ## re-thresholded later (VideoAnalysis.resegment)
+        img_quality_df['scene_change_score'] = VideoAnalysis.scene_change_scores(img_quality_df)
+        if cut_detector == 'ffprobe':
+            scene_change_df = VideoAnalysis.detect_cut(video, img_quality_df['time'])
+        else:
+            scene_change_df = VideoAnalysis.detect_cut_from_hists(img_quality_df)
+            if validate_cuts:
+                ffprobe_df = VideoAnalysis.detect_cut(video, img_quality_df['time'])
+                agreement = VideoAnalysis.compare_cuts(
+                    ffprobe_df['is_scene_transition'].values,
+                    scene_change_df['is_scene_transition'].values)
+                print "-I- Cut agreement with ffprobe: %d matched of %d " \
+                    "ffprobe and %d histogram cuts, precision %.2f, " \
+                    "recall %.2f" % \
+                    (agreement['matched'], agreement['num_cuts_a'],
+                     agreement['num_cuts_b'], agreement['precision'],
+                     agreement['recall'])
         img_quality_df['is_scene_transition'] = scene_change_df['is_scene_transition'].copy()
 
         ## Pickle model and save it to S3 or local directory
         img_quality_df.to_pickle(video_id + '.img_quality.pkl')
         video_df.to_pickle(video_id + '.flow.pkl')
-        return img_quality_df, video_df
+        motion_df.to_pickle(video_id + '.motion.pkl')
+        if cache is not None:
+            cache.put(cache_key, img_quality_df, video_df, motion_df)
+        if checkpoint_dir is not None:
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        return img_quality_df, video_df, motion_df
+
+    @staticmethod
+    def extract(video_id, video, num_workers=0, num_segments=1, max_edge=None,
+                motion_gate=None, sampling=None, backend='opencv',
+                checkpoint_dir=None, chunk_size=1000):
+        '''
+        Go through every frame in the video and extract features. Unlike
+        run, this does not detect scene cuts or save anything.
+
+        ARGS:
+            video_id: unique video identifier
+            video: path to video file (mp4 format)
+            num_workers: number of analysis threads. If 0, frames are
+                         decoded and analyzed one after another on the
+                         calling thread. Otherwise a decoder thread feeds
+                         a pool of analysis threads (see FramePipeline).
+            num_segments: number of time segments to split the video into.
+                          Each segment is extracted in its own process and
+                          the results are stitched back together
+                          (see _run_segments).
+            max_edge: analysis resolution, as the maximum length of the
+                      long edge of a frame in pixels. Every frame is
+                      downscaled once after decoding and all metrics are
+                      computed on the downscaled frame. None analyzes
+                      frames at their decoded resolution.
+            motion_gate: if set, optical flow is skipped on frames whose
+                         thumbnail differs from the last computed frame's by
+                         less than this many gray levels on average (see
+                         FlowTracker). Their points are recorded as not
+                         moving, and 'flow_skipped' is set to 1. Only used
+                         when num_workers is 0.
+            sampling: dictionary of FrameSampling policies by metric family:
+                      'quality' (blur, colour histograms; one
+                      img_quality_df row per sampled frame) and 'flow'
+                      (optical flow and motion, on the pair ending at each
+                      sampled frame; one motion_df row per sampled frame).
+                      Missing families use every frame.
+                      Frames no family needs are skipped with grab().
+                      Adaptive policies need the motion of each frame
+                      before the next is decoded, so they are only
+                      supported when num_workers is 0.
+            backend: 'opencv' or 'ffmpeg' (see VideoUtilities.open_video).
+                     ffmpeg scales frames to max_edge while decoding.
+            checkpoint_dir: if set, results are flushed to this directory
+                            every chunk_size frames (see FrameCheckpoint)
+                            instead of being kept in memory, and an
+                            interrupted extraction of the same video
+                            resumes from its last complete chunk. Use one
+                            directory per video.
+            chunk_size: number of frames per checkpoint chunk
+        RETURNS:
+            Tuple of (image quality dataframe, optical flow dataframe,
+            motion dataframe)
+        '''
+        if num_workers > 0 and any(policy.policy == 'adaptive'
+                                   for policy in (sampling or {}).values()):
+            raise ValueError("Adaptive sampling is not supported with num_workers > 0")
+
+        options = {'num_workers': num_workers,
+                   'max_edge': max_edge,
+                   'motion_gate': motion_gate,
+                   'sampling': sampling,
+                   'backend': backend,
+                   'checkpoint_dir': checkpoint_dir,
+                   'chunk_size': chunk_size}
+
+        cap = cv2.VideoCapture(video)
+        num_frames = cap.get(cv2.cv.CV_CAP_PROP_FRAME_COUNT)
+        cap.release()
+
+        if num_segments > 1:
+            buffers = VideoFeatureExtraction._run_segments(
+                video, num_frames, num_segments, options)
+        else:
+            buffers = VideoFeatureExtraction._stitch_segments(
+                [extract_segment((video, 0, num_frames, options))])
+
+        img_quality_df = VideoFeatureExtraction._quality_df(video_id, buffers['quality'])
+        video_df = VideoFeatureExtraction._flow_df(video_id, buffers['flow'])
+        motion_df = VideoFeatureExtraction._motion_df(video_id, buffers['motion'])
+        return img_quality_df, video_df, motion_df
+
+    @staticmethod
+    def _config(max_edge, motion_gate, sampling, backend):
+        """
+        Extraction settings that change the results (not just the speed),
+        for ExtractionCache.key
+
+        ARGS:
+            max_edge, motion_gate, sampling, backend: see extract
+        RETURNS:
+            Dictionary of settings, with stable reprs
+        """
+        return {'max_edge': max_edge,
+                'motion_gate': motion_gate,
+                'sampling': sorted((family, policy.get_config())
+                                   for family, policy in (sampling or {}).items()),
+                'backend': backend}
+
+    @staticmethod
+    def _run_segments(video, num_frames, num_segments, options):
+        """
+        Extract a video as num_segments time segments in parallel processes
+        and stitch the results.
+
+        Each worker seeks to the frame before its segment (see
+        _read_frame_at) and decodes it only to use as the previous frame,
+        so the flow pair that crosses each segment boundary is computed by
+        the later segment as the sequential run would. The output matches
+        the sequential run as long as the seek position is found exactly:
+        always when ffprobe can read the packet timestamps, and otherwise
+        only for constant frame rate video.
+
+        Timestamps come from the decoder, and a segment whose clock
+        restarts after the seek is shifted to follow on from the previous
+        segment.
+
+        ARGS:
+            video: path to video file
+            num_frames: number of frames in the video
+            num_segments: number of segments/processes
+            options: dictionary of extraction options (see extract)
+        RETURNS:
+            Dictionary of buffers (see _buffers) for the whole video
+        """
+        bounds = np.linspace(0, num_frames, num_segments + 1).astype(int)
+        tasks = [(video, bounds[i], bounds[i + 1], options)
+                 for i in range(num_segments) if bounds[i + 1] > bounds[i]]
+
+        pool = multiprocessing.Pool(len(tasks))
+        try:
+            segments = pool.map(extract_segment, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        return VideoFeatureExtraction._stitch_segments(segments)
+
+    @staticmethod
+    def _stitch_segments(segments):
+        """
+        Concatenate per-segment results, dropping any frames that a segment
+        repeated from the previous ones (e.g. segments of different runs
+        resumed from checkpoints) and fixing up timestamps that restarted
+        after a seek. Each buffer is deduplicated by its own frame numbers,
+        since sampling can leave some buffers of a segment empty.
+
+        Segments extracted with a checkpoint are read from it one chunk at
+        a time, straight into output buffers of their final size, so the
+        rows are never held twice.
+
+        ARGS:
+            segments: results of extract_segment, in time order:
+                      dictionaries of buffers (see _buffers) or complete
+                      FrameCheckpoints
+        RETURNS:
+            Dictionary of buffers for the whole video
+        """
+        if len(segments) == 1 and isinstance(segments[0], dict):
+            return segments[0]
+
+        ## Output buffers, with room for every row of every segment
+        schemas = dict((name, buf.schema)
+                       for name, buf in VideoFeatureExtraction._buffers(0).items())
+        buffers = {}
+        for name, schema in schemas.items():
+            num_rows = sum(VideoFeatureExtraction._segment_rows(segment, name)
+                           for segment in segments)
+            buffers[name] = FrameBuffer(schema, capacity=num_rows)
+
+        ## Buffers with one row per sampled frame, whose times give the
+        ## frame period (flow has one row per point)
+        per_frame = ['quality', 'motion']
+
+        last_frames = dict((name, -1) for name in schemas)
+        last_time = None
+        frame_period = 0.
+        for segment in segments:
+            ## Times and last frame number of the rows each buffer keeps:
+            ## those after the last frame it already holds. Buffers are
+            ## sampled independently, so any of them may be empty.
+            index = dict((name, FrameBuffer([column for column in schema
+                                             if column[0] in ('frame_number', 'time')]))
+                         for name, schema in schemas.items())
+            first_times, last_times, segment_frames = {}, {}, {}
+            frame_times = dict((name, []) for name in per_frame)
+            for chunk in VideoFeatureExtraction._segment_chunks(segment, index):
+                for name, buf in chunk.items():
+                    keep = buf.view('frame_number') > last_frames[name]
+                    if not keep.any():
+                        continue
+                    times = buf.view('time')[keep]
+                    first_times.setdefault(name, times[0])
+                    last_times[name] = times[-1]
+                    segment_frames[name] = buf.view('frame_number')[keep][-1]
+                    if name in frame_times:
+                        frame_times[name].append(times.copy())
+            if not first_times:
+                ## Every row repeats earlier segments
+                continue
+
+            start_time = min(first_times.values())
+            time_shift = 0.
+            if last_time is not None and start_time <= last_time:
+                time_shift = last_time + frame_period - start_time
+            for name in per_frame:
+                if sum(len(times) for times in frame_times[name]) > 1:
+                    frame_period = np.median(np.diff(np.concatenate(frame_times[name])))
+                    break
+
+            for chunk in VideoFeatureExtraction._segment_chunks(segment):
+                for name, buf in buffers.items():
+                    seg_buf = chunk[name]
+                    keep_rows = seg_buf.view('frame_number') > last_frames[name]
+                    values = dict((column, seg_buf.view(column)[keep_rows])
+                                  for column in seg_buf.columns)
+                    values['time'] = values['time'] + time_shift
+                    buf.extend(int(keep_rows.sum()), **values)
+
+            last_frames.update(segment_frames)
+            last_time = max(last_times.values()) + time_shift
+
+        return buffers
+
+    @staticmethod
+    def _segment_chunks(segment, buffers=None):
+        """
+        The rows of a segment result, in chunks
+
+        ARGS:
+            segment: dictionary of buffers, or complete FrameCheckpoint
+            buffers: buffers to read checkpoint chunks into (see
+                     FrameCheckpoint.iter_chunks). Defaults to every
+                     buffer of _buffers.
+        RETURNS:
+            Iterable of dictionaries of buffers
+        """
+        if isinstance(segment, FrameCheckpoint):
+            if buffers is None:
+                buffers = VideoFeatureExtraction._buffers(segment.chunk_size)
+            return segment.iter_chunks(buffers)
+        return [segment]
+
+    @staticmethod
+    def _segment_rows(segment, name):
+        """
+        Number of rows of one buffer in a segment result
+        """
+        if isinstance(segment, FrameCheckpoint):
+            return segment.state['num_rows'].get(name, 0)
+        return len(segment[name])
+
+    @staticmethod
+    def _extract_frames(frames, num_frames, options, checkpoint=None):
+        """
+        Analyze a sequence of decoded frames and collect the results
+
+        ARGS:
+            frames: generator from _read_frames
+            num_frames: expected number of frames, used to size the buffers
+            options: dictionary of extraction options (see extract)
+            checkpoint: optional FrameCheckpoint. Results are flushed to it
+                        every chunk_size frames, and the tracker starts
+                        from its saved state.
+        RETURNS:
+            Dictionary of buffers (see _buffers), or, with a checkpoint,
+            the complete checkpoint, which holds every chunk including
+            those of earlier runs (see _stitch_segments)
+        """
+        ## Output buffers, sized from the reported frame count. They grow
+        ## geometrically if the container's frame count is wrong. With a
+        ## checkpoint they only ever hold one chunk.
+        buffer_frames = num_frames
+        if checkpoint is not None:
+            buffer_frames = min(num_frames, checkpoint.chunk_size)
+        buffers = VideoFeatureExtraction._buffers(buffer_frames)
+        quality_buf = buffers['quality']
+        flow_buf = buffers['flow']
+        motion_buf = buffers['motion']
+        num_unsaved = 0
+
+        ## Colour/size conversions actually computed, summed over frames
+        conversions = {}
+        num_analyzed = 0
+        num_flow = 0
+        num_skipped = 0
+
+        ## Adaptive sampling policies are fed the measured motion
+        sampling = options.get('sampling') or {}
+
+        num_workers = options['num_workers']
+        if num_workers > 0 and options['motion_gate'] is not None:
+            print "-I- motion_gate is not used with num_workers > 0"
+        if num_workers > 0:
+            ## Frames are analyzed out of order, so flow is computed
+            ## independently for every pair of frames
+            analyze = lambda item: VideoFeatureExtraction._analyze_frame(
+                item[2], item[3], frame_number=item[0],
+                quality=item[4][0], flow=item[4][1])
+            pipeline = FramePipeline(analyze, num_workers=num_workers)
+            results = pipeline.run(frames)
+            tracker = None
+        else:
+            tracker = FlowTracker(motion_gate=options['motion_gate'])
+            if checkpoint is not None and checkpoint.state['tracker'] is not None:
+                tracker.set_state(checkpoint.state['tracker'])
+            analyze = lambda item: VideoFeatureExtraction._analyze_frame(
+                item[2], item[3], tracker, frame_number=item[0],
+                quality=item[4][0], flow=item[4][1])
+            pipeline = None
+            results = ((item, analyze(item)) for item in frames)
+
+        for (i_frame, time, frame, prev_frame, (quality, flow)), \
+                (blur, color, motion, pts, skipped, gap) in results:
+            ## Progress logging
+            if i_frame % 100 == 0:
+            	print i_frame
+
+            ## Image quality rows are written for frames sampled for quality,
+            ## and motion rows for frames sampled for flow. Quality rows
+            ## repeat the motion values of frames sampled for both.
+            if quality:
+                image = frame.get_image()
+                quality_buf.append(frame_number=i_frame,
+                                   time=time,
+                                   blur=blur,
+                                   motion_mean=motion[0],
+                                   motion_stdev=motion[1],
+                                   color=color,
+                                   num_pixels=image.shape[0] * image.shape[1],
+                                   flow_skipped=skipped)
+            for name, count in frame.conversions.items():
+                conversions[name] = conversions.get(name, 0) + count
+            num_analyzed += 1
+            num_flow += flow
+            num_skipped += skipped
+            for policy in sampling.values():
+                policy.observe(i_frame, motion[0])
+
+            num_points = 0
+            if pts is not None:
+                p0, p1, st, err = pts
+                num_points = len(st)
+                flow_buf.extend(len(st),
+                                frame_number=i_frame,
+                                time=time,
+                                x0=p0[:, 0],
+                                y0=p0[:, 1],
+                                x1=p1[:, 0],
+                                y1=p1[:, 1],
+                                flow_st=st,
+                                flow_err=err)
+            if flow:
+                motion_buf.append(frame_number=i_frame,
+                                  time=time,
+                                  motion_mean=motion[0],
+                                  motion_stdev=motion[1],
+                                  flow_skipped=skipped,
+                                  flow_gap=gap,
+                                  num_points=num_points)
+
+            ## Flush a complete chunk
+            num_unsaved += 1
+            if checkpoint is not None and num_unsaved >= checkpoint.chunk_size:
+                sampling_state = dict((family, policy.get_state())
+                                      for family, policy in sampling.items()
+                                      if policy is not None)
+                checkpoint.save(buffers, i_frame + 1,
+                                tracker.get_state() if tracker is not None else None,
+                                sampling_state=sampling_state)
+                for buf in buffers.values():
+                    buf.clear()
+                num_unsaved = 0
+
+        if pipeline is not None:
+            print pipeline.report()
+        if num_analyzed > 0:
+            print "-I- Conversions per frame: " + ", ".join(
+                "%s %.2f" % (name, 1. * count / num_analyzed)
+                for name, count in sorted(conversions.items()))
+        if options['motion_gate'] is not None and num_flow > 0:
+            print "-I- Flow skipped on %d of %d frames (%.1f%%)" % \
+                (num_skipped, num_flow, 100. * num_skipped / num_flow)
+
+        if checkpoint is not None:
+            checkpoint.save(buffers, None, complete=True)
+            return checkpoint
+
+        for buf in buffers.values():
+            buf.trim()
+        return buffers
+
+    @staticmethod
+    def _read_frame_at(cap, frame_number, max_edge=None, frame_times=None):
+        """
+        Seek to a frame and read it, frame-accurately.
+
+        CV_CAP_PROP_POS_FRAMES seeks are not frame-accurate with every
+        codec and backend, and the position the decoder reports afterwards
+        is often just the requested one. The position actually reached is
+        therefore worked out from the timestamp of the frame decoded after
+        the seek, relative to the first frame's timestamp: it is the frame
+        with that timestamp in frame_times, or, without frame_times, the
+        timestamp times the frame rate, which is only right for constant
+        frame rate video. If that is still before frame_number, frames are
+        decoded forward to it. If the seek overshot, even past the end of
+        the video, it is retried further back, and as a last resort the
+        video is decoded from the start.
+
+        ARGS:
+            cap: video opened with VideoUtilities.open_video
+            frame_number: frame to read
+            max_edge: analysis resolution (see FrameContext)
+            frame_times: presentation time of every frame (see
+                         VideoUtilities.get_frame_times), or None to
+                         assume a constant frame rate
+        RETURNS:
+            Tuple of (whether there was a frame, FrameContext); the next
+            read returns frame_number + 1
+        """
+        fps = cap.get(cv2.cv.CV_CAP_PROP_FPS)
+        if frame_times is not None and len(frame_times) <= frame_number:
+            ## The timestamps do not cover the video
+            frame_times = None
+        if frame_times is not None:
+            frame_offsets = frame_times - frame_times[0]
+
+        cap.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, 0)
+        ret, frame = VideoUtilities.read_frame(cap, max_edge)
+        if ret == False:
+            return False, None
+        first_time = cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000.
+
+        position = 0
+        backoff = 0
+        while frame_number > 0:
+            seek_frame = frame_number - backoff
+            if seek_frame <= 0 or (frame_times is None and fps <= 0):
+                ## Decode forward from the first frame
+                cap.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, 0)
+                ret, frame = VideoUtilities.read_frame(cap, max_edge)
+                position = 0
+                break
+            cap.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, seek_frame)
+            ret, frame = VideoUtilities.read_frame(cap, max_edge)
+            if ret:
+                offset = cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000. - first_time
+                if frame_times is not None:
+                    position = int(np.argmin(np.abs(frame_offsets - offset)))
+                else:
+                    position = int(round(offset * fps))
+                if 0 <= position <= frame_number:
+                    break
+            ## Overshot (possibly past the end): seek further back
+            backoff = max(2 * backoff, 16)
+
+        while ret and position < frame_number:
+            if position < frame_number - 1:
+                ret = cap.grab()
+            else:
+                ret, frame = VideoUtilities.read_frame(cap, max_edge)
+            position += 1
+        if not ret:
+            return False, None
+        return True, frame
+
+    @staticmethod
+    def _read_frames(cap, num_frames, first_frame=0, frame=None, max_edge=None,
+                     sampling=None, sampling_state=None):
+        """
+        Decode frames from an open video. Each frame is wrapped in a
+        FrameContext, which downscales it to the analysis resolution and
+        converts it to gray/HSV at most once, when first needed.
+
+        Frames that no metric family needs (see FrameSampling) are skipped
+        with grab(), without being decoded. A frame is decoded if the
+        quality or flow family wants it, or if the flow family wants the
+        next frame, since flow runs on consecutive pairs.
+
+        ARGS:
+            cap: cv2.VideoCapture or FFmpegCapture (see
+                 VideoUtilities.open_video)
+            num_frames: maximum number of frames to read
+            first_frame: frame number of the next frame cap will return
+            frame: FrameContext of the frame before first_frame, if it has
+                   already been decoded
+            max_edge: analysis resolution (see extract)
+            sampling: dictionary of FrameSampling by metric family
+                      ('quality', 'flow'). Missing families use every frame.
+            sampling_state: dictionary of FrameSampling.get_state() by
+                            metric family to carry on from, e.g. when
+                            resuming from a checkpoint. Otherwise the
+                            policies start afresh at first_frame.
+        RETURNS:
+            Generator of (frame number, time, frame, previous frame,
+            (quality, flow)) tuples, where frames are FrameContexts and
+            quality/flow say which metric families to compute. The
+            previous frame is None if the frame before was not decoded,
+            e.g. for the first frame of the video.
+        """
+        if sampling is None:
+            sampling = {}
+        quality_sampling = sampling.get('quality')
+        flow_sampling = sampling.get('flow')
+        for family, policy in sampling.items():
+            if policy is None:
+                continue
+            if sampling_state is not None and family in sampling_state:
+                policy.set_state(sampling_state[family])
+            else:
+                policy.reset()
+
+        i_frame = first_frame
+        while i_frame < first_frame + num_frames:
+            prev_frame = frame
+
+            quality = quality_sampling is None or quality_sampling.wants(i_frame)
+            flow = flow_sampling is None or flow_sampling.wants(i_frame)
+            if not (quality or flow or flow_sampling.wants(i_frame + 1)):
+                ## Not needed: skip without decoding
+                frame = None
+                if not cap.grab():
+                    break
+                i_frame += 1
+                continue
+
+            ret,frame = VideoUtilities.read_frame(cap, max_edge)
+            ## If there are no more frames, break out of loop
+            if ret == False:
+                break
+
+            if quality and quality_sampling is not None:
+                quality_sampling.sampled(i_frame)
+            if flow and flow_sampling is not None:
+                flow_sampling.sampled(i_frame)
+
+            if quality or flow:
+                time = cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000.
+                yield i_frame, time, frame, prev_frame, (quality, flow)
+            i_frame += 1
+
+    @staticmethod
+    def _analyze_frame(frame, prev_frame, tracker=None, frame_number=None,
+                       quality=True, flow=True):
+        """
+        Compute every per-frame metric. Without a tracker this is thread
+        safe so it can run on FramePipeline workers.
+
+        ARGS:
+            frame: FrameContext of the current frame
+            prev_frame: FrameContext of the previous frame, or None if it
+                        was not decoded
+            tracker: optional FlowTracker. If it did not see the previous
+                     frame last, it is restarted from prev_frame.
+            frame_number: frame number of frame
+            quality: whether to compute the image quality metrics
+            flow: whether to compute the motion metrics
+        RETURNS:
+            Tuple of (blur, color histogram values, motion, flow points,
+            skipped, gap). Blur and color are None if quality is False.
+            Motion is the (mean, standard deviation) from
+            VideoUtilities.motion_energy, or NaNs without a previous frame.
+            Flow points are as returned by VideoUtilities.flow_points, or
+            None. skipped is whether the tracker's motion gate skipped flow,
+            and gap the number of frames the flow points moved over (see
+            FlowTracker.gap).
+        """
+        ##=======================
+        ## Image quality metrics
+        ##=======================
+        blur, color = None, None
+        if quality:
+            ## Blur
+            blur = FrameAnalysis.get_blur_value(frame)
+
+            ## Color Spectrum
+            color = FrameAnalysis.get_hsv_hist_values(frame)
+
+        ##=======================
+        ## Video/motion metrics
+        ##=======================
+        motion = (np.nan, np.nan)
+        pts = None
+        skipped = False
+        gap = 0
+        if not flow:
+            return blur, color, motion, pts, skipped, gap
+
+        ## Frame difference, on the same preprocessed frames as optical flow
+        if prev_frame is not None:
+            motion = VideoUtilities.motion_energy(frame, prev_frame)
+
+        ## Optical Flow
+        if tracker is not None:
+            ## Restart the tracker after a seek or skipped frames
+            if prev_frame is not None and frame_number is not None and \
+                    tracker.prev_frame_number != frame_number - 1:
+                tracker.reset()
+                tracker.update(prev_frame, frame_number - 1)
+            pts = tracker.update(frame, frame_number)
+            skipped = tracker.skipped
+            gap = tracker.gap
+        elif prev_frame is not None:
+            pts = VideoUtilities.flow_points(frame, prev_frame)
+            if pts is not None:
+                gap = 1
+
+        return blur, color, motion, pts, skipped, gap
+
+    @staticmethod
+    def _buffers(num_frames):
+        """
+        Create the output buffers of an extraction
+
+        ARGS:
+            num_frames: expected number of frames in the video
+        RETURNS:
+            Dictionary of FrameBuffers: 'quality' (see _quality_buffer),
+            'flow' (see _flow_buffer) and 'motion' (see _motion_buffer)
+        """
+        return {'quality': VideoFeatureExtraction._quality_buffer(num_frames),
+                'flow': VideoFeatureExtraction._flow_buffer(num_frames),
+                'motion': VideoFeatureExtraction._motion_buffer(num_frames)}
+
+    @staticmethod
+    def _quality_buffer(num_frames):
+        """
+        Create the columnar buffer for per-frame image quality metrics
+
+        ARGS:
+            num_frames: expected number of frames in the video
+        RETURNS:
+            FrameBuffer with one row per frame
+        """
+        num_color_cols = len(FrameAnalysis.get_hsv_hist_columns())
+        schema = [('frame_number', np.int64, ()),
+                  ('time', np.float64, ()),
+                  ('blur', np.float64, ()),
+                  ('motion_mean', np.float64, ()),
+                  ('motion_stdev', np.float64, ()),
+                  ('color', np.int64, (num_color_cols,)),
+                  ('num_pixels', np.int64, ()),
+                  ('flow_skipped', np.uint8, ())]
+        return FrameBuffer(schema, capacity=num_frames + 1)
+
+    @staticmethod
+    def _flow_buffer(num_frames):
+        """
+        Create the columnar buffer for optical flow points
+
+        ARGS:
+            num_frames: expected number of frames in the video
+        RETURNS:
+            FrameBuffer with one row per tracked point
+        """
+        max_points = VideoUtilities.FEATURE_PARAMS['maxCorners']
+        schema = [(name, dtype, ()) for name, dtype in FlowPreprocess.FLOW_SCHEMA]
+        return FrameBuffer(schema, capacity=(num_frames + 1) * max_points)
+
+    @staticmethod
+    def _motion_buffer(num_frames):
+        """
+        Create the columnar buffer for per-frame motion metrics
+
+        ARGS:
+            num_frames: expected number of frames in the video
+        RETURNS:
+            FrameBuffer with one row per frame sampled for flow
+        """
+        schema = [('frame_number', np.int64, ()),
+                  ('time', np.float64, ()),
+                  ('motion_mean', np.float64, ()),
+                  ('motion_stdev', np.float64, ()),
+                  ('flow_skipped', np.uint8, ()),
+                  ('flow_gap', np.int32, ()),
+                  ('num_points', np.int32, ())]
+        return FrameBuffer(schema, capacity=num_frames + 1)
+
+    @staticmethod
+    def _quality_df(video_id, quality_buf):
+        """
+        Build the image quality dataframe from its buffer, in a single step.
+        The motion columns repeat the motion dataframe for frames that
+        were sampled for flow as well, and are NaN (motion) or 0
+        (flow_skipped) for the others.
+
+        ARGS:
+            video_id: unique video identifier
+            quality_buf: FrameBuffer filled by run
+        RETURNS:
+            Dataframe with one row per frame
+        """
+        frame_df = pd.DataFrame({'video_id': video_id,
+                                 'frame_number': quality_buf.view('frame_number'),
+                                 'time': quality_buf.view('time'),
+                                 'blur': quality_buf.view('blur'),
+                                 'motion_mean': quality_buf.view('motion_mean'),
+                                 'motion_stdev': quality_buf.view('motion_stdev')},
+                                columns=['video_id', 'frame_number', 'time', 'blur',
+                                         'motion_mean', 'motion_stdev'])
+        color_df = pd.DataFrame(quality_buf.view('color'),
+                                columns=FrameAnalysis.get_hsv_hist_columns())
+        ## Pixels per frame at the analysis resolution, to normalise
+        ## pixel counts
+        color_df['num_pixels'] = quality_buf.view('num_pixels')
+        ## Frames whose flow was skipped by the motion gate
+        color_df['flow_skipped'] = quality_buf.view('flow_skipped')
+        return pd.concat([frame_df, color_df], axis=1)
+
+    @staticmethod
+    def _flow_df(video_id, flow_buf):
+        """
+        Build the optical flow dataframe from its buffer, in a single step.
+        Columns are those of FlowPreprocess.FLOW_SCHEMA, after video_id.
+
+        ARGS:
+            video_id: unique video identifier
+            flow_buf: FrameBuffer filled by run
+        RETURNS:
+            Dataframe with one row per tracked point
+        """
+        names = [name for name, _ in FlowPreprocess.FLOW_SCHEMA]
+        columns = dict((name, flow_buf.view(name)) for name in names)
+        columns['video_id'] = video_id
+        return pd.DataFrame(columns, columns=['video_id'] + names)
+
+    @staticmethod
+    def _motion_df(video_id, motion_buf):
+        """
+        Build the motion dataframe from its buffer. It has one row per
+        frame sampled for flow, so per-frame flow statistics (points per
+        frame, share of frames skipped by the motion gate) can be taken
+        over the frames flow was actually computed on.
+
+        ARGS:
+            video_id: unique video identifier
+            motion_buf: FrameBuffer filled by run
+        RETURNS:
+            Dataframe with one row per frame sampled for flow: frame number,
+            time, motion mean and standard deviation (see
+            VideoUtilities.motion_energy), flow_skipped, flow_gap and the
+            number of flow points recorded (num_points). flow_gap is the
+            number of frames the frame's flow points moved over: 1, or 0
+            if the motion gate held them, or more for the first frame
+            computed after held frames (see FlowTracker). Divide by it to
+            get motion per frame.
+        """
+        names = [name for name, _, _ in motion_buf.schema]
+        columns = dict((name, motion_buf.view(name)) for name in names)
+        columns['video_id'] = video_id
+        return pd.DataFrame(columns, columns=['video_id'] + names)
+
+def extract_segment(args):
+    """
+    Extract features for one segment of a video, [start_frame, end_frame).
+    This is a module level function so that it can be sent to
+    multiprocessing workers. With a checkpoint_dir option, the segment
+    keeps its chunks in its own subdirectory and resumes from them, unless
+    they were made from another video or with other settings.
+
+    ARGS:
+        args: tuple of (video path, start frame, end frame, options), where
+              options is a dictionary of extraction options (see
+              VideoFeatureExtraction.extract)
+    RETURNS:
+        Dictionary of buffers (see VideoFeatureExtraction._buffers), or the
+        complete FrameCheckpoint with a checkpoint_dir option
+    """
+    video, start_frame, end_frame, options = args
+    start_frame, end_frame = int(start_frame), int(end_frame)
+
+    ## Resume after the last complete chunk of an earlier run
+    checkpoint = None
+    sampling_state = None
+    if options.get('checkpoint_dir') is not None:
+        config = VideoFeatureExtraction._config(options['max_edge'],
+                                                options['motion_gate'],
+                                                options.get('sampling'),
+                                                options['backend'])
+        config.update(pipelined=options['num_workers'] > 0,
+                      chunk_size=options['chunk_size'],
+                      start_frame=start_frame,
+                      end_frame=end_frame)
+        checkpoint = FrameCheckpoint(
+            os.path.join(options['checkpoint_dir'],
+                         'frames_%d_%d' % (start_frame, end_frame)),
+            options['chunk_size'],
+            key=ExtractionCache.key(video, config))
+        if checkpoint.state['complete']:
+            print "-I- Using extracted frames from %s" % checkpoint.directory
+            return checkpoint
+        if checkpoint.state['next_frame'] is not None:
+            start_frame = checkpoint.state['next_frame']
+            sampling_state = checkpoint.state.get('sampling')
+            print "-I- Resuming extraction at frame %d" % start_frame
+
+    cap = VideoUtilities.open_video(video, options['backend'], options['max_edge'])
+
+    ## Decode the frame before the segment, so the first frame of the
+    ## segment has a previous frame to compute flow against
+    prev_frame = None
+    first_frame = start_frame
+    if start_frame > 0:
+        frame_times = VideoUtilities.get_frame_times(video)
+        if len(frame_times) == 0:
+            print "-I- No frame timestamps; seeking assumes a constant frame rate"
+            frame_times = None
+        ret, prev_frame = VideoFeatureExtraction._read_frame_at(
+            cap, start_frame - 1, options['max_edge'], frame_times)
+        if ret == False:
+            cap.release()
+            return VideoFeatureExtraction._extract_frames([], 1, options, checkpoint)
+
+    frames = VideoFeatureExtraction._read_frames(cap,
+                                                 end_frame - first_frame,
+                                                 first_frame=first_frame,
+                                                 frame=prev_frame,
+                                                 max_edge=options['max_edge'],
+                                                 sampling=options.get('sampling'),
+                                                 sampling_state=sampling_state)
+    out = VideoFeatureExtraction._extract_frames(frames,
+                                                 end_frame - first_frame,
+                                                 options,
+                                                 checkpoint)
+    cap.release()
+    return out
 
 if __name__ == "__main__":
     video = "../media/CKeLfaOl0Qk.mp4"
@@ -1,6 +1,9 @@
 import pandas as pd
 import numpy as np
 from scene_postprocess import ScenePostprocess
+from flow_preprocess import FlowPreprocess
+from scene_features import SceneFeatures
+from video_analysis import VideoAnalysis
 
 
 class VideoPostprocess(object):
@@ -12,7 +15,8 @@ class VideoPostprocess(object):
     1. Would random sampling of scenes be as effective as a summary of every scene
     """
 
-    def __init__(self, video_id, flow_df, quality_df):
+    def __init__(self, video_id, flow_df, quality_df, threshold=None,
+                 motion_df=None):
         """
         Default constructor
 
@@ -20,75 +24,120 @@ class VideoPostprocess(object):
             video_id: unique video identifier
             flow_df: dataframe with optical flow data
             quality_df: dataframe with image quality data
+            threshold: if given, scenes are split at this scene cut
+                       threshold (see VideoAnalysis.resegment) instead of
+                       the stored is_scene_transition flags
+            motion_df: optional dataframe with one row per frame sampled
+                       for flow (see VideoFeatureExtraction._motion_df).
+                       Per-frame flow statistics are taken over its frames;
+                       without it, over the image quality frames.
         RETURNS:
             None
         """
         self.video_id = video_id
-        self.flow_df = flow_df.copy()
-        self.quality_df = quality_df.copy()
-        self.scenes = self._split_scenes()
+
+        ## Per-point motion is computed once for the whole video, and both
+        ## dataframes are sorted by frame number so scenes are row ranges
+        flow_df = FlowPreprocess.to_flat_layout(flow_df)
+        self.flow_df = self._sort_by_frame(FlowPreprocess.add_motion_columns(flow_df))
+        self.quality_df = self._sort_by_frame(quality_df)
+        self.motion_df = None
+        if motion_df is not None:
+            self.motion_df = self._sort_by_frame(motion_df)
+        if threshold is not None:
+            ## Resegmenting overwrites the caller's cut flags, so on a copy
+            self.quality_df = self.quality_df.copy()
+            self.quality_df['is_scene_transition'] = \
+                VideoAnalysis.resegment(self.quality_df, threshold).values
+        self._scenes = None
+
+    @property
+    def scenes(self):
+        """
+        ScenePostprocess of every scene, built on first use (the batch
+        to_df does not need them)
+        """
+        if self._scenes is None:
+            self._scenes = self._split_scenes()
+        return self._scenes
+
+    @staticmethod
+    def _sort_by_frame(df):
+        """
+        Sort a dataframe by frame number (keeping the order of rows of the
+        same frame) and renumber its index
+
+        ARGS:
+            df: dataframe with a 'frame_number' column
+        RETURNS:
+            Sorted dataframe
+        """
+        if (np.diff(df['frame_number'].values) < 0).any():
+            df = df.sort_values('frame_number', kind='mergesort')
+        return df.reset_index(drop=True)
 
     def _split_scenes(self):
         """
-        Split the video up by scenes, and process each scene.
+        Split the video up by scenes, and process each scene. Each scene
+        gets row slices (views) of the video's dataframes.
 
         ARGS:
             None
         RETURNS:
             Returns a list of scene objects
         """
-        scene_list = []
-
         df = self.quality_df
         split_frame_numbers = df[df['is_scene_transition'] == 1]['frame_number'].values
-        # Take care of last scene split by appending -1
-        split_frame_numbers = np.append(split_frame_numbers, -1)
 
         ## Handle special case where video is single, continuous scene
         if len(split_frame_numbers) == 0:
-            scene_list = [ScenePostprocess(flow_df=self.flow_df, quality_df=self.quality_df)]
-        ## Video has multiple scenes
-        else:
-            i_begin = 0
-            for i_end in split_frame_numbers:
-                f_df = self._get_frame_range(self.flow_df, i_begin, i_end)
-                f_df.reset_index(inplace=True)
-                q_df = self._get_frame_range(self.quality_df, i_begin, i_end)
-                f_df.reset_index(inplace=True)
-                scene_list.append(ScenePostprocess(f_df, q_df))
-                i_begin = i_end
+            return [ScenePostprocess(flow_df=self.flow_df, quality_df=self.quality_df,
+                                     motion_df=self.motion_df)]
+
+        ## Video has multiple scenes. Scene i covers frame numbers
+        ## [bounds[i], bounds[i + 1]).
+        quality_frames = self.quality_df['frame_number'].values
+        flow_frames = self.flow_df['frame_number'].values
+        quality_rows = np.concatenate([[0], np.searchsorted(quality_frames, split_frame_numbers),
+                                       [len(quality_frames)]])
+        flow_rows = np.concatenate([[0], np.searchsorted(flow_frames, split_frame_numbers),
+                                    [len(flow_frames)]])
+        if self.motion_df is not None:
+            motion_frames = self.motion_df['frame_number'].values
+            motion_rows = np.concatenate([[0], np.searchsorted(motion_frames, split_frame_numbers),
+                                          [len(motion_frames)]])
 
-        return scene_list
-
-    def _get_frame_range(self, input_df, begin_frame_num, end_frame_num=-1):
-        """
-        Create a dataframe for a specific range of frames. This is a
-        helper function to a helper function.
-
-        ARGS:
-            input_df: dataframe to separate
-            begin_frame_num: starting frame number
-            end_frame_num: ending frame number, non-inclusive
-        RETURNS:
-            Dataframe containing only frames in given range
-        """
-        df = input_df.copy()
-        df = df[df['frame_number'] >= begin_frame_num]
+        scene_list = []
+        for i in range(len(quality_rows) - 1):
+            ## A cut on the first frame leaves nothing before it
+            if quality_rows[i + 1] <= quality_rows[i]:
+                continue
+            q_df = self.quality_df.iloc[quality_rows[i]:quality_rows[i + 1]]
+            f_df = self.flow_df.iloc[flow_rows[i]:flow_rows[i + 1]]
+            m_df = None
+            if self.motion_df is not None:
+                m_df = self.motion_df.iloc[motion_rows[i]:motion_rows[i + 1]]
+            scene_list.append(ScenePostprocess(f_df, q_df, motion_df=m_df))
 
-        if end_frame_num > 0:
-            ## non-inclusive interval
-            df = df[df['frame_number'] < end_frame_num]
-        return df
+        return scene_list
 
-    def to_df(self):
+    def to_df(self, batch=True):
         """
         Aggregate all scene summary dataframes into a single dataframe
 
         ARGS:
-            None
+            batch: compute every scene's features in one pass over the
+                   whole video (see SceneFeatures). If False, call
+                   ScenePostprocess.to_df on each scene; the results are
+                   the same.
         RETURNS:
             Dataframe containing a summary of every scene in the video.
         """
+        if batch:
+            return SceneFeatures.to_df(self.quality_df, self.flow_df,
+                                       video_id=self.video_id,
+                                       motion_df=self.motion_df)
+
         video_df = pd.DataFrame()
         for scene in self.scenes:
             video_df = video_df.append(scene.to_df(), ignore_index=True)
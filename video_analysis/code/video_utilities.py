@@ -2,6 +2,9 @@ import cv2
 import numpy as np
 import pandas as pd
 import math
+from subprocess import Popen, PIPE
+from frame_context import FrameContext
+from ffmpeg_capture import FFmpegCapture
 
 
 class VideoUtilities():
@@ -9,130 +12,326 @@ class VideoUtilities():
     Standard functions for video cleanup
     """
 
+    # params for ShiTomasi corner detection
+    FEATURE_PARAMS = dict( maxCorners = 50,
+                           qualityLevel = 0.5,
+                           minDistance = 10,
+                           blockSize = 7 )
+
+    # Parameters for lucas kanade optical flow
+    LK_PARAMS = dict( winSize  = (15,15),
+                      maxLevel = 5,
+                      criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
     @staticmethod
-    def get_derivative(video, frame_stride=1):
+    def open_video(video, backend='opencv', max_edge=None):
+        """
+        Open a video for decoding
+
+        ARGS:
+            video: path to video file
+            backend: 'opencv' for cv2.VideoCapture, or 'ffmpeg' for
+                     FFmpegCapture, which scales frames to max_edge in the
+                     decoder
+            max_edge: analysis resolution (only used by 'ffmpeg')
+        RETURNS:
+            cv2.VideoCapture or FFmpegCapture
+        """
+        if backend == 'ffmpeg':
+            return FFmpegCapture(video, max_edge=max_edge)
+        if backend != 'opencv':
+            raise ValueError("Unknown video backend: %s" % backend)
+        return cv2.VideoCapture(video)
+
+    @staticmethod
+    def read_frame(cap, max_edge=None):
+        """
+        Read the next frame from a video opened with open_video
+
+        ARGS:
+            cap: cv2.VideoCapture or FFmpegCapture
+            max_edge: analysis resolution (see FrameContext)
+        RETURNS:
+            Tuple of (whether there was a frame, FrameContext)
+        """
+        ret, frame = cap.read()
+        if ret == False:
+            return False, None
+        return True, FrameContext(frame, max_edge)
+
+    @staticmethod
+    def get_derivative(video, frame_stride=1, spill_path=None, backend='opencv',
+                       max_edge=None):
         """
         Take derivative of video. The derivative is calculated as:
-            dx/dt = Frame(n + frame_stride) - Frame(n)
+            dx/dt = |Frame(n + frame_stride) - Frame(n)|
+        on standardized (grayscale, blurred) frames.
+
+        Only per-frame summaries are kept in memory. Difference images are
+        optionally written to spill_path, one after another, and returned
+        as a read-only memory-mapped array.
 
         ARGS:
             video: path to video file
             frame_stride: number of frames to between subtraction operations
+            spill_path: file to write the difference images to, or None to
+                        discard them
+            backend, max_edge: see open_video
         RETURNS:
-            Dataframe of the derviatives for the video
+            Dataframe of the derviatives for the video: 'frame_number',
+            'time', 'deriv_mean' and 'deriv_stdev'. If spill_path is given,
+            a tuple of the dataframe and an (n, height, width) uint8
+            np.memmap of the difference images, one per row.
         """
-        deriv_df = pd.DataFrame()
+        spill_file = None
+        if spill_path is not None:
+            spill_file = open(spill_path, 'wb')
+
+        try:
+            rows = list(VideoUtilities.iter_derivative(video, frame_stride,
+                                                       spill_file, backend,
+                                                       max_edge))
+        finally:
+            if spill_file is not None:
+                spill_file.close()
+
+        deriv_df = pd.DataFrame(rows, columns=['frame_number', 'time',
+                                               'deriv_mean', 'deriv_stdev'])
+        if spill_path is None:
+            return deriv_df
+
+        ## Difference images are the size of the analyzed frames
+        cap = VideoUtilities.open_video(video, backend, max_edge)
+        ret, frame = VideoUtilities.read_frame(cap, max_edge)
+        cap.release()
+        shape = frame.get_image().shape[:2] if ret else (0, 0)
+        if len(deriv_df) == 0:
+            images = np.zeros((0,) + shape, dtype=np.uint8)
+        else:
+            images = np.memmap(spill_path, dtype=np.uint8, mode='r',
+                               shape=(len(deriv_df),) + shape)
+        return deriv_df, images
 
-        cap = cv2.VideoCapture(video)
-        ret, frame = cap.read()
-        frame = VideoAnalysis._img_preprocess(frame)
-        frame_series = pd.Series()
-        frame_series['time'] = cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000.
-        deriv_df.append(frame_series, ignore_index=True)
-
-        while frame is not None:
-            prev_frame = frame.copy()
-            ## Capture image
-            i = 0
-            while i < frame_stride:
-                ret,frame = cap.read()
-                i += 1
-            ## TODO: Check that there's actually a frame there
-            frame = VideoAnalysis._img_preprocess(frame)
-
-            # Take the difference
-            frame_diff = abs(frame - prev_frame)
-            frame_series = pd.Series()
-            frame_series['time'] = cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000.
-            ## The following functions should be done elsewherez
-            frame_series['deriv_mean'] = frame_diff.mean()
-            frame_series['deriv_stdev'] = frame_diff.std()
-            frame_series['deriv_image'] = frame_diff
-
-            deriv_df = deriv_df.append(frame_series, ignore_index=True)
-
-        return deriv_df
+    @staticmethod
+    def iter_derivative(video, frame_stride=1, spill_file=None, backend='opencv',
+                        max_edge=None):
+        """
+        Streaming version of get_derivative. Frames are decoded one at a
+        time and only the current pair is held in memory.
+
+        ARGS:
+            video: path to video file
+            frame_stride: number of frames to between subtraction operations.
+                          Frames in between are skipped with grab().
+            spill_file: open binary file to append each difference image
+                        to, or None
+            backend, max_edge: see open_video
+        RETURNS:
+            Generator of (frame number, time, mean, standard deviation) of
+            each difference image
+        """
+        cap = VideoUtilities.open_video(video, backend, max_edge)
+        ret, frame = VideoUtilities.read_frame(cap, max_edge)
+        if ret == False:
+            return
+        prev_image = VideoUtilities._img_preprocess(frame)
+
+        i_frame = 0
+        while True:
+            for _ in range(frame_stride - 1):
+                cap.grab()
+            ret, frame = VideoUtilities.read_frame(cap, max_edge)
+            ## If there are no more frames, break out of loop
+            if ret == False:
+                break
+            i_frame += frame_stride
+            image = VideoUtilities._img_preprocess(frame)
+
+            # Take the (saturating) difference
+            frame_diff = cv2.absdiff(image, prev_image)
+            if spill_file is not None:
+                frame_diff.tofile(spill_file)
+            mean, stdev = cv2.meanStdDev(frame_diff)
+
+            yield (i_frame, cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000.,
+                   mean[0, 0], stdev[0, 0])
+            prev_image = image
+        cap.release()
+
+    @staticmethod
+    def _get_packets(video):
+        """
+        Timestamps and keyframe flags of the video stream's packets, read
+        with ffprobe without decoding anything
+
+        ARGS:
+            video: path to video file
+        RETURNS:
+            Tuple of (packet times in seconds, keyframe flags), numpy
+            arrays in presentation order, so index i is frame number i
+        """
+        p = Popen(["ffprobe", "-v", "error", "-select_streams", "v:0",
+                   "-show_entries", "packet=pts_time,flags",
+                   "-of", "csv=p=0", video], stdout=PIPE, stderr=PIPE)
+        output, err = p.communicate()
+
+        times = []
+        is_key = []
+        for line in output.split():
+            fields = line.split(',')
+            if len(fields) < 2 or fields[0] == 'N/A':
+                continue
+            times.append(float(fields[0]))
+            is_key.append('K' in fields[1])
+
+        ## Packets are in decode order; frame numbers are in presentation
+        ## (time) order
+        order = np.argsort(times, kind='mergesort')
+        return (np.array(times, dtype=np.float64)[order],
+                np.array(is_key, dtype=bool)[order])
+
+    @staticmethod
+    def get_keyframes(video):
+        """
+        Frame numbers of the video's keyframes (I-frames). OpenCV does not
+        expose frame types, so this reads the packet flags with ffprobe,
+        without decoding anything.
+
+        ARGS:
+            video: path to video file
+        RETURNS:
+            Sorted numpy array of keyframe numbers
+        """
+        times, is_key = VideoUtilities._get_packets(video)
+        return np.flatnonzero(is_key)
 
     @staticmethod
-    def optical_flow(video, stride=1, preprocess=True):
+    def get_frame_times(video):
+        """
+        Presentation time of every frame, from the packet timestamps. Unlike
+        frame number / fps, this holds for variable frame rate video.
+
+        ARGS:
+            video: path to video file
+        RETURNS:
+            Numpy array of times in seconds, indexed by frame number. Empty
+            if ffprobe is not installed.
+        """
+        try:
+            times, is_key = VideoUtilities._get_packets(video)
+        except OSError:
+            return np.zeros(0)
+        return times
+
+    @staticmethod
+    def motion_energy(frame, prev_frame, preprocess=True):
+        """
+        Mean and standard deviation of the absolute difference between two
+        frames. A cheap, dense measure of how much changed between them.
+
+        ARGS:
+            frame: current frame, or its FrameContext
+            prev_frame: previous frame, or its FrameContext
+            preprocess: whether frames need to be put into standardized
+                        format (with FrameContexts, the preprocessed frame
+                        is shared with optical flow)
+        RETURNS:
+            Tuple of (mean, standard deviation)
+        """
+        if preprocess:
+            image = VideoUtilities._img_preprocess(frame)
+            prev_image = VideoUtilities._img_preprocess(prev_frame)
+        else:
+            image, prev_image = frame, prev_frame
+        mean, stdev = cv2.meanStdDev(cv2.absdiff(image, prev_image))
+        return mean[0, 0], stdev[0, 0]
+
+    @staticmethod
+    def optical_flow(video, stride=1, preprocess=True, redetect_fraction=None,
+                     return_tracks=False, backend='opencv', max_edge=None):
         """
         Calculate the optical flow for a video.
         Adapted from http://docs.opencv.org/master/d7/d8b/tutorial_py_lucas_kanade.html#gsc.tab=0
 
         ARGS:
-            video:
-            stride:
+            video: path to video file
+            stride: number of frames between the two frames of each flow
+                    pair. Frames in between are skipped with grab(), without
+                    being decoded.
             preprocess: whether video needs to be put into standardized
                         format
+            redetect_fraction: if None, feature points are re-detected on
+                               every frame. Otherwise points are tracked
+                               from frame to frame and only topped up with
+                               new detections when fewer than
+                               redetect_fraction * maxCorners survive
+                               (see FlowTracker).
+            return_tracks: also return every point's trajectory
+            backend, max_edge: see open_video
         RETURNS:
-            A Pandas DataFrame with feature point coordinates
+            A Pandas DataFrame with feature point coordinates. If
+            return_tracks is set, a tuple of the DataFrame and the
+            trajectories from FlowTracker.get_trajectories.
 
-        TODO: Implement stride
         NOTE: Should the distance calculation be done here?
         NOTE: SHould the direction calculation be done here?
         """
-        # params for ShiTomasi corner detection
-        feature_params = dict( maxCorners = 50,
-                                qualityLevel = 0.5,
-                                minDistance = 10,
-                                blockSize = 7 )
-
-        # Parameters for lucas kanade optical flow
-        lk_params = dict( winSize  = (15,15),
-                          maxLevel = 5,
-                          criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        from flow_tracker import FlowTracker
+        tracker = FlowTracker(preprocess=preprocess,
+                              redetect_fraction=redetect_fraction,
+                              record_tracks=return_tracks)
 
         # Take first frame and find corners in it
         # cap.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, start_frame)
-        cap = cv2.VideoCapture(video)
-        ret, frame = cap.read()
-        frame_series = pd.Series()
-        frame_series['time'] = cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000.
-
-        ## Ensure frame is in a standardized format
-        if preprocess:
-            frame = VideoUtilities._img_preprocess(frame)
-        ## Find feature points to track across frames
-        p0 = cv2.goodFeaturesToTrack(frame, mask = None, **feature_params)
+        cap = VideoUtilities.open_video(video, backend, max_edge)
+        ret, frame = VideoUtilities.read_frame(cap, max_edge)
+        if not preprocess:
+            frame = frame.get_image()
+        tracker.update(frame, frame_number=0)
 
-        ## Output dataframe
-        flow_df = pd.DataFrame()
+        ## Output rows, turned into a dataframe at the end
+        rows = []
 
         num_frames = cap.get(cv2.cv.CV_CAP_PROP_FRAME_COUNT)
         i_frame = 0
-        while i_frame < num_frames:
-            if i_frame % 100 == 0:
+        while i_frame + stride < num_frames:
+            if i_frame % 100 < stride:
                 print i_frame
 
-            prev_frame = frame.copy()
-            ret,frame = cap.read()
+            ## Skip to the next frame of the pair without decoding
+            for _ in range(stride - 1):
+                cap.grab()
+            ret,frame = VideoUtilities.read_frame(cap, max_edge)
             ## If there are no more frames, break out of loop
             if ret == False:
                 break
-
-            if preprocess:
-                frame = VideoUtilities._img_preprocess(frame)
+            if not preprocess:
+                frame = frame.get_image()
+            i_frame += stride
 
             # calculate optical flow if feature points exist
-            if p0 is not None:
-                p1, st, err = cv2.calcOpticalFlowPyrLK(prev_frame, frame, p0, None, **lk_params)
+            pts = tracker.update(frame, frame_number=i_frame)
+            if pts is not None:
+                p0, p1, st, err = pts
+                p0, p1 = p0.reshape(-1, 1, 2), p1.reshape(-1, 1, 2)
+                st, err = st.reshape(-1, 1), err.reshape(-1, 1)
             else:
-                p1, st, err = (None, None, None)
+                p0, p1, st, err = (None, None, None, None)
 
             # Store the result
-            frame_series = pd.Series()
-            frame_series['time'] = cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000.
-            #frame_series['frame_number'] = cap.get(cv2.cv.
-            frame_series['pt_pos(t)'] = p1      ## Current position of feature points
-            frame_series['pt_pos(t-1)'] = p0    ## Previous position of feature points
-            frame_series['st'] = st
-            frame_series['err'] = err
-            flow_df = flow_df.append(frame_series, ignore_index=True)
-
-            # This has the effect of resetting the points to track
-            p0 = cv2.goodFeaturesToTrack(frame, mask = None, **feature_params)
-            i_frame += 1
-
+            rows.append({'time': cap.get(cv2.cv.CV_CAP_PROP_POS_MSEC) / 1000.,
+                         'pt_pos(t)': p1,       ## Current position of feature points
+                         'pt_pos(t-1)': p0,     ## Previous position of feature points
+                         'st': st,
+                         'err': err})
+
+        print "-I- Corner detections: %d, avoided: %d" % \
+            (tracker.num_detections, tracker.num_detections_avoided)
+
+        flow_df = pd.DataFrame(rows, columns=['time', 'pt_pos(t)',
+                                              'pt_pos(t-1)', 'st', 'err'])
+        if return_tracks:
+            return flow_df, tracker.get_trajectories()
         return flow_df
 
     @staticmethod
@@ -149,110 +348,170 @@ class VideoUtilities():
         RETURNS:
             Returns a Pandas DataFrame with feature point coordinates
         """
-        # params for ShiTomasi corner detection
-        feature_params = dict( maxCorners = 50,
-                                qualityLevel = 0.5,
-                                minDistance = 10,
-                                blockSize = 7 )
+        pts = VideoUtilities.flow_points(frame, prev_frame, preprocess)
+        # Check that optical flow was able to track points
+        if pts is None:
+            return pd.DataFrame()
+
+        # Store the result as one point per row (see FlowPreprocess.FLOW_SCHEMA)
+        p0, p1, st, err = pts
+        flow_df = pd.DataFrame({'x0': p0[:, 0],     ## Previous position of feature points
+                                'y0': p0[:, 1],
+                                'x1': p1[:, 0],     ## Current position of feature points
+                                'y1': p1[:, 1],
+                                'flow_st': st.astype(np.uint8),
+                                'flow_err': err.astype(np.float32)},
+                               columns=['x0', 'y0', 'x1', 'y1',
+                                        'flow_st', 'flow_err'])
+        return flow_df
 
-        # Parameters for lucas kanade optical flow
-        lk_params = dict( winSize  = (15,15),
-                          maxLevel = 5,
-                          criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+    @staticmethod
+    def flow_points(frame, prev_frame, preprocess=True):
+        """
+        Track corners from prev_frame into frame and return the raw
+        Lucas-Kanade arrays, flattened to one row per point.
 
+        ARGS:
+            frame: current frame, or its FrameContext
+            prev_frame: previous frame, or its FrameContext
+            preprocess: whether frames need to be put into standardized
+                        format
+        RETURNS:
+            Tuple of (p0, p1, st, err) arrays with shapes (n, 2), (n, 2),
+            (n,), (n,), or None if no feature points were found
+        """
         ## Ensure frame is in a standardized format
         if preprocess:
             frame = VideoUtilities._img_preprocess(frame)
             prev_frame = VideoUtilities._img_preprocess(prev_frame)
         ## Find feature points to track across frames
-        p0 = cv2.goodFeaturesToTrack(prev_frame, mask = None, **feature_params)
+        p0 = cv2.goodFeaturesToTrack(prev_frame, mask = None, **VideoUtilities.FEATURE_PARAMS)
+        if p0 is None:
+            return None
 
-        # calculate optical flow if feature points exist
-        if p0 is not None:
-            p1, st, err = cv2.calcOpticalFlowPyrLK(prev_frame, frame, p0, None, **lk_params)
-        else:
-            p1, st, err = (None, None, None)
+        p1, st, err = cv2.calcOpticalFlowPyrLK(prev_frame, frame, p0, None, **VideoUtilities.LK_PARAMS)
+        return (p0.reshape(-1, 2), p1.reshape(-1, 2),
+                st.reshape(-1), err.reshape(-1))
 
-        ## Output dataframe
-        flow_df = pd.DataFrame()
+    @staticmethod
+    def _get_flow_distances(flow_df):
+        """
+        Find the distance each successfully tracked (st == 1) optical flow
+        point has moved between frames, as one flat ragged array: frame i's
+        distances are distances[offsets[i]:offsets[i + 1]].
 
-        # Check that optical flow was able to track points
-        if p0 is not None:
-            # Store the result as one point per row
-            for pt0_array, pt1_array, st_array, err_array in zip(p0, p1, st, err):
-                ## Cleaning up messy nested arrays
-                pt0 = pt0_array[0]
-                pt1 = pt1_array[0]
-                pt_st = st_array[0]       ## per point st
-                pt_err = err_array[0]     ## per point err
-
-                frame_series = pd.Series()
-                frame_series['flow_pt_pos(t)'] = pt1      ## Current position of feature points
-                frame_series['flow_pt_pos(t-1)'] = pt0    ## Previous position of feature points
-                frame_series['flow_st'] = pt_st
-                frame_series['flow_err'] = pt_err
-                flow_df = flow_df.append(frame_series, ignore_index=True)
-            # Return default values when optical flow is not successful
+        ARGS:
+            flow_df - pandas DataFrame, either with one row per frame (as
+                      returned by optical_flow) or with one row per point
+                      (see FlowPreprocess.FLOW_SCHEMA)
+        RETURNS:
+            Tuple of (distances, offsets, frame rows). For one row per
+            point, frame rows is the first row of each frame_number,
+            in frame order; otherwise it is None.
+        """
+        if 'x0' in flow_df.columns:
+            order = np.argsort(flow_df['frame_number'].values, kind='mergesort')
+            frame_numbers = flow_df['frame_number'].values[order]
+            found = flow_df['flow_st'].values[order] == 1
+            dx = flow_df['x1'].values[order] - flow_df['x0'].values[order]
+            dy = flow_df['y1'].values[order] - flow_df['y0'].values[order]
+            starts = np.flatnonzero(np.r_[True, frame_numbers[1:] != frame_numbers[:-1]])
+            if len(frame_numbers) == 0:
+                starts = starts[:0]
+            ## Number of tracked points in each frame
+            counts = np.add.reduceat(found.astype(np.int64), starts) if len(starts) else starts
+            frame_rows = order[starts]
+        else:
+            ## One row per frame; frames without points hold None
+            num_points = np.array([len(st) if st is not None else 0
+                                   for st in flow_df['st']], dtype=np.int64)
+            has_points = num_points > 0
+            if has_points.any():
+                st = np.concatenate([np.ravel(x) for x in flow_df['st'][has_points]])
+                p1 = np.concatenate([np.reshape(x, (-1, 2)) for x in flow_df['pt_pos(t)'][has_points]])
+                p0 = np.concatenate([np.reshape(x, (-1, 2)) for x in flow_df['pt_pos(t-1)'][has_points]])
             else:
-                frame_series = pd.Series()
-                frame_series['flow_pt_pos(t)'] = None      ## Current position of feature points
-                frame_series['flow_pt_pos(t-1)'] = None    ## Previous position of feature points
-                frame_series['flow_st'] = None
-                frame_series['flow_err'] = None
-
-        return flow_df
+                st, p1, p0 = np.empty(0), np.empty((0, 2)), np.empty((0, 2))
+            found = st == 1
+            dx, dy = p1[:, 0] - p0[:, 0], p1[:, 1] - p0[:, 1]
+            frame_ids = np.repeat(np.arange(len(num_points)), num_points)
+            counts = np.bincount(frame_ids[found], minlength=len(num_points))
+            frame_rows = None
 
+        distances = np.hypot(dx[found].astype(np.float64), dy[found].astype(np.float64))
+        offsets = np.r_[0, np.cumsum(counts)].astype(np.int64)
+        return distances, offsets, frame_rows
 
     @staticmethod
-    def _get_flow_distances(flow_df):
+    def _segment_stats(values, offsets):
         """
-        Find the distance each optical flow point has moved between frames
+        Mean, median, standard deviation and count of each segment of a
+        flat ragged array, with vectorized segment reductions. Empty
+        segments get NaN statistics and a count of 0.
 
         ARGS:
-            flow_df - pandas DataFrame
+            values: flat float array
+            offsets: segment i is values[offsets[i]:offsets[i + 1]]
         RETURNS:
-            Returns a pandas DataFrame with the distance each optical flow
-            point traveled between frames.
-        """
-        dist_df = pd.DataFrame()
-        output = []
-        for pts1, pts0, st in zip(flow_df['pt_pos(t)'], flow_df['pt_pos(t-1)'], flow_df['st']):
-            dist_list = []
-            try:
-                for p1, p0, found in zip(pts1, pts0, st):
-                    if found == 1:
-                        dist = np.sqrt((p1[0][0] - p0[0][0])**2 + (p1[0][1] - p0[0][1])**2)
-                        dist_list.append(dist)
-                    else:
-                        # TODO: Need to handle this better... probably by saving an st array
-                        dist = None
-                        # dist_list.append(None)
-                output.append(dist_list)
-            except:
-                output.append(None)
-
-        dist_df['dists'] = np.array(output)
-        return dist_df
+            Dictionary of per-segment numpy arrays: 'dist_mean',
+            'dist_median', 'dist_dev' (float64) and 'dist_count' (int64)
+        """
+        counts = np.diff(offsets)
+        num_segments = len(counts)
+        nonempty = counts > 0
+        starts = offsets[:-1][nonempty]
+
+        mean = np.empty(num_segments)
+        mean.fill(np.nan)
+        dev = mean.copy()
+        median = mean.copy()
+        if len(starts):
+            mean[nonempty] = np.add.reduceat(values, starts) / counts[nonempty]
+            segment_ids = np.repeat(np.arange(num_segments), counts)
+            squares = (values - mean[segment_ids]) ** 2
+            dev[nonempty] = np.sqrt(np.add.reduceat(squares, starts) / counts[nonempty])
+
+            ## Sort within segments, then take the middle value(s)
+            ordered = values[np.lexsort((values, segment_ids))]
+            c = counts[nonempty]
+            lower = ordered[starts + (c - 1) // 2]
+            upper = ordered[starts + c // 2]
+            median[nonempty] = (lower + upper) / 2.
+
+        return {'dist_mean': mean,
+                'dist_median': median,
+                'dist_dev': dev,
+                'dist_count': counts.astype(np.int64)}
 
     @staticmethod
     def get_dist_stats(flow_df):
         """
-        Calculates per-frame summary stats for optical flow distances
+        Calculates per-frame summary stats for optical flow distances, over
+        the points that were tracked successfully (st == 1)
 
         ARGS:
-            flow_df: dataframe of optical flow analysis
+            flow_df: dataframe of optical flow analysis, in either layout
+                     accepted by _get_flow_distances
         RETURNS:
-            Returns dataframe with statistics appended
+            Per-frame dataframe with 'dist_mean', 'dist_median',
+            'dist_dev' and 'dist_count'. For one row per frame, these are
+            appended to a copy of flow_df. For one row per point, the
+            table has one row per frame_number, with its 'frame_number'
+            and 'time'.
         """
-        out_df = flow_df.copy()
-        col = distances_column_name
+        distances, offsets, frame_rows = VideoUtilities._get_flow_distances(flow_df)
+        stats = VideoUtilities._segment_stats(distances, offsets)
+        columns = ['dist_mean', 'dist_median', 'dist_dev', 'dist_count']
 
-        out_df['dist_mean'] = flow_df[col].apply(lambda x: np.mean(x) if x is not None else None)
-        out_df['dist_median'] = flow_df[col].apply(lambda x: np.median(x) if x is not None and len(x) > 0 else None) #[np.median(d) if len(d) > 0 else 0 for d in distances]
-        out_df['dist_dev'] = flow_df[col].apply(lambda x: np.std(x) if x is not None else None) #[np.std(d) if len(d) > 0 else 0 for d in distances]
-        out_df['dist_count'] = flow_df[col].apply(lambda x: len(x) if x is not None else None)# [len(d) for d in distances]
+        if frame_rows is None:
+            out_df = flow_df.copy()
+            for col in columns:
+                out_df[col] = stats[col]
+            return out_df
 
-        return out_df
+        stats['frame_number'] = flow_df['frame_number'].values[frame_rows]
+        stats['time'] = flow_df['time'].values[frame_rows]
+        return pd.DataFrame(stats, columns=['frame_number', 'time'] + columns)
 
     @staticmethod
     def _get_flow_directions(flow_df):
@@ -286,17 +545,18 @@ class VideoUtilities():
         and Gaussian blurring.
 
         ARGS:
-            frame: a single frame of video to be pre-processed
+            frame: a single frame of video to be pre-processed, or its
+                   FrameContext
         RETURNS:
             A dataframe of the preprocessed image.
         """
-        processed = frame.copy()
-        # Convert to grayscale to eliminate auto-adjustment artifacts
-        processed = cv2.cvtColor(processed, cv2.COLOR_BGR2GRAY)
-        # Blur to reduce spurious (minor) image artifacts
-        processed = cv2.GaussianBlur(processed, (15,15), 0)
-        # TODO: Think about resizing image for faster processing
-        return processed
+        # Convert to grayscale to eliminate auto-adjustment artifacts, then
+        # blur to reduce spurious (minor) image artifacts
+        if not isinstance(frame, FrameContext):
+            frame = FrameContext(frame)
+        # NOTE: frames are downscaled by the FrameContext if it has a
+        #       max_edge
+        return frame.get_blurred_gray()
 
 if __name__ == "__main__":
     pass